@@ -24,7 +24,7 @@ def plot_hits(hist, extent):
     P.colorbar()
     return f
     
-def test_case(focus, num_rays=100, h_depth=0.7, side=0.4):
+def test_case(focus, num_rays=100, h_depth=0.7, side=0.4, light_pipe=False):
     # Case parameters (to be moved out:
     D = 5.
     
@@ -35,10 +35,15 @@ def test_case(focus, num_rays=100, h_depth=0.7, side=0.4):
     ang_range = 0.005
     
     iterate = 100
+    if light_pipe:
+        # The light pipe reflects rays all the way through the homogenizer in
+        # one iteration, so few are needed:
+        iterate = 5
     min_energy = 1e-6
     
     # Model:
-    assembly = MiniDish(D, focus, 0.9, focus + h_depth, side, h_depth, 0.9)
+    assembly = MiniDish(D, focus, 0.9, focus + h_depth, side, h_depth, 0.9,
+        light_pipe=light_pipe)
     assembly.set_transform(rotx(-N.pi/4))
     
     # Rays:
@@ -69,7 +74,9 @@ if __name__ == '__main__':
         help="Homogenizer depth, default %default")
     parser.add_option('--receiver-side', '-s', dest='side', type='float', default=0.4,
         help="Side of square receiver area, default %default")
+    parser.add_option('--light-pipe', dest='light_pipe', action='store_true',
+        default=False, help="Trace the homogenizer as an unfolded light pipe")
     opts, pos = parser.parse_args()
     
-    test_case(opts.foc, opts.num_rays, opts.hdepth, opts.side)
+    test_case(opts.foc, opts.num_rays, opts.hdepth, opts.side, opts.light_pipe)
     P.show()
@@ -0,0 +1,107 @@
+"""
+Test aim point strategies from superposed heliostat flux images.
+"""
+
+import unittest
+import numpy as N
+
+from tracer.assembly import Assembly
+from tracer.tracer_engine import TracerEngine
+from tracer.spatial_geometry import roty
+from tracer.random_streams import RandomStream
+from tracer.models.one_sided_mirror import one_sided_receiver
+from tracer.models.heliostat_field import HeliostatField, field_bundle
+from tracer.models.aimpoints import FluxImages, trace_flux_images, \
+    optimize_aimpoints
+
+class TestFluxImages(unittest.TestCase):
+    def test_superposition(self):
+        """The flux is the weighted sum of the images"""
+        images = N.random.uniform(size=(3, 2, 4, 5))
+        fimg = FluxImages(images, 2., 1.)
+        N.testing.assert_array_almost_equal(fimg.flux(N.r_[0, 1, 1]),
+            images[0,0] + images[1,1] + images[2,1])
+        N.testing.assert_array_almost_equal(
+            fimg.flux(N.tile([0.5, 0.5], (3, 1))),
+            images.sum(axis=0).sum(axis=0)/2.)
+        self.assertAlmostEqual(fimg.get_pixel_area(), 0.1)
+
+    def test_optimize(self):
+        """Spreading heliostats over offsets lowers the peak"""
+        # Each offset lights one pixel:
+        images = N.zeros((6, 3, 1, 3))
+        images[:,N.r_[0, 1, 2],0,N.r_[0, 1, 2]] = 1.
+        fimg = FluxImages(images, 3., 1.)
+
+        assignment = optimize_aimpoints(fimg)
+        N.testing.assert_array_equal(fimg.flux(assignment), [[2., 2., 2.]])
+        assignment = optimize_aimpoints(fimg, peak_limit=4.)
+        N.testing.assert_array_equal(N.sort(fimg.flux(assignment)[0]),
+            [0., 2., 4.])
+
+class TestFieldImages(unittest.TestCase):
+    def setUp(self):
+        pos = N.zeros((4, 3))
+        pos[:,0] = N.r_[20., 30., 40., 50.]
+        pos[:,1] = N.r_[-3., 3., -3., 3.]
+        self.field = HeliostatField(pos, 2., 2., 0., 20., contributors=True)
+
+        self.rec_surf, rec_obj = one_sided_receiver(4., 4.)
+        rec_trans = roty(N.pi/2)
+        rec_trans[2,3] = 20.
+        rec_obj.set_transform(rec_trans)
+        self.plant = Assembly(objects=[rec_obj], subassemblies=[self.field])
+
+        self.offsets = N.c_[N.zeros(3), N.zeros(3), N.r_[0., -1., 1.]]
+        self.sun = (N.pi/2, N.pi/4)
+        self.images = trace_flux_images(self.field, self.plant, self.rec_surf,
+            4., 4., self.offsets, self.sun[0], self.sun[1], 500, 0.00465,
+            (8, 8), prng=RandomStream(5))
+
+    def trace(self, assignment, prng):
+        """Flux image of a full trace of the field aimed by an assignment"""
+        self.field.aim_to_sun(self.sun[0], self.sun[1],
+            self.offsets[assignment])
+        rays = field_bundle(self.field, 500, self.sun[0], self.sun[1], 1.,
+            0.00465, prng=prng)
+        TracerEngine(self.plant).ray_tracer(rays, 100, 1e-9, tree=False)
+
+        optics = self.rec_surf.get_optics_manager()
+        energy, hits = optics.get_all_hits()
+        optics.reset()
+        # The receiver's local x is the global -z, and its y the global y:
+        return N.histogram2d(hits[1], 20. - hits[2], bins=(8, 8),
+            weights=energy, range=[[-2., 2.], [-2., 2.]])[0]/0.25
+
+    def test_same_offset(self):
+        """The images sum to the flux of a full trace"""
+        N.testing.assert_array_almost_equal(
+            self.images.flux(N.zeros(4, dtype=N.int_)),
+            self.trace(N.zeros(4, dtype=N.int_),
+                RandomStream(5).spawn(0).spawn(0)))
+
+    def test_mixed_offsets(self):
+        """A mixed strategy's flux is found without tracing it"""
+        assignment = N.r_[1, 2, 0, 1]
+        traced = self.trace(assignment, RandomStream(6))
+        self.assertAlmostEqual(self.images.intercepted(assignment)/
+            (traced.sum()*0.25), 1., 1)
+
+    def test_untagged_field(self):
+        """Images can only be split from a field that tags contributors"""
+        field = HeliostatField(N.zeros((1, 3)), 2., 2., 0., 20.)
+        self.assertRaises(ValueError, trace_flux_images, field, self.plant,
+            self.rec_surf, 4., 4., self.offsets, self.sun[0], self.sun[1], 10,
+            0.00465, (8, 8))
+
+    def test_offset_images(self):
+        """Images move on the receiver with the aim point offset"""
+        # Centroids along the receiver's x axis, which points down:
+        images = self.images.get_images().sum(axis=2)
+        centroids = N.sum(images*N.r_[-1.75:2:0.5], axis=2)/images.sum(axis=2)
+        N.testing.assert_array_almost_equal(centroids[:,0], 0., 1)
+        self.failUnless(N.all(centroids[:,1] > 0.5))
+        self.failUnless(N.all(centroids[:,2] < -0.5))
+
+if __name__ == '__main__':
+    unittest.main()
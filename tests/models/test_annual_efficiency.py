@@ -0,0 +1,108 @@
+"""
+Test the annual efficiency table of a plant.
+"""
+
+import unittest
+import numpy as N
+
+from tracer.assembly import Assembly
+from tracer.spatial_geometry import roty
+from tracer.models.one_sided_mirror import one_sided_receiver
+from tracer.models.heliostat_field import HeliostatField
+from tracer.models.annual_efficiency import sun_position, EfficiencyTable, \
+    efficiency_table, field_is_symmetric, field_evaluator
+
+class TestSunPosition(unittest.TestCase):
+    def test_solstice(self):
+        """At the summer solstice noon the sun is south, 23.45 deg high"""
+        lat = N.radians(32.)
+        az, elev = sun_position(172, 12., lat)
+        self.assertAlmostEqual(az, N.pi/2)
+        self.assertAlmostEqual(elev, lat - N.radians(23.45), 3)
+
+    def test_afternoon(self):
+        """The afternoon mirrors the morning about the south"""
+        az, elev = sun_position(80, N.r_[9., 15.], N.radians(40.))
+        self.assertAlmostEqual(az[0] + az[1], N.pi)
+        self.assertAlmostEqual(elev[0], elev[1])
+
+class TestEfficiencyTable(unittest.TestCase):
+    def setUp(self):
+        self.azims = N.linspace(0, 2*N.pi, 9)
+        self.elevs = N.linspace(0, N.pi/2, 4)
+        self.calls = []
+
+    def evaluate(self, az, elev, prng):
+        self.calls.append((az, elev))
+        return N.cos(elev)*(1 + 0.1*N.sin(az)*N.sin(elev))
+
+    def test_interpolation(self):
+        """A bilinear function is interpolated exactly"""
+        effs = 1 + N.outer(self.azims, 2*self.elevs)
+        table = EfficiencyTable(self.azims, self.elevs, effs)
+        az = N.r_[0.3, 2., 6.]
+        elev = N.r_[0.1, 1., 1.5]
+        N.testing.assert_array_almost_equal(table(az, elev), 1 + 2*az*elev)
+        # Edges extend out of the table:
+        self.assertAlmostEqual(table(1., 2.), 1 + N.pi)
+
+    def test_symmetry(self):
+        """Mirrored and zenith positions are traced once"""
+        table = efficiency_table(self.evaluate, self.azims, self.elevs,
+            mirror_azimuth=N.pi/2, processes=1)
+        expected = N.cos(self.elevs)*(1 + \
+            0.1*N.sin(self.azims[:,None])*N.sin(self.elevs))
+        N.testing.assert_array_almost_equal(table.get_efficiencies(),
+            expected)
+
+        # 5 distinct azimuth classes for 3 elevations, and the zenith:
+        self.failUnlessEqual(len(self.calls), 16)
+
+    def test_night(self):
+        """No efficiency when the sun is down"""
+        table = EfficiencyTable(self.azims, self.elevs,
+            N.ones((len(self.azims), len(self.elevs))))
+        N.testing.assert_array_equal(
+            table.at_times(172, N.r_[2., 12., 22.], N.radians(32.)), [0, 1, 0])
+
+class TestFieldEfficiency(unittest.TestCase):
+    def setUp(self):
+        spread = N.r_[20:41:10]
+        pos = N.zeros((2*len(spread), 3))
+        pos[:len(spread), 0] = spread
+        pos[len(spread):, 0] = spread
+        pos[:len(spread), 1] = 5.
+        pos[len(spread):, 1] = -5.
+        self.pos = pos
+        self.field = HeliostatField(pos, 2., 2., 0., 20.)
+
+        rec_surf, rec_obj = one_sided_receiver(6., 6.)
+        self.receiver = rec_surf.get_optics_manager()
+        rec_trans = roty(N.pi/2)
+        rec_trans[2,3] = 20.
+        rec_obj.set_transform(rec_trans)
+        self.plant = Assembly(objects=[rec_obj], subassemblies=[self.field])
+
+    def test_symmetric(self):
+        """The field is symmetric about the north-south plane"""
+        self.failUnless(field_is_symmetric(self.pos, N.pi/2))
+        self.failIf(field_is_symmetric(self.pos, 0.))
+
+    def test_parallel(self):
+        """Parallel tables are identical to serial ones"""
+        evaluate = field_evaluator(self.field, self.plant, self.receiver, 50,
+            0.00465)
+        azims = N.r_[N.pi/4:3*N.pi/4 + 0.1:N.pi/4]
+        elevs = N.r_[0.2, 0.6]
+        tables = [efficiency_table(evaluate, azims, elevs, N.pi/2, 7,
+            processes) for processes in (1, 2)]
+        N.testing.assert_array_equal(tables[0].get_efficiencies(),
+            tables[1].get_efficiencies())
+
+        # Mirror images, and the receiver catches most of the light:
+        effs = tables[0].get_efficiencies()
+        N.testing.assert_array_equal(effs[0], effs[2])
+        self.failUnless(N.all(effs > 0.5) and N.all(effs < 1.))
+
+if __name__ == '__main__':
+    unittest.main()
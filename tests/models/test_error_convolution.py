@@ -0,0 +1,106 @@
+"""
+Test the convolution of flux maps with optical error kernels.
+"""
+
+import unittest
+import numpy as N
+
+from tracer.ray_bundle import RayBundle
+from tracer.tracer_engine import TracerEngine
+from tracer.models.tau_minidish import MiniDish
+from tracer.models.error_convolution import gaussian_pdf, project_kernel, \
+    convolve_sweep, convolve_flux
+
+class TestKernel(unittest.TestCase):
+    def test_gaussian(self):
+        """A Gaussian kernel is centered, normalized and of the right width"""
+        kernel = project_kernel(gaussian_pdf(0.01), 0.05, 10., (0.05, 0.1))
+        self.failUnlessEqual(kernel.shape, (21, 11))
+        self.assertAlmostEqual(kernel.sum(), 1.)
+        self.failUnlessEqual(N.unravel_index(N.argmax(kernel), kernel.shape),
+            (10, 5))
+
+        xs = (N.arange(21) - 10)*0.05
+        var = N.sum(kernel.sum(axis=1)*xs**2)
+        self.assertAlmostEqual(N.sqrt(var), 0.1, 2)
+
+    def test_narrow(self):
+        """A kernel narrower than a pixel is a single pixel"""
+        kernel = project_kernel(gaussian_pdf(1e-4), 4e-4, 10., (0.1, 0.1))
+        N.testing.assert_array_equal(kernel, [[1.]])
+
+class TestConvolution(unittest.TestCase):
+    def setUp(self):
+        self.flux = N.random.RandomState(0).rand(12, 9)
+        self.kernel = project_kernel(gaussian_pdf(0.02), 0.06, 1., (0.01,
+            0.02))
+
+    def test_direct(self):
+        """FFT convolution equals the direct sum"""
+        hx, hy = N.array(self.kernel.shape)//2
+        padded = N.pad(self.flux, ((hx, hx), (hy, hy)), 'constant')
+        direct = N.empty_like(self.flux)
+        flipped = self.kernel[::-1,::-1]
+        for i in xrange(self.flux.shape[0]):
+            for j in xrange(self.flux.shape[1]):
+                direct[i,j] = N.sum(padded[i:i + 2*hx + 1, j:j + 2*hy + 1]* \
+                    flipped)
+        N.testing.assert_array_almost_equal(
+            convolve_flux(self.flux, self.kernel), direct)
+
+    def test_delta(self):
+        """A point of flux spreads to the kernel"""
+        flux = N.zeros((15, 15))
+        flux[7,7] = 2.
+        conv = convolve_flux(flux, self.kernel)
+        hx, hy = N.array(self.kernel.shape)//2
+        N.testing.assert_array_almost_equal(
+            conv[7 - hx:8 + hx, 7 - hy:8 + hy], 2*self.kernel)
+        self.assertAlmostEqual(conv.sum(), 2.)
+
+    def test_boundary(self):
+        """Reflected edges keep the energy, filled edges lose it"""
+        filled = convolve_flux(self.flux, self.kernel)
+        reflected = convolve_flux(self.flux, self.kernel, 'reflect')
+        self.failUnless(filled.sum() < self.flux.sum())
+        self.assertAlmostEqual(reflected.sum(), self.flux.sum())
+
+        uniform = N.ones((6, 6))
+        N.testing.assert_array_almost_equal(
+            convolve_flux(uniform, self.kernel, 'reflect'), uniform)
+
+    def test_sweep(self):
+        """A sweep gives each kernel's convolution"""
+        kernels = [self.kernel, project_kernel(gaussian_pdf(0.01), 0.03, 1.,
+            (0.01, 0.02))]
+        for boundary in ('fill', 'reflect'):
+            swept = convolve_sweep(self.flux, kernels, boundary)
+            for kernel, conv in zip(kernels, swept):
+                N.testing.assert_array_almost_equal(conv,
+                    convolve_flux(self.flux, kernel, boundary))
+
+class TestHomogenizedReceiver(unittest.TestCase):
+    def test_minidish(self):
+        """Slope errors spread the flux of a traced dish"""
+        md = MiniDish(5, 5, 0.9, 5.7, .4, 0.7, 0.9)
+        pos = N.zeros((3, 5))
+        pos[0] = N.r_[-2:2:5j]
+        pos[2] = 6.
+        dirs = N.zeros((3, 5))
+        dirs[2] = -1.
+        bund = RayBundle(pos, dirs, energy=N.ones(5)*100,
+            ref_index=N.ones(5))
+        TracerEngine(md).ray_tracer(bund, 100, 0.05)
+
+        H, xbins, ybins = md.histogram_hits(10)
+        Hs, xb, yb = md.histogram_with_errors([0.001, 0.01], 10)
+        N.testing.assert_array_equal(xb, xbins)
+        self.failUnlessEqual(len(Hs), 2)
+        for conv in Hs:
+            self.failUnlessEqual(conv.shape, H.shape)
+            self.assertAlmostEqual(conv.sum(), H.sum())
+        # Larger errors spread the energy further from the peak:
+        self.failUnless(Hs[1].max() < Hs[0].max() <= H.max())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Test the analytic flux model of heliostat fields.
+"""
+
+import unittest
+import numpy as N
+
+from tracer.assembly import Assembly
+from tracer.spatial_geometry import roty
+from tracer.random_streams import RandomStream
+from tracer.models.one_sided_mirror import one_sided_receiver
+from tracer.models.heliostat_field import HeliostatField, radial_stagger, \
+    solar_vector
+from tracer.models.layout_optimizer import attenuation
+from tracer.models.hflcal import hflcal_flux, compare_to_trace
+
+class TestHFLCAL(unittest.TestCase):
+    def setUp(self):
+        xy = radial_stagger(-N.pi/8, N.pi/8, N.pi/64, 300, 400, 20)
+        self.pos = N.c_[xy, N.tile(2., len(xy))]
+        self.field = HeliostatField(self.pos, 2., 2., 0., 100., grid=True)
+        self.sun = (N.pi/2, N.pi/4)
+        self.field.aim_to_sun(*self.sun)
+
+        self.rec_surf, rec_obj = one_sided_receiver(8., 8.)
+        self.rec_frame = roty(N.pi/2)
+        self.rec_frame[2,3] = 100.
+        rec_obj.set_transform(self.rec_frame)
+        self.plant = Assembly(objects=[rec_obj], subassemblies=[self.field])
+
+    def test_power(self):
+        """A large receiver gets all of each heliostat's power"""
+        images = hflcal_flux(self.field, self.sun[0], self.sun[1],
+            self.rec_frame, 30., 30., (60, 60), dni=800., per_heliostat=True)
+        self.failUnlessEqual(images.shape, (len(self.pos), 60, 60))
+
+        tower = N.r_[0., 0., 100.] - self.pos
+        dist = N.sqrt(N.sum(tower**2, axis=1))
+        cos_inc = N.dot(self.field.get_heliostat_frames()[:,:3,2],
+            solar_vector(*self.sun))
+        N.testing.assert_allclose(images.sum(axis=2).sum(axis=1)*0.25,
+            800.*4.*cos_inc*attenuation(dist), rtol=1e-3)
+
+        N.testing.assert_array_almost_equal(images.sum(axis=0),
+            hflcal_flux(self.field, self.sun[0], self.sun[1], self.rec_frame,
+                30., 30., (60, 60), dni=800.))
+
+    def test_back(self):
+        """A receiver facing away gets nothing"""
+        back = N.dot(self.rec_frame, roty(N.pi))
+        N.testing.assert_array_equal(hflcal_flux(self.field, self.sun[0],
+            self.sun[1], back, 8., 8., (4, 4)), 0.)
+
+    def test_trace(self):
+        """The model agrees with a trace of far heliostats"""
+        model, traced, rms, power_ratio = compare_to_trace(self.field,
+            self.plant, self.rec_surf, 8., 8., (16, 16), self.sun[0],
+            self.sun[1], 2000, 0.00465, prng=RandomStream(1))
+        self.failUnlessEqual(model.shape, (16, 16))
+        self.assertAlmostEqual(power_ratio, 1., 1)
+        self.failUnless(rms < 0.1)
+
+if __name__ == '__main__':
+    unittest.main()
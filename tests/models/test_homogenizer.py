@@ -2,7 +2,11 @@
 import unittest
 import numpy as N
 
-from tracer.models.homogenizer import rect_homogenizer
+from tracer.models.homogenizer import rect_homogenizer, light_pipe, \
+    unfold_pipe
+from tracer.models.one_sided_mirror import one_sided_receiver
+from tracer.assembly import Assembly
+from tracer.spatial_geometry import rotx
 from tracer.ray_bundle import RayBundle
 from tracer.tracer_engine import TracerEngine
 
@@ -40,3 +44,59 @@ class TestHomogenizer(unittest.TestCase):
             [0, -1.5, 9.5]]
         N.testing.assert_array_almost_equal(v, out_hits)
     
+
+class TestLightPipe(unittest.TestCase):
+    def test_unfold(self):
+        """Rays are folded back into the pipe after each wall"""
+        verts = N.c_[[0, 0, 10], [0, 0, 10], [0, 0, 10], [0, 0, 10]]
+        dirs = N.c_[[1, 0, -1], [-1, 0, -1], [0, 1, -1], [1, 1, -1]]/N.r_[
+            N.sqrt(2), N.sqrt(2), N.sqrt(2), N.sqrt(3)]
+        exits, exit_dirs, bounces, last = unfold_pipe(verts, dirs, 5., 3.)
+        
+        N.testing.assert_array_equal(bounces, [2, 2, 3, 5])
+        N.testing.assert_array_almost_equal(exits, N.c_[
+            [0, 0, 0], [0, 0, 0], [0, -1, 0], [0, -1, 0]])
+        N.testing.assert_array_almost_equal(exit_dirs,
+            dirs*N.c_[[1, 1, 1], [1, 1, 1], [1, -1, 1], [1, -1, 1]])
+        N.testing.assert_array_almost_equal(last, N.c_[
+            [-2.5, 0, 2.5], [2.5, 0, 2.5], [0, 1.5, 2.5], [-2.5, 1.5, 2.5]])
+    
+    def test_same_as_mirrors(self):
+        """The light pipe delivers rays like the homogenizer's mirrors"""
+        prng = N.random.RandomState(0)
+        pos = N.vstack((prng.uniform(-2.5, 2.5, 50), prng.uniform(-1.5, 1.5,
+            50), N.ones(50)*10.))
+        dirs = N.vstack((prng.uniform(-1, 1, (2, 50)), -N.ones(50)))
+        dirs /= N.sqrt(N.sum(dirs**2, axis=0))
+        
+        results = []
+        rec, rec_obj = one_sided_receiver(5., 3.)
+        rec_obj.set_transform(rotx(N.pi))
+        for plant in (
+                Assembly(objects=[rec_obj],
+                    subassemblies=[rect_homogenizer(5., 3., 10., 0.9)]),
+                Assembly(objects=[rec_obj, light_pipe(5., 3., 10., 0.9)])):
+            rec.get_optics_manager().reset()
+            engine = TracerEngine(plant)
+            bund = RayBundle(pos, dirs, energy=N.ones(50),
+                ref_index=N.ones(50))
+            engine.ray_tracer(bund, 100, 1e-6)
+            energy, hits = rec.get_optics_manager().get_all_hits()
+            order = N.lexsort(hits[:2])
+            results.append((energy[order], hits[:,order]))
+        
+        N.testing.assert_array_almost_equal(results[0][0], results[1][0])
+        N.testing.assert_array_almost_equal(results[0][1], results[1][1])
+    
+    def test_absorbed(self):
+        """Wall losses are kept by the aperture's optics"""
+        pipe = light_pipe(5., 3., 10., 0.9)
+        bund = RayBundle(N.c_[[0, 0, 11], [0, 0, 11]],
+            N.c_[[1, 0, -1], [0, 0, -1]]/N.r_[N.sqrt(2), 1],
+            energy=N.r_[1., 1.], ref_index=N.r_[1., 1.])
+        TracerEngine(Assembly(objects=[pipe])).ray_tracer(bund, 10, 1e-6)
+        
+        absorbed, bounces = \
+            pipe.get_surfaces()[0].get_optics_manager().get_absorbed()
+        N.testing.assert_array_equal(bounces, [2, 0])
+        N.testing.assert_array_almost_equal(absorbed, [1 - 0.81, 0.])
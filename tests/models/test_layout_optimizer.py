@@ -0,0 +1,130 @@
+"""
+Test the heliostat field layout optimizer.
+"""
+
+import unittest
+import numpy as N
+
+from tracer.assembly import Assembly
+from tracer.spatial_geometry import roty
+from tracer.models.one_sided_mirror import one_sided_receiver
+from tracer.models.heliostat_field import solar_vector
+from tracer.models.layout_optimizer import graded_stagger, stagger_family, \
+    attenuation, gaussian_intercept, LayoutSurrogate, tower_check, \
+    optimize_layout
+
+class TestLayouts(unittest.TestCase):
+    def test_graded_stagger(self):
+        """Rows at the given spaces, heliostats evenly spaced along them"""
+        xy = graded_stagger(0., N.pi/2, 5., 50., [10., 20.])
+        radii = N.sqrt(N.sum(xy**2, axis=1))
+        N.testing.assert_array_almost_equal(N.unique(N.round(radii, 6)),
+            [50., 60., 80.])
+
+        row = xy[abs(radii - 80.) < 1e-6]
+        N.testing.assert_array_almost_equal(
+            N.diff(N.arctan2(row[:,1], row[:,0]))*80., 5.)
+        # The middle row is staggered:
+        first = xy[abs(radii - 60.) < 1e-6][0]
+        self.assertAlmostEqual(N.arctan2(first[1], first[0])*60., 2.5)
+
+    def test_family(self):
+        """Row spaces grow up to the outer radius"""
+        xy = stagger_family(0., N.pi/2, 50., 100.)(N.r_[5., 10., 0.5])
+        radii = N.unique(N.round(N.sqrt(N.sum(xy**2, axis=1)), 6))
+        N.testing.assert_array_almost_equal(radii, [50., 60., 75., 97.5])
+
+class TestSurrogate(unittest.TestCase):
+    def setUp(self):
+        self.suns = N.array([[N.pi/2, N.pi/6]])
+        self.surrogate = LayoutSurrogate(2., 2., 1., 30., 2., self.suns,
+            sigma=0.005)
+
+    def test_single(self):
+        """A lone heliostat loses only cosine, attenuation and spillage"""
+        eff = self.surrogate.efficiency(N.array([[100., 0.]]))
+        tower = N.r_[-100., 0., 29.]
+        dist = N.sqrt(N.sum(tower**2))
+        normal = tower/dist + solar_vector(*self.suns[0])
+        normal /= N.sqrt(N.sum(normal**2))
+        N.testing.assert_array_almost_equal(eff, N.dot(normal,
+            solar_vector(*self.suns[0]))*attenuation(dist)* \
+            gaussian_intercept(dist, 2., 0.005))
+
+    def test_crowding(self):
+        """Close rows shade and block each other"""
+        sparse = self.surrogate.efficiency(graded_stagger(-0.1, 0.1, 2.5, 60.,
+            [8.]))
+        dense = self.surrogate.efficiency(graded_stagger(-0.1, 0.1, 2.5, 60.,
+            [2.]))
+        self.failUnless(dense.sum() < sparse.sum())
+
+    def test_select(self):
+        """The best heliostats are kept"""
+        xy = N.array([[50., 0.], [300., 0.], [80., 0.]])
+        chosen, score = self.surrogate.select(xy, 2)
+        N.testing.assert_array_equal(chosen, xy[[0, 2]])
+        self.assertAlmostEqual(score,
+            self.surrogate.efficiency(xy[[0, 2]]).sum())
+
+class TestOptimizer(unittest.TestCase):
+    def setUp(self):
+        self.layout = stagger_family(-0.3, 0.3, 30., 80.)
+        self.surrogate = LayoutSurrogate(2., 2., 1., 20., 2.,
+            N.array([[N.pi/2, N.pi/6], [N.pi/3, N.pi/4]]))
+
+    def test_surrogate_only(self):
+        """The search improves on the start"""
+        start = N.r_[2.5, 2.5, 0.]
+        params, checked = optimize_layout(self.layout, start,
+            N.r_[1., 1., 0.05], self.surrogate, 40, max_iter=6,
+            bounds=(N.r_[2., 2., 0.], N.r_[10., 10., 0.5]))
+        self.failUnlessEqual(checked, [])
+        self.failUnless(self.surrogate.select(self.layout(params), 40)[1] > \
+            self.surrogate.select(self.layout(start), 40)[1])
+
+    def test_invalid_moves(self):
+        """Unbounded steps past valid spacings are skipped, not raised"""
+        start = N.r_[2.5, 2.5, 0.]
+        params, checked = optimize_layout(self.layout, start,
+            N.r_[3., 3., 1.], self.surrogate, 40, max_iter=2)
+        self.failUnless(params[0] > 0 and params[1] > 0 and params[2] > -1)
+        self.failIf(self.surrogate.select(self.layout(params), 40)[1] < \
+            self.surrogate.select(self.layout(start), 40)[1])
+        self.failUnless(isinstance(params, N.ndarray))
+
+    def test_all_rejected(self):
+        """A layout function that rejects everything is reported"""
+        def reject(params):
+            raise ValueError("No layout")
+        self.assertRaises(ValueError, optimize_layout, reject, N.r_[3., 3.],
+            N.r_[1., 1.], self.surrogate, 40, check=lambda xy, prng: 0.,
+            max_iter=2)
+
+    def test_checks(self):
+        """Candidates are traced alike in any number of processes"""
+        def make_plant(field):
+            rec_surf, rec_obj = one_sided_receiver(4., 4.)
+            rec_trans = roty(N.pi/2)
+            rec_trans[2,3] = 20.
+            rec_obj.set_transform(rec_trans)
+            return Assembly(objects=[rec_obj], subassemblies=[field]), \
+                rec_surf.get_optics_manager()
+
+        check = tower_check(2., 2., 0., 1., 20., make_plant,
+            N.array([[N.pi/2, N.pi/6]]), None, 10, 0.00465)
+        results = [optimize_layout(self.layout, N.r_[3., 3., 0.],
+            N.r_[1., 1., 0.05], self.surrogate, 20, check, check_every=2,
+            num_checks=2, max_iter=2, bounds=(N.r_[2., 2., 0.], N.r_[10., 10.,
+            0.5]), prng=3, processes=processes) \
+            for processes in (1, 2)]
+
+        N.testing.assert_array_equal(results[0][0], results[1][0])
+        self.failUnlessEqual(results[0][1], results[1][1])
+        self.failUnlessEqual(len(results[0][1]), 4)
+        for params, surr_score, traced_score in results[0][1]:
+            # Traced efficiency is near the surrogate's:
+            self.assertAlmostEqual(traced_score/surr_score, 1., 1)
+
+if __name__ == '__main__':
+    unittest.main()
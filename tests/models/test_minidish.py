@@ -62,3 +62,18 @@ class TestMiniDish(unittest.TestCase):
         
         self.failUnless(N.allclose(y, 0))
         N.testing.assert_array_equal(energy, N.r_[90., 90., 81., 81.])
+    
+    def test_light_pipe(self):
+        """Dish with a light pipe homogenizer"""
+        md = MiniDish(5, 5, 0.9, 5.7, .4, 0.7, 0.9, light_pipe=True)
+        bund = tracer.ray_bundle.RayBundle(self.pos, self.dir,
+            energy=N.ones(5)*100, ref_index=N.ones(5))
+        tracer.tracer_engine.TracerEngine(md).ray_tracer(bund, 1776, 0.05)
+        
+        receiver = md.get_receiver_surf()
+        energy, pts = receiver.get_optics_manager().get_all_hits()
+        x, y = receiver.global_to_local(pts)[:2]
+        
+        self.failUnless(N.allclose(y, 0))
+        # All rays arrive in one iteration, so the order differs:
+        N.testing.assert_array_equal(N.sort(energy), N.r_[81., 81., 90., 90.])
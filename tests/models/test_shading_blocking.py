@@ -0,0 +1,97 @@
+"""
+Test the shading and blocking factors of heliostat fields.
+"""
+
+import unittest
+import numpy as N
+
+from tracer.models.heliostat_field import HeliostatField, field_bundle, \
+    solar_vector
+from tracer.models.shading_blocking import shading_blocking, \
+    field_shading_blocking, NeighbourGrid
+
+class TestTwoPlates(unittest.TestCase):
+    """Two horizontal 1x1 plates, one above the other and offset by half."""
+    def setUp(self):
+        self.frames = N.tile(N.eye(4), (2, 1, 1))
+        self.half_dims = N.r_[0.5, 0.5]
+
+    def test_shading(self):
+        """Sun at zenith, the upper plate shades half of the lower one"""
+        self.frames[1,:3,3] = [0.5, 0., 1.]
+        shaded, blocked = shading_blocking(self.frames, self.half_dims,
+            N.r_[0., 0., 1.], samples=10)
+        N.testing.assert_array_almost_equal(shaded, [0.5, 0.])
+        N.testing.assert_array_almost_equal(blocked, [0., 0.])
+
+    def test_blocking(self):
+        """A slanted sun reflects into half of the upper plate"""
+        sun_vec = N.r_[-1., 0., 1.]/N.sqrt(2)
+        self.frames[1,:3,3] = [1.5, 0., 1.]
+        shaded, blocked = shading_blocking(self.frames, self.half_dims,
+            sun_vec, samples=10)
+        N.testing.assert_array_almost_equal(shaded, [0., 0.])
+        N.testing.assert_array_almost_equal(blocked, [0.5, 0.])
+
+    def test_far(self):
+        """Plates out of each other's way are not shaded or blocked"""
+        self.frames[1,:3,3] = [5., 0., 1.]
+        shaded, blocked = shading_blocking(self.frames, self.half_dims,
+            N.r_[0., 0., 1.])
+        N.testing.assert_array_equal(shaded, 0.)
+        N.testing.assert_array_equal(blocked, 0.)
+
+class TestNeighbourGrid(unittest.TestCase):
+    def test_pairs(self):
+        """All pairs of positions in cells at an offset are found"""
+        xy = N.random.uniform(0., 10., (200, 2))
+        grid = NeighbourGrid(xy, 1.5)
+        first, second = grid.pairs_at_offset(N.r_[1, -1])
+
+        cells = N.floor((xy - xy.min(axis=0))/1.5).astype(N.int_)
+        expected = set((i, j) for i in xrange(200) for j in xrange(200) \
+            if N.all(cells[j] - cells[i] == [1, -1]))
+        self.failUnlessEqual(set(zip(first, second)), expected)
+
+class TestFieldShading(unittest.TestCase):
+    def setUp(self):
+        pos = N.zeros((30, 3))
+        pos[:,0] = N.r_[40:100:2][:30]
+        pos[:,1] = N.tile([0., 1.5], 15)
+        pos[:,2] = 1.
+        self.field = HeliostatField(pos, 2., 2., 0., 10., grid=True)
+        self.sun = (0.3, 1.2)
+        self.field.aim_to_sun(*self.sun)
+
+    def test_against_trace(self):
+        """Shading and blocking match the rays traced through the field"""
+        shaded, blocked = field_shading_blocking(self.field, *self.sun,
+            samples=20)
+        self.failUnless(N.any(shaded > 0.1))
+        self.failUnless(N.any(blocked > 0.1))
+
+        rays = field_bundle(self.field, 2000, self.sun[0], self.sun[1],
+            1000., 0.)
+        aimed = N.repeat(N.arange(30), 2000)
+        mirror = self.field.get_instanced_surface()
+        gm = mirror.get_geometry_manager()
+
+        mirror.register_incoming(rays)
+        mirror.select_rays(N.arange(rays.get_num_rays()))
+        first_hit = gm.get_instance_indices()
+        reflected = mirror.get_outgoing()
+        mirror.done()
+
+        # Unshaded rays whose reflections hit another heliostat are blocked:
+        prm = mirror.register_incoming(reflected)
+        mirror.done()
+        mc_blocked = N.bincount(aimed,
+            (first_hit == aimed) & N.isfinite(prm), minlength=30)
+
+        # Within a row of the 20x20 sample grid:
+        N.testing.assert_allclose(
+            N.bincount(aimed, first_hit != aimed)/2000., shaded, atol=0.05)
+        N.testing.assert_allclose(mc_blocked/2000., blocked, atol=0.05)
+
+if __name__ == '__main__':
+    unittest.main()
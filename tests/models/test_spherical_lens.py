@@ -44,6 +44,29 @@ class Biconvex(unittest.TestCase):
         N.testing.assert_array_equal(verts, N.tile(N.c_[[0.5, 0., 0.08]], (1,2)))
         N.testing.assert_array_equal(dirs, N.c_[[-1., 0., 0.], [1., 0., 0.]])
 
+    def test_stochastic(self):
+        """A stochastic lens keeps the ray count and focuses the same"""
+        N.random.seed(3)
+        lens = SphericalLens(diameter=1., depth=0.1, R1=10., R2=-10., 
+            refr_idx=1.5, stochastic=True)
+        rb = RayBundle(N.c_[[0., 0.001, 1.]], N.c_[[0., 0., -1.]], 
+            energy=N.r_[1.], ref_index=N.r_[1.])
+        rb = rb.inherit(N.zeros(1000, dtype=N.int))
+        screen = rect_one_sided_mirror(5, 5)
+        screen.set_transform(translate(0, 0, -lens.focal_length()))
+        
+        e = TracerEngine(Assembly([lens, screen]))
+        e.ray_tracer(rb, 3, 1e-6)
+        for bund in e.tree:
+            self.failUnless(bund.get_num_rays() <= 1000)
+        
+        # Most rays pass both faces and reach the focus:
+        focused = abs(e.tree[-1].get_vertices()[2] + lens.focal_length()) < 1e-6
+        self.failUnless(focused.sum() > 850)
+        N.testing.assert_array_almost_equal(
+            e.tree[-1].get_vertices()[1,focused], 0, 4)
+        N.testing.assert_array_equal(e.tree[-1].get_energy(), 1.)
+
 class Biconcave(unittest.TestCase):
     def setUp(self):
         self.lens = SphericalLens(diameter=1., depth=0.1, R1=-10., R2=10.,
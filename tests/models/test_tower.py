@@ -7,7 +7,11 @@ import numpy as N
 
 from tracer.tracer_engine import TracerEngine
 from tracer.ray_bundle import RayBundle
-from tracer.models.heliostat_field import HeliostatField, radial_stagger
+from tracer.models.heliostat_field import HeliostatField, radial_stagger, \
+    field_bundle, solar_vector
+from tracer.spatial_geometry import rotx, roty, rotz, translate
+from tracer.assembly import Assembly
+from tracer.models.one_sided_mirror import one_sided_receiver
 
 class TestHeliostatField(unittest.TestCase):
     def setUp(self):
@@ -28,9 +32,9 @@ class TestHeliostatField(unittest.TestCase):
     def test_secure_position(self):
         """Heliostats at default position absorb the sunlight"""
         e = TracerEngine(self.field)
-        e.ray_tracer(self.rays, 1, 0.05)
+        v, d = e.ray_tracer(self.rays, 1, 0.05)
         
-        N.testing.assert_array_equal(e.tree[-1].get_energy(), 0)
+        self.failUnlessEqual(v.shape, (3, 0))
     
     def test_aim(self):
         """Aiming heliostats works"""
@@ -45,6 +49,122 @@ class TestHeliostatField(unittest.TestCase):
         N.testing.assert_array_almost_equal(d[0, self.pos.shape[0]/2:], 0)
         N.testing.assert_array_almost_equal(abs(d[2]*(v[0] + v[1])/(d[0] + d[1])), 85.5)
 
+    def test_field_bundle(self):
+        """Rays aimed at the heliostats all hit them"""
+        elev = N.pi/4
+        az = N.pi/2
+        self.field.aim_to_sun(az, elev)
+        rays = field_bundle(self.field, 100, az, elev, 1000., 0.00465)
+        self.failUnlessEqual(rays.get_num_rays(), 100*self.pos.shape[0])
+        
+        e = TracerEngine(self.field)
+        v, d = e.ray_tracer(rays, 1, 0.05)
+        self.failUnlessEqual(v.shape[1], rays.get_num_rays())
+        
+        # No overlaps here, so each heliostat gets its full projected area:
+        hstat_energy = rays.get_energy().reshape(-1, 100).sum(axis=1)
+        self.assertTrue(N.all(hstat_energy <= 64*1000.))
+        self.assertTrue(N.all(hstat_energy > 0.5*64*1000.))
+
+    def test_instanced(self):
+        """An instanced field traces like a field of objects"""
+        self.field.aim_to_sun(N.pi/2, N.pi/4)
+        inst_field = HeliostatField(self.pos, 8., 8., 0., 90., instanced=True)
+        self.assertEqual(inst_field.get_heliostats(), [])
+        inst_field.aim_to_sun(N.pi/2, N.pi/4)
+        N.testing.assert_array_almost_equal(
+            inst_field.get_heliostat_transforms(),
+            self.field.get_heliostat_transforms())
+        
+        v, d = TracerEngine(self.field).ray_tracer(self.rays, 1, 0.05)
+        iv, id = TracerEngine(inst_field).ray_tracer(self.rays, 1, 0.05)
+        N.testing.assert_array_almost_equal(iv, v)
+        N.testing.assert_array_almost_equal(id, d)
+        
+        # Rays aimed at the heliostats of an instanced field:
+        rays = field_bundle(inst_field, 10, N.pi/2, N.pi/4, 1000., 0.00465)
+        iv, id = TracerEngine(inst_field).ray_tracer(rays, 1, 0.05)
+        self.failUnlessEqual(iv.shape[1], rays.get_num_rays())
+    
+    def test_grid(self):
+        """A grid-indexed field finds the heliostat hit by each ray"""
+        grid_field = HeliostatField(self.pos, 8., 8., 0., 90., grid=True)
+        grid_field.aim_to_sun(N.pi/2, N.pi/4)
+        rays = field_bundle(grid_field, 10, N.pi/2, N.pi/4, 1000., 0.00465)
+        
+        # Some rays are shaded by the next heliostat, as in a plain field:
+        inst_field = HeliostatField(self.pos, 8., 8., 0., 90., instanced=True)
+        inst_field.aim_to_sun(N.pi/2, N.pi/4)
+        hit_hstats = []
+        for field in grid_field, inst_field:
+            mirror = field.get_instanced_surface()
+            mirror.register_incoming(rays)
+            mirror.select_rays(N.arange(rays.get_num_rays()))
+            hit_hstats.append(
+                mirror.get_geometry_manager().get_instance_indices())
+            mirror.done()
+        N.testing.assert_array_equal(hit_hstats[0], hit_hstats[1])
+        
+        v, d = TracerEngine(grid_field).ray_tracer(rays, 1, 0.05)
+        self.failUnlessEqual(v.shape[1], rays.get_num_rays())
+    
+    def test_contributors(self):
+        """Receiver energy is broken down by heliostat"""
+        rec_surf, rec_obj = one_sided_receiver(20., 20.)
+        rec_trans = roty(N.pi/2)
+        rec_trans[2,3] = 90.
+        rec_obj.set_transform(rec_trans)
+        receiver = rec_surf.get_optics_manager()
+        
+        for kwds in {}, {'instanced': True}:
+            field = HeliostatField(self.pos, 8., 8., 0., 90., contributors=True,
+                **kwds)
+            field.aim_to_sun(N.pi/2, N.pi/4)
+            rays = field_bundle(field, 20, N.pi/2, N.pi/4, 1000., 0.00465)
+            TracerEngine(Assembly(objects=[rec_obj], subassemblies=[field])
+                ).ray_tracer(rays, 10, 0.05)
+            
+            contribs = receiver.get_contributions(self.pos.shape[0])
+            self.failUnlessEqual(len(contribs), self.pos.shape[0])
+            self.assertAlmostEqual(contribs.sum(),
+                receiver.get_all_hits()[0].sum())
+            # The receiver faces the heliostats on the X axis only:
+            half = self.pos.shape[0]/2
+            self.failUnless(N.all(contribs[:half] > 0))
+            N.testing.assert_array_equal(contribs[half:], 0)
+            receiver.reset()
+    
+    def test_batched_transforms(self):
+        """Bulk aiming equals turning each heliostat in azimuth and tilt"""
+        self.field.set_transform(translate(1., 2., 3.))
+        self.field.aim_to_sun(N.pi/3, N.pi/5)
+        
+        tower = N.r_[0., 0., 90.] - self.pos
+        tower /= N.sqrt(N.sum(tower**2, axis=1))[:,None]
+        normals = solar_vector(N.pi/3, N.pi/5) + tower
+        normals /= N.sqrt(N.sum(normals**2, axis=1))[:,None]
+        frames = self.field.heliostat_frames(
+            self.field.get_heliostat_transforms())
+        
+        for hidx, hstat in enumerate(self.field.get_heliostats()):
+            trans = N.dot(rotz(N.arctan2(normals[hidx,1], normals[hidx,0])),
+                roty(N.arccos(normals[hidx,2])))
+            trans[:3,3] = self.pos[hidx]
+            N.testing.assert_array_almost_equal(hstat.get_transform(), trans)
+            N.testing.assert_array_almost_equal(frames[hidx],
+                N.dot(translate(1., 2., 3.), trans))
+            
+            surf = hstat.get_surfaces()[0]
+            N.testing.assert_array_almost_equal(surf.get_global_transform(),
+                N.dot(N.dot(translate(1., 2., 3.), trans),
+                surf.get_transform()))
+    
+    def test_face_down(self):
+        """Initial transforms are a flip around the x axis"""
+        for hidx, trans in enumerate(self.field.get_heliostat_transforms()):
+            N.testing.assert_array_almost_equal(trans,
+                N.dot(translate(*self.pos[hidx]), rotx(N.pi)))
+
 class TestRadialStagger(unittest.TestCase):
     def test_stagger(self):
         """position in a radial-stagger are correct"""
@@ -0,0 +1,124 @@
+# Test the compound parabolic concentrator geometry managers.
+
+import unittest
+import numpy as N
+
+from tracer.ray_bundle import RayBundle
+from tracer.surface import Surface
+from tracer.object import AssembledObject
+from tracer.assembly import Assembly
+from tracer.tracer_engine import TracerEngine
+from tracer.cpc import RotationalCPCGM, TroughCPCGM
+from tracer.models.one_sided_mirror import one_sided_receiver
+import tracer.optics_callables as opt
+from tracer.spatial_geometry import rotx, translate
+
+class TestProfile(unittest.TestCase):
+    def test_dimensions(self):
+        """A full CPC has the textbook apertures and height"""
+        th = N.pi/9
+        gm = RotationalCPCGM(1., th)
+        self.assertAlmostEqual(gm.profile(0.), 1.)
+        self.assertAlmostEqual(gm.get_entrance_radius(), 1./N.sin(th))
+        self.assertAlmostEqual(gm.get_height(),
+            (1 + 1./N.sin(th))/N.tan(th))
+
+    def test_truncated(self):
+        """A truncated CPC is cut at its height"""
+        gm = TroughCPCGM(1., N.pi/9, 2., height=3.)
+        self.failUnlessEqual(gm.get_height(), 3.)
+        self.assertAlmostEqual(gm.get_entrance_radius(), gm.profile(3.))
+        self.assertRaises(ValueError, TroughCPCGM, 1., N.pi/9, 2., 20.)
+
+class TestRotationalCPC(unittest.TestCase):
+    def setUp(self):
+        self.th = N.pi/9
+        self.gm = RotationalCPCGM(1., self.th)
+
+    def test_horizontal(self):
+        """Rays from the axis hit the wall at the profile's radius"""
+        z = N.r_[0.5, 2., 5., 8.]
+        ang = N.r_[0., 1., 2., 3.]
+        dirs = N.vstack((N.cos(ang), N.sin(ang), N.zeros(4)))
+        bund = RayBundle(N.vstack((N.zeros((2, 4)), z)), dirs)
+
+        prm = self.gm.find_intersections(N.eye(4), bund)
+        N.testing.assert_array_almost_equal(prm, self.gm.profile(z))
+
+        self.gm.select_rays(N.arange(4))
+        N.testing.assert_array_almost_equal(
+            self.gm.get_intersection_points_global(),
+            N.vstack((prm*dirs[:2], z)))
+
+        # Normals are perpendicular to the profile and face the rays:
+        norm = self.gm.get_normals()
+        slope = (self.gm.profile(z + 1e-6) - self.gm.profile(z - 1e-6))/2e-6
+        tangent = N.vstack((slope*dirs[:2], N.ones(4)))
+        N.testing.assert_array_almost_equal(N.sum(norm*tangent, axis=0), 0.)
+        self.failUnless((N.sum(norm*dirs, axis=0) < 0).all())
+
+    def test_edge_rays(self):
+        """Rays along the parabola's axis are reflected to the exit's edge"""
+        S, C = N.sin(self.th), N.cos(self.th)
+        frame = N.dot(translate(1., 2., 3.), rotx(N.pi/5))
+        # In local coordinates: one axial ray, one along the parabola's axis.
+        pos = N.c_[[2., 0., 20.], [0., 0., self.gm.get_height()]]
+        dirs = N.c_[[0., 0., -1.], [S, 0., -C]]
+        bund = RayBundle(N.dot(frame[:3,:3], pos) + frame[:3,3][:,None],
+            N.dot(frame[:3,:3], dirs))
+
+        self.gm.find_intersections(frame, bund)
+        self.gm.select_rays(N.arange(2))
+        hits = N.dot(N.linalg.inv(frame), N.vstack((
+            self.gm.get_intersection_points_global(), N.ones(2))))[:3]
+        self.assertAlmostEqual(self.gm.profile(hits[2,0]), 2.)
+        self.assertAlmostEqual(self.gm.profile(hits[2,1]), hits[0,1])
+
+        norm = N.dot(frame[:3,:3].T, self.gm.get_normals()[:,1])
+        refl = dirs[:,1] - 2*N.dot(dirs[:,1], norm)*norm
+        to_focus = N.r_[-1., 0., 0.] - hits[:,1]
+        N.testing.assert_array_almost_equal(refl,
+            to_focus/N.sqrt(N.sum(to_focus**2)))
+
+    def test_mesh(self):
+        """The mesh lies on the profile"""
+        x, y, z = self.gm.mesh(2)
+        N.testing.assert_array_almost_equal(N.sqrt(x**2 + y**2),
+            self.gm.profile(z))
+        self.assertAlmostEqual(z.max(), self.gm.get_height())
+
+class TestTroughCPC(unittest.TestCase):
+    def setUp(self):
+        self.th = 0.3
+        self.gm = TroughCPCGM(1., self.th, 10.)
+        cpc = AssembledObject(surfs=[Surface(self.gm, opt.perfect_mirror)])
+        self.rec, rec_obj = one_sided_receiver(4., 10.)
+        rec_obj.set_transform(translate(0., 0., -1e-6))
+        self.engine = TracerEngine(Assembly(objects=[cpc, rec_obj]))
+
+    def test_acceptance(self):
+        """All rays within the acceptance angle reach the exit, none beyond"""
+        prng = N.random.RandomState(1)
+        num = 1000
+        height = self.gm.get_height()*0.9999
+        ang = prng.uniform(-1.5*self.th, 1.5*self.th, num)
+        pos = N.vstack((prng.uniform(-1, 1, num)*self.gm.profile(height),
+            prng.uniform(-4, 4, num), N.tile(height, num)))
+        dirs = N.vstack((N.sin(ang), N.zeros(num), -N.cos(ang)))
+        bund = RayBundle(pos, dirs, energy=N.ones(num), ref_index=N.ones(num))
+
+        self.engine.ray_tracer(bund, 100, 1e-9, tree=False)
+        energy, hits = self.rec.get_optics_manager().get_all_hits()
+        self.failUnlessEqual(energy.sum(), (abs(ang) < self.th).sum())
+        self.failUnless((abs(hits[0]) < 1.01).all())
+
+    def test_length(self):
+        """Rays beyond the trough's ends miss it"""
+        bund = RayBundle(N.c_[[0., 4., 1.], [0., 6., 1.]],
+            N.c_[[1., 0., 0.], [1., 0., 0.]])
+        prm = self.gm.find_intersections(N.eye(4), bund)
+        self.assertAlmostEqual(prm[0], self.gm.profile(1.))
+        self.failUnlessEqual(prm[1], N.inf)
+
+if __name__ == '__main__':
+    unittest.main()
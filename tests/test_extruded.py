@@ -0,0 +1,144 @@
+# Test the translation-invariant geometry managers and the 2.5D trace mode.
+
+import unittest
+import numpy as N
+
+from tracer.ray_bundle import RayBundle
+from tracer.surface import Surface
+from tracer.object import AssembledObject
+from tracer.assembly import Assembly
+from tracer.tracer_engine import TracerEngine
+from tracer.extruded import ExtrudedFlatGM, ParabolicTroughGM, \
+    ExtrudedCircleGM
+from tracer.sources import transverse_bundle, pillbox_sunshape_directions
+from tracer.spatial_geometry import translate, rotz, rotation_to_z
+import tracer.optics_callables as opt
+
+class TestExtrudedGMs(unittest.TestCase):
+    def test_trough(self):
+        """Rays hit the parabola and are reflected across the focal line"""
+        gm = ParabolicTroughGM(4., 1., length=10.)
+        dirs = N.c_[[0., 0., -1.], [0., 0.6, -0.8], [0., 0.6, -0.8],
+            [0., 0., -1.]]
+        pos = N.c_[[1., 0., 3.], [-1.5, 0., 3.], [1., -4.5, 3.], [3., 0., 3.]]
+        prm = gm.find_intersections(N.eye(4), RayBundle(pos, dirs))
+
+        z = N.r_[0.25, 0.5625, 0.25]
+        N.testing.assert_array_almost_equal(prm[:3], (3 - z)/-dirs[2,:3])
+        self.failUnlessEqual(prm[3], N.inf) # outside the width
+
+        gm.select_rays(N.arange(2))
+        hits = gm.get_intersection_points_global()
+        N.testing.assert_array_almost_equal(hits, N.c_[[1., 0., 0.25],
+            [-1.5, 0.6*prm[1], 0.5625]])
+
+        norms = gm.get_normals()
+        refl = dirs[:,:2] - 2*N.sum(dirs[:,:2]*norms, axis=0)*norms
+        # The reflections cross the focal line x=0, z=1:
+        N.testing.assert_array_almost_equal(
+            hits[0] - refl[0]*(hits[2] - 1)/refl[2], 0.)
+        N.testing.assert_array_almost_equal(norms[1], 0.)
+
+    def test_length(self):
+        """The axial travel of rays takes them past a finite surface's end"""
+        gm = ParabolicTroughGM(4., 1., length=10.)
+        bund = RayBundle(N.c_[[1., 4.5, 3.]], N.c_[[0., 0.6, -0.8]])
+        self.failUnlessEqual(gm.find_intersections(N.eye(4), bund)[0], N.inf)
+        gm = ParabolicTroughGM(4., 1.)
+        self.failUnless(N.isfinite(gm.find_intersections(N.eye(4), bund)[0]))
+
+    def test_circle(self):
+        """A tube is hit from outside, in a rotated frame"""
+        gm = ExtrudedCircleGM(2.)
+        frame = N.dot(translate(1., 2., 3.), rotz(N.pi/2))
+        pos = N.c_[[1., 2., 6.], [4., 5., 3.]]
+        dirs = N.c_[[0., 0., -1.], [0., -1., 0.]]
+        prm = gm.find_intersections(frame, RayBundle(pos, dirs))
+        N.testing.assert_array_almost_equal(prm, [2., 2.])
+
+        gm.select_rays(N.arange(2))
+        N.testing.assert_array_almost_equal(gm.get_normals(),
+            N.c_[[0., 0., 1.], [0., 1., 0.]])
+        N.testing.assert_array_equal(gm.get_backside(), [False, False])
+
+    def test_flat_backside(self):
+        """A strip reports the side it's hit from"""
+        gm = ExtrudedFlatGM(2.)
+        pos = N.c_[[0., 0., 1.], [0.5, 3., -1.], [2., 0., 1.]]
+        dirs = N.c_[[0., 0., -1.], [0., 0., 1.], [0., 0., -1.]]
+        prm = gm.find_intersections(N.eye(4), RayBundle(pos, dirs))
+        N.testing.assert_array_equal(prm, [1., 1., N.inf])
+
+        gm.select_rays(N.arange(2))
+        N.testing.assert_array_equal(gm.get_backside(), [False, True])
+        N.testing.assert_array_equal(gm.get_normals(),
+            N.c_[[0., 0., 1.], [0., 0., -1.]])
+
+class TestTransverseMode(unittest.TestCase):
+    def setUp(self):
+        self.W, self.f, self.L = 5., 1.7, 12.
+        self.sun = N.r_[0., N.sin(0.35), -N.cos(0.35)]
+        self.axis = N.r_[0., 1., 0.]
+
+    def plant(self, length, mirror_opt, rec_opt):
+        mirror = AssembledObject(surfs=[Surface(
+            ParabolicTroughGM(self.W, self.f, length), mirror_opt)])
+        tube = AssembledObject(surfs=[Surface(ExtrudedCircleGM(0.07, length),
+            rec_opt)], transform=translate(0., 0., self.f))
+        return Assembly(objects=[mirror, tube])
+
+    def test_bundle(self):
+        """Rays start across the axis and the sun, with the beam's power"""
+        bund = transverse_bundle(100, N.c_[[0., 0., 3.]], self.sun, self.W,
+            0.00465, self.axis, flux=1000.)
+        verts = bund.get_vertices()
+        N.testing.assert_array_equal(verts[1:], N.tile(N.c_[[0., 3.]],
+            (1, 100)))
+        self.failUnless((abs(verts[0]) <= self.W/2.).all())
+        self.assertAlmostEqual(bund.get_energy().sum(),
+            1000.*self.W*N.cos(0.35))
+
+    def test_end_factors(self):
+        """Energy is lost in proportion to the axial travel"""
+        rec = opt.EndLossReceiver(self.axis, 10.)
+        tube = AssembledObject(surfs=[Surface(ExtrudedCircleGM(2.), rec)])
+        bund = opt.with_axial_start(RayBundle(N.c_[[0., 0., 5.],
+            [0., 0., 5.]], N.c_[[0., 0.6, -0.8], [0., 0.6, -0.8]],
+            energy=N.r_[1., 1.], ref_index=N.r_[1., 1.]))
+        bund.set_axial_start(N.r_[N.nan, 1.])
+        TracerEngine(Assembly(objects=[tube])).ray_tracer(bund, 1, 1e-9)
+
+        # The second ray travelled 2 units axially from its first hit:
+        N.testing.assert_array_almost_equal(rec.get_end_factors(), [1., 0.8])
+        N.testing.assert_array_almost_equal(rec.get_all_hits()[0], [1., 0.8])
+
+    def test_same_as_3d(self):
+        """The 2.5D mode with end losses agrees with a 3D trace"""
+        num = 100000
+        prng = N.random.RandomState(0)
+        x = prng.uniform(-self.W/2., self.W/2., num)
+        y = prng.uniform(-self.L/2., self.L/2., num)
+        dirs = N.dot(rotation_to_z(self.sun),
+            pillbox_sunshape_directions(num, 0.00465, prng=prng))
+        # Start right on the mirror, so it is lit along all its length:
+        verts = N.vstack((x, y, x**2/(4*self.f))) - 1e-3*dirs
+        bund = RayBundle(verts, dirs, energy=N.ones(num)*self.W*self.L* \
+            N.cos(0.35)/num, ref_index=N.ones(num))
+        rec3 = opt.ReflectiveReceiver(0.9)
+        TracerEngine(self.plant(self.L, opt.Reflective(0.05), rec3)
+            ).ray_tracer(bund, 100, 1e-9, tree=False)
+
+        bund = opt.with_axial_start(transverse_bundle(5000, N.c_[[0., 0., 3.]],
+            self.sun, self.W, 0.00465, self.axis, flux=1.,
+            prng=N.random.RandomState(1)))
+        rec2 = opt.EndLossReceiver(self.axis, self.L, 0.9)
+        TracerEngine(self.plant(None, opt.AxialStart(opt.Reflective(0.05),
+            self.axis), rec2)).ray_tracer(bund, 100, 1e-9, tree=False)
+
+        self.assertAlmostEqual(rec2.get_all_hits()[0].sum()*self.L/ \
+            rec3.get_all_hits()[0].sum(), 1., 2)
+        # End losses are a few percent here:
+        self.failUnless(rec2.get_end_factors().min() < 0.97)
+
+if __name__ == '__main__':
+    unittest.main()
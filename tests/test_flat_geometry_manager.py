@@ -35,6 +35,12 @@ class TestFlatGeomManagerInterface(unittest.TestCase):
         n = self.gm.get_normals()
         N.testing.assert_array_equal(n, N.tile(N.c_[[0, 0, 1]], (1,2)))
     
+    def test_broadcast_normals(self):
+        """A one-sided hit returns the normal once, for broadcasting"""
+        self.gm.select_rays(N.arange(4))
+        n = self.gm.get_broadcast_normals()
+        N.testing.assert_array_equal(n, N.c_[[0, 0, 1]])
+    
     def test_inters_points_global(self):
         """On the basic setup, a flat surface returns correct intersections"""
         correct_pts = N.zeros((3,4))
@@ -151,3 +157,19 @@ class TestBacksideNormals(unittest.TestCase):
         n = self.gm.get_normals()
         N.testing.assert_array_equal(n, N.tile(N.c_[[0, 0, -1]], (1,4)))
 
+class TestTwoSidedNormals(unittest.TestCase):
+    def setUp(self):
+        dir = N.c_[[1, 1, -1], [-1, 1, 1], [-1, -1, -1], [1, -1, 1]] / math.sqrt(3)
+        position = N.c_[[0,0,1], [1,-1,-1], [1,1,1], [-1,1,-1]]
+        self._bund = RayBundle(position, dir)
+
+        self.gm = FlatGeometryManager()
+        self.prm = self.gm.find_intersections(N.eye(4), self._bund)
+    
+    def test_broadcast_normals(self):
+        """Hits from both sides get a normal per ray, facing the ray"""
+        self.gm.select_rays(N.arange(4))
+        n = self.gm.get_broadcast_normals()
+        N.testing.assert_array_equal(n,
+            N.c_[[0, 0, 1], [0, 0, -1], [0, 0, 1], [0, 0, -1]])
+
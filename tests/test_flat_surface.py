@@ -6,7 +6,8 @@ from numpy import c_, r_
 
 from tracer.surface import Surface
 from tracer.flat_surface import FlatGeometryManager
-from tracer.optics_callables import perfect_mirror
+from tracer.optics_callables import perfect_mirror, Reflective, \
+    ReflectiveReceiver
 from tracer.ray_bundle import RayBundle
 
 class TestTraceProtocol(unittest.TestCase):
@@ -40,3 +41,38 @@ class TestTraceProtocol(unittest.TestCase):
         N.testing.assert_array_equal(outg.get_energy(), N.ones(4)*100)
         N.testing.assert_array_equal(outg.get_parents(), N.arange(4))
 
+class TestTwoSidedOptics(unittest.TestCase):
+    """A surface with separate optics for each side"""
+    def setUp(self):
+        self._rec = ReflectiveReceiver(0.5)
+        self._surf = Surface(FlatGeometryManager(), self._rec,
+            back_optics=Reflective(1.))
+        
+        # Two rays coming from above, two from below:
+        dir = N.c_[[1, 1, -1], [-1, 1, 1], [-1, -1, -1], [1, -1, 1]] / math.sqrt(3)
+        position = c_[[0,0,1], [1,-1,-1], [1,1,1], [-1,1,-1]]
+        self._bund = RayBundle(position, dir, energy=N.ones(4)*100)
+    
+    def test_get_outgoing(self):
+        """Only the front side hits generate outgoing rays"""
+        self._surf.register_incoming(self._bund)
+        self._surf.select_rays(N.arange(4))
+        outg = self._surf.get_outgoing()
+        
+        N.testing.assert_array_equal(outg.get_parents(), N.r_[0, 2])
+        N.testing.assert_array_equal(outg.get_energy(), N.ones(2)*50)
+        N.testing.assert_array_almost_equal(outg.get_vertices(),
+            N.c_[[1, 1, 0], [0, 0, 0]])
+        N.testing.assert_array_almost_equal(outg.get_directions(),
+            N.c_[[1, 1, 1], [-1, -1, 1]] / math.sqrt(3))
+        
+        absorbed, hits = self._rec.get_all_hits()
+        N.testing.assert_array_equal(absorbed, N.ones(2)*50)
+    
+    def test_terminal(self):
+        """Terminal only if both sides are"""
+        self.assertFalse(self._surf.is_terminal())
+        surf = Surface(FlatGeometryManager(), ReflectiveReceiver(),
+            back_optics=Reflective(1.))
+        self.assertTrue(surf.is_terminal())
+
@@ -0,0 +1,134 @@
+# Test the geometry manager of surfaces given as heights on a grid.
+
+import unittest
+import numpy as N
+
+from tracer.ray_bundle import RayBundle
+from tracer.height_field import HeightFieldGM
+from tracer.paraboloid import ParabolicDishGM
+from tracer.spatial_geometry import translate, rotx
+
+class TestSpline(unittest.TestCase):
+    def setUp(self):
+        self.xs = N.linspace(-1., 1., 21)
+        self.ys = N.linspace(-1.2, 1.2, 25)
+        X, Y = N.meshgrid(self.xs, self.ys, indexing='ij')
+        self.f = lambda x, y: 0.1*N.sin(3*x)*N.cos(2*y) + 0.05*x
+        self.gm = HeightFieldGM(self.xs, self.ys, self.f(X, Y))
+
+    def test_interpolation(self):
+        """The spline passes through the grid and follows a smooth shape"""
+        X, Y = N.meshgrid(self.xs, self.ys, indexing='ij')
+        N.testing.assert_array_almost_equal(self.gm.height(X, Y),
+            self.f(X, Y), 12)
+
+        x, y = N.random.RandomState(0).uniform(-0.8, 0.8, (2, 100))
+        N.testing.assert_array_almost_equal(self.gm.height(x, y),
+            self.f(x, y), 4)
+
+    def test_bad_grid(self):
+        """Irregular grids and mismatched heights are refused"""
+        heights = N.zeros((21, 25))
+        self.assertRaises(ValueError, HeightFieldGM, self.xs**3, self.ys,
+            heights)
+        self.assertRaises(ValueError, HeightFieldGM, self.xs[::-1], self.ys,
+            heights)
+        self.assertRaises(ValueError, HeightFieldGM, self.xs, self.ys,
+            heights.T)
+
+    def test_oblique(self):
+        """Oblique rays find the first crossing along their path"""
+        prng = N.random.RandomState(1)
+        num = 50
+        pos = N.vstack((prng.uniform(-1.5, 1.5, (2, num)), N.ones(num)))
+        dirs = N.vstack((prng.uniform(-1, 1, (2, num)), N.tile(-0.5, num)))
+        dirs /= N.sqrt(N.sum(dirs**2, axis=0))
+        prm = self.gm.find_intersections(N.eye(4), RayBundle(pos, dirs))
+
+        # Brute force: the first sign change of the height above the surface
+        ts = N.linspace(0., 5., 5001)
+        path = pos[:,None,:] + ts[:,None]*dirs[:,None,:]
+        inside = (abs(path[0]) <= 1.) & (abs(path[1]) <= 1.2)
+        gap = path[2] - self.gm.height(N.clip(path[0], -1., 1.),
+            N.clip(path[1], -1.2, 1.2))
+        cross = (gap[:-1]*gap[1:] <= 0) & inside[:-1] & inside[1:]
+        first = N.where(cross.any(axis=0), ts[N.argmax(cross, axis=0)], N.inf)
+
+        N.testing.assert_array_equal(N.isinf(prm), N.isinf(first))
+        hit = N.isfinite(prm)
+        self.failUnless(hit.sum() > 10)
+        N.testing.assert_array_almost_equal(prm[hit], first[hit], 2)
+
+        self.gm.select_rays(N.nonzero(hit)[0])
+        pts = self.gm.get_intersection_points_global()
+        N.testing.assert_array_almost_equal(pts[2],
+            self.gm.height(pts[0], pts[1]))
+
+    def test_self_hit(self):
+        """A ray leaving the surface does not hit it again at its vertex"""
+        pos = N.c_[[0.3, 0.2, self.gm.height(0.3, 0.2)]]
+        prm = self.gm.find_intersections(N.eye(4),
+            RayBundle(pos, N.c_[[0., 0., 1.]]))
+        self.failUnlessEqual(prm[0], N.inf)
+
+class TestShapes(unittest.TestCase):
+    def test_plane(self):
+        """A tilted plane is exact, and reports hits from behind"""
+        xs = N.linspace(0., 2., 5)
+        X, Y = N.meshgrid(xs, xs, indexing='ij')
+        gm = HeightFieldGM(xs, xs, 0.5*X - 0.25*Y + 1.)
+        frame = N.dot(translate(1., 2., 3.), rotx(N.pi/6))
+
+        # Local rays from above and below, the latter oblique:
+        pos = N.c_[[1., 1., 5.], [0.2, 1.5, -2.]]
+        dirs = N.c_[[0., 0., -1.], [0.28, 0., 0.96]]
+        bund = RayBundle(N.dot(frame[:3,:3], pos) + frame[:3,3][:,None],
+            N.dot(frame[:3,:3], dirs))
+        prm = gm.find_intersections(frame, bund)
+
+        # Solve 0.5x - 0.25y + 1 - z = 0 along the rays:
+        normal = N.r_[0.5, -0.25, -1.]
+        expected = -(N.dot(normal, pos) + 1.)/N.dot(normal, dirs)
+        N.testing.assert_array_almost_equal(prm, expected)
+
+        gm.select_rays(N.arange(2))
+        N.testing.assert_array_equal(gm.get_backside(), [False, True])
+        unit = -normal/N.sqrt(N.sum(normal**2))
+        N.testing.assert_array_almost_equal(gm.get_normals(),
+            N.dot(frame[:3,:3], N.c_[unit, -unit]))
+
+    def test_dish(self):
+        """A sampled paraboloid acts as the analytic one"""
+        xs = N.linspace(-1., 1., 41)
+        X, Y = N.meshgrid(xs, xs, indexing='ij')
+        gm = HeightFieldGM(xs, xs, (X**2 + Y**2)/4.)
+        dish = ParabolicDishGM(2., 1.)
+
+        prng = N.random.RandomState(2)
+        num = 100
+        pos = N.vstack((prng.uniform(-0.6, 0.6, (2, num)), N.tile(2., num)))
+        dirs = N.tile(N.c_[[0., 0., -1.]], (1, num))
+        N.testing.assert_array_almost_equal(
+            gm.find_intersections(N.eye(4), RayBundle(pos, dirs)),
+            dish.find_intersections(N.eye(4), RayBundle(pos, dirs)))
+
+        gm.select_rays(N.arange(num))
+        dish.select_rays(N.arange(num))
+        N.testing.assert_array_almost_equal(gm.get_normals(),
+            dish.get_normals())
+
+    def test_mesh(self):
+        """The mesh covers the grid's extents on the surface"""
+        xs = N.linspace(0., 1., 3)
+        ys = N.linspace(0., 2., 5)
+        X, Y = N.meshgrid(xs, ys, indexing='ij')
+        gm = HeightFieldGM(xs, ys, X*Y)
+
+        x, y, z = gm.mesh(4)
+        self.failUnlessEqual(x.shape, (5, 9))
+        N.testing.assert_array_almost_equal(N.r_[x.min(), x.max(), y.min(),
+            y.max()], [0., 1., 0., 2.])
+        N.testing.assert_array_almost_equal(z, x*y)
+
+if __name__ == '__main__':
+    unittest.main()
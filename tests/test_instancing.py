@@ -0,0 +1,152 @@
+# Tests for instanced geometry.
+
+import unittest
+import numpy as N
+
+from tracer.instancing import InstancedGM, GridInstancedGM
+from tracer.flat_surface import RectPlateGM, RoundPlateGM
+from tracer.sphere_surface import SphericalGM
+from tracer.ray_bundle import RayBundle
+from tracer.spatial_geometry import generate_transform
+
+class TestInstancedGM(unittest.TestCase):
+    def setUp(self):
+        N.random.seed(4)
+        num_rays = 300
+        verts = N.random.uniform(-3, 3, (3, num_rays))
+        verts[2] = 5
+        dirs = N.random.uniform(-0.3, 0.3, (3, num_rays))
+        dirs[2] = -1
+        self.bund = RayBundle(verts, dirs/N.sqrt(N.sum(dirs**2, axis=0)))
+        
+        self.transforms = N.array([generate_transform(N.r_[0., 1., 0.],
+            0.3*i, N.c_[[i - 2., 0., 0.2*i]]) for i in xrange(5)])
+        self.frame = generate_transform(N.r_[1., 0., 0.], 0.1,
+            N.c_[[0., 0.5, 0.]])
+    
+    def brute_force(self, proto):
+        """The nearest hit of each ray on separate copies of the prototype"""
+        params = N.empty((len(self.transforms), self.bund.get_num_rays()))
+        for inst, trans in enumerate(self.transforms):
+            params[inst] = proto.find_intersections(N.dot(self.frame, trans),
+                self.bund)
+            proto.done()
+        owner = N.where(N.isinf(params.min(axis=0)), -1,
+            N.argmin(params, axis=0))
+        return params.min(axis=0), owner
+    
+    def check_instanced(self, proto):
+        correct, correct_owner = self.brute_force(proto)
+        gm = InstancedGM(proto, self.transforms)
+        params = gm.find_intersections(self.frame, self.bund)
+        N.testing.assert_array_almost_equal(params, correct)
+        
+        hit = N.nonzero(N.isfinite(params))[0]
+        self.assertTrue(len(hit) > 0)
+        gm.select_rays(hit)
+        N.testing.assert_array_equal(gm.get_instance_indices(),
+            correct_owner[hit])
+        N.testing.assert_array_almost_equal(gm.get_intersection_points_global(),
+            self.bund.get_vertices()[:,hit] + \
+            params[hit]*self.bund.get_directions()[:,hit])
+        return gm, hit
+    
+    def test_rect(self):
+        """Vectorized rectangle instances"""
+        gm, hit = self.check_instanced(RectPlateGM(1.5, 1.))
+        
+        # Normals are the instance Z axes, facing the incoming rays:
+        frames = N.array([N.dot(self.frame, t) for t in self.transforms])
+        normals = frames[gm.get_instance_indices(),:3,2].T
+        N.testing.assert_array_almost_equal(abs(gm.get_normals()), abs(normals))
+        self.assertTrue(N.all(N.sum(gm.get_normals()*\
+            self.bund.get_directions()[:,hit], axis=0) < 0))
+        N.testing.assert_array_equal(gm.get_backside(),
+            N.sum(normals*self.bund.get_directions()[:,hit], axis=0) > 0)
+    
+    def test_round(self):
+        """Instances of a flat prototype without a vectorized kernel"""
+        self.check_instanced(RoundPlateGM(0.7))
+    
+    def test_general(self):
+        """Instances of a curved prototype"""
+        gm, hit = self.check_instanced(SphericalGM(0.6))
+        self.assertRaises(TypeError, gm.get_backside)
+    
+    def test_leaving_ray(self):
+        """A ray leaving one instance may hit another"""
+        trans = N.array([N.eye(4), N.eye(4)])
+        trans[1,2,3] = 1.
+        gm = InstancedGM(RectPlateGM(1., 1.), trans)
+        bund = RayBundle(N.c_[[0., 0., 0.]], N.c_[[0., 0., 1.]])
+        N.testing.assert_array_almost_equal(
+            gm.find_intersections(N.eye(4), bund), N.r_[1.])
+
+class TestGridInstancedGM(unittest.TestCase):
+    """The grid walk finds the same hits as testing all instances"""
+    def setUp(self):
+        N.random.seed(9)
+        xs, ys = N.mgrid[-20:21:4., -20:21:4.]
+        num_inst = xs.size
+        normals = N.random.uniform(-0.5, 0.5, (num_inst, 3))
+        normals[:,2] = 1.
+        normals /= N.sqrt(N.sum(normals**2, axis=1))[:,None]
+        x_axes = N.cross(N.r_[0., 1., 0.], normals)
+        x_axes /= N.sqrt(N.sum(x_axes**2, axis=1))[:,None]
+        
+        self.transforms = N.zeros((num_inst, 4, 4))
+        self.transforms[:,:3,0] = x_axes
+        self.transforms[:,:3,1] = N.cross(normals, x_axes)
+        self.transforms[:,:3,2] = normals
+        self.transforms[:,:3,3] = N.c_[xs.flatten(), ys.flatten(),
+            N.random.uniform(0, 1, num_inst)]
+        self.transforms[:,3,3] = 1.
+        self.frame = generate_transform(N.r_[0., 0., 1.], 0.4,
+            N.c_[[1., -2., 0.5]])
+    
+    def compare(self, bund, cell_size=None):
+        proto = RectPlateGM(3.5, 3.)
+        plain = InstancedGM(proto, self.transforms)
+        grid = GridInstancedGM(proto, self.transforms, cell_size)
+        correct = plain.find_intersections(self.frame, bund)
+        params = grid.find_intersections(self.frame, bund)
+        N.testing.assert_array_almost_equal(params, correct)
+        
+        hit = N.nonzero(N.isfinite(params))[0]
+        self.assertTrue(len(hit) > 0)
+        plain.select_rays(hit)
+        grid.select_rays(hit)
+        N.testing.assert_array_equal(grid.get_instance_indices(),
+            plain.get_instance_indices())
+    
+    def test_oblique(self):
+        """Low rays crossing many cells, from above and below"""
+        num_rays = 2000
+        verts = N.random.uniform(-25, 25, (3, num_rays))
+        verts[2] = N.random.uniform(-2, 3, num_rays)
+        dirs = N.random.uniform(-1, 1, (3, num_rays))
+        dirs[2] *= 0.3
+        dirs /= N.sqrt(N.sum(dirs**2, axis=0))
+        bund = RayBundle(verts, dirs)
+        self.compare(bund)
+        self.compare(bund, 1.3)
+    
+    def test_vertical(self):
+        """Rays parallel to the grid axes"""
+        verts = N.random.uniform(-22, 22, (3, 500))
+        verts[2] = 10.
+        dirs = N.tile(N.c_[[0., 0., -1.]], (1, 500))
+        self.compare(RayBundle(verts, dirs))
+        
+        dirs = N.tile(N.c_[[1., 0., 0.]], (1, 500))
+        verts[0] = -30.
+        verts[2] = N.random.uniform(0, 1, 500)
+        self.compare(RayBundle(verts, dirs))
+    
+    def test_prototype(self):
+        """Only rectangles can be gridded"""
+        self.assertRaises(TypeError, GridInstancedGM, RoundPlateGM(1.),
+            self.transforms)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# Tests for the kernel registry, and agreement of optional backends with the
+# reference NumPy kernels.
+
+import unittest
+import numpy as N
+
+from tracer import kernels
+from tracer.spatial_geometry import generate_transform
+
+class TestRegistry(unittest.TestCase):
+    def tearDown(self):
+        kernels.set_backend('numpy')
+
+    def test_reference_available(self):
+        """The NumPy backend is always available and active by default"""
+        self.assertTrue('numpy' in kernels.available_backends())
+        self.assertEqual(kernels.get_backend(), 'numpy')
+
+    def test_unknown_backend(self):
+        """Choosing an unavailable backend raises ValueError"""
+        self.assertRaises(ValueError, kernels.set_backend, 'no-such-backend')
+
+    def test_fallback(self):
+        """Kernels missing from the active backend come from the reference"""
+        kernels.register_kernel('partial', 'reflections', lambda d, n: None)
+        kernels.set_backend('partial')
+        self.assertTrue(kernels.get_kernel('reflections')(None, None) is None)
+        self.assertTrue(kernels.get_kernel('fresnel') is \
+            kernels._backends['numpy']['fresnel'])
+
+class TestNumbaKernels(unittest.TestCase):
+    """The JIT-compiled kernels reproduce the reference kernels"""
+    def setUp(self):
+        if 'numba' not in kernels.available_backends():
+            self.skipTest("Numba is not installed")
+
+        N.random.seed(1)
+        num_rays = 500
+        self.verts = N.random.uniform(-2, 2, (3, num_rays))
+        self.verts[2] += 5
+        dirs = N.random.uniform(-0.5, 0.5, (3, num_rays))
+        dirs[2] = -1
+        self.dirs = dirs/N.sqrt(N.sum(dirs**2, axis=0))
+        self.frame = generate_transform(N.r_[1., 0., 0.], 0.3,
+            N.c_[[0.1, -0.2, 0.3]])
+
+    def compare(self, name, *args):
+        ref = kernels._backends['numpy'][name](*args)
+        jit = kernels._backends['numba'][name](*args)
+        if isinstance(ref, tuple):
+            for r, j in zip(ref, jit):
+                N.testing.assert_array_almost_equal(r, j)
+        else:
+            N.testing.assert_array_almost_equal(ref, jit)
+        return ref
+
+    def test_flat(self):
+        """Flat-plane intersection"""
+        self.compare('flat_intersections', self.frame, self.verts, self.dirs)
+
+    def test_finite_flat(self):
+        """Rectangle, circle and triangle intersections"""
+        params = self.compare('rect_plate_intersections', self.frame,
+            self.verts, self.dirs, N.r_[1., 0.5])[0]
+        self.assertTrue(N.isfinite(params).any() and N.isinf(params).any())
+
+        self.compare('round_plate_intersections', self.frame, self.verts,
+            self.dirs, 1.)
+
+        tri = N.zeros((3,2))
+        tri[:2] = N.array([[1., -0.5], [1., 1.5]])
+        self.compare('triangle_intersections', self.frame, self.verts,
+            self.dirs, tri)
+
+    def test_instanced_rect(self):
+        """Nearest of many rectangles"""
+        frames = N.array([generate_transform(N.r_[1., 0., 0.], ang,
+            N.c_[[ang, -ang, ang]]) for ang in N.linspace(-0.5, 0.5, 7)])
+        params, owner = self.compare('instanced_rect_intersections', frames,
+            self.verts, self.dirs, N.r_[0.5, 0.5], 1e-6)
+        self.assertTrue((owner >= 0).any() and (owner < 0).any())
+
+    def test_quadric(self):
+        """Quadric roots and default root selection"""
+        A = N.r_[1., 1., 0., 1., 2.]
+        B = N.r_[0., -5., 2., 1., 1.]
+        C = N.r_[-4., 4., -3., 1., -1.]
+        hits = self.compare('quadric_roots', A, B, C)
+        self.compare('quadric_select_positive', hits)
+
+    def test_optics(self):
+        """Reflection, refraction and Fresnel reflectance"""
+        normals = N.tile(N.c_[[0., 0., 1.]], (1, self.dirs.shape[1]))
+        self.compare('reflections', self.dirs, normals)
+        self.compare('reflections', self.dirs, normals[:,:1])
+
+        n1 = N.ones(self.dirs.shape[1])
+        self.compare('refractions', n1, 1.5, self.dirs, normals)
+        self.compare('refractions', 1.5*n1, 1., self.dirs, normals)
+        self.compare('fresnel', self.dirs, normals, n1, 1.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,10 +5,11 @@ import math
 
 from tracer.tracer_engine import TracerEngine
 from tracer.ray_bundle import RayBundle
-from tracer.spatial_geometry import general_axis_rotation, generate_transform
+from tracer.spatial_geometry import general_axis_rotation, generate_transform, \
+    translate
 from tracer.sphere_surface import HemisphereGM, CutSphereGM
 from tracer.boundary_shape import BoundarySphere
-from tracer.object import AssembledObject
+from tracer.object import AssembledObject, TransformBatch
 from tracer.assembly import Assembly
 from tracer import assembly
 from tracer.paraboloid import Paraboloid
@@ -264,6 +265,67 @@ class TestNestedAssemblies(unittest.TestCase):
         self.assertEqual(len(subs), 1)
         self.assertTrue(subs[0] is self.sub_assembly)
 
+class TestTransformBatch(unittest.TestCase):
+    """Moving many objects at once is like moving each one"""
+    def setUp(self):
+        self.objects = []
+        for i in xrange(3):
+            surf = Surface(flat_surface.FlatGeometryManager(),
+                optics_callables.perfect_mirror, location=N.r_[0., 0., 1.])
+            bound = BoundarySphere(N.r_[0., 1., 0.], 2.)
+            self.objects.append(AssembledObject(surfs=[surf], bounds=[bound]))
+        self.batch = TransformBatch(self.objects)
+        
+        self.transforms = N.array([generate_transform(N.r_[1., 0., 0.],
+            ang, N.c_[[ang, 0., 0.]]) for ang in N.r_[0.1, 0.2, 0.3]])
+        self.parent = generate_transform(N.r_[0., 0., 1.], 0.5,
+            N.c_[[1., 2., 3.]])
+    
+    def check_frames(self, transforms):
+        for obj, trans in zip(self.objects, transforms):
+            glob = N.dot(self.parent, trans)
+            surf = obj.get_surfaces()[0]
+            N.testing.assert_array_almost_equal(obj.get_transform(), trans)
+            N.testing.assert_array_almost_equal(surf.get_global_transform(),
+                N.dot(glob, surf.get_transform()))
+            N.testing.assert_array_almost_equal(
+                obj.get_boundaries()[0]._temp_loc[:3],
+                N.dot(glob, N.r_[0., 1., 0., 1.])[:3])
+    
+    def test_bulk(self):
+        """Binding and then updating in place give the right frames"""
+        self.batch.set_transforms(self.transforms, self.parent)
+        self.check_frames(self.transforms)
+        
+        self.batch.set_transforms(self.transforms[::-1], self.parent)
+        self.check_frames(self.transforms[::-1])
+    
+    def test_invalidate(self):
+        """An object moved individually is bound again after invalidate()"""
+        self.batch.set_transforms(self.transforms, self.parent)
+        self.objects[1].set_transform(N.eye(4))
+        self.batch.invalidate()
+        self.batch.set_transforms(self.transforms, self.parent)
+        self.check_frames(self.transforms)
+
+    def test_moved_member(self):
+        """Objects and surfaces moved individually are bound again"""
+        self.batch.set_transforms(self.transforms, self.parent)
+        self.objects[1].set_transform(N.eye(4))
+        N.testing.assert_array_equal(self.batch.get_transforms()[1], N.eye(4))
+        self.batch.set_transforms(self.transforms[::-1], self.parent)
+        self.check_frames(self.transforms[::-1])
+        
+        surf = self.objects[2].get_surfaces()[0]
+        surf.set_transform(translate(0., 0., 2.))
+        self.objects[2].transform_children(N.eye(4))
+        self.batch.set_transforms(self.transforms, self.parent)
+        self.check_frames(self.transforms)
+        
+        # Bound again, moving with the batch:
+        self.batch.set_transforms(self.transforms[::-1], self.parent)
+        self.check_frames(self.transforms[::-1])
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -5,6 +5,7 @@ import numpy as N
 from tracer import optics_callables
 from tracer.ray_bundle import RayBundle
 from tracer.flat_surface import FlatGeometryManager
+from tracer.hit_record import HitRecord
 
 class TestReflective(unittest.TestCase):
     def setUp(self):
@@ -21,7 +22,7 @@ class TestReflective(unittest.TestCase):
         """A correct bundle is generated by reflective, with energy reduced correctly"""
         reflective = optics_callables.Reflective(0.1)
         self.gm.select_rays(N.arange(4))
-        outg = reflective(self.gm, self._bund, N.arange(4))
+        outg = reflective(HitRecord(self.gm, self._bund, N.arange(4)))
         
         correct_pts = N.zeros((3,4))
         correct_pts[:2,0] = 1
@@ -37,7 +38,7 @@ class TestReflective(unittest.TestCase):
         """Perfect mirroring works"""
         reflective = optics_callables.Reflective(0)
         self.gm.select_rays(N.arange(4))
-        outg = reflective(self.gm, self._bund, N.arange(4))
+        outg = reflective(HitRecord(self.gm, self._bund, N.arange(4)))
         N.testing.assert_array_equal(outg.get_energy(), N.r_[100, 200, 300, 400])
     
     def test_receiver(self):
@@ -46,8 +47,9 @@ class TestReflective(unittest.TestCase):
         self.gm.select_rays(N.arange(4))
         
         # Round one:
-        outg = receiver(self.gm, self._bund, N.arange(4))
-        N.testing.assert_array_equal(outg.get_energy(), 0)
+        self.assertTrue(receiver.is_terminal())
+        outg = receiver(HitRecord(self.gm, self._bund, N.arange(4)))
+        self.failUnlessEqual(outg.get_num_rays(), 0)
         absorbed, hits = receiver.get_all_hits()
         N.testing.assert_array_equal(absorbed, N.r_[100, 200, 300, 400])
         correct_pts = N.zeros((3,4))
@@ -55,11 +57,65 @@ class TestReflective(unittest.TestCase):
         N.testing.assert_array_equal(hits, correct_pts)
         
         # Round two:
-        outg = receiver(self.gm, self._bund, N.arange(4))
+        outg = receiver(HitRecord(self.gm, self._bund, N.arange(4)))
         absorbed, hits = receiver.get_all_hits()
         N.testing.assert_array_equal(absorbed, N.tile(N.r_[100, 200, 300, 400], 2))
         N.testing.assert_array_equal(hits, N.tile(correct_pts, (1,2)))
 
+    def test_partial_receiver(self):
+        """A partially reflective receiver is not terminal"""
+        receiver = optics_callables.ReflectiveReceiver(0.5)
+        self.assertFalse(receiver.is_terminal())
+        self.gm.select_rays(N.arange(4))
+        
+        outg = receiver(HitRecord(self.gm, self._bund, N.arange(4)))
+        N.testing.assert_array_equal(outg.get_energy(), N.r_[50, 100, 150, 200])
+        absorbed, hits = receiver.get_all_hits()
+        N.testing.assert_array_equal(absorbed, N.r_[50, 100, 150, 200])
+
+class TestHitRecord(unittest.TestCase):
+    def test_gathered_once(self):
+        """Hit record data is gathered from the hitting rays, once"""
+        dir = N.c_[[1, 1, -1], [-1, 1, -1], [-1, -1, -1], [1, -1, -1]] / N.sqrt(3)
+        position = N.c_[[0,0,1], [1,-1,1], [1,1,1], [-1,1,1]]
+        bund = RayBundle(position, dir, energy=N.r_[100, 200, 300, 400])
+        
+        gm = FlatGeometryManager()
+        gm.find_intersections(N.eye(4), bund)
+        selector = N.r_[1, 3]
+        gm.select_rays(selector)
+        hits = HitRecord(gm, bund, selector)
+        
+        self.failUnlessEqual(hits.get_num_hits(), 2)
+        N.testing.assert_array_equal(hits.get_energy(), N.r_[200, 400])
+        N.testing.assert_array_equal(hits.get_directions(), dir[:,selector])
+        self.assertTrue(hits.get_directions() is hits.get_directions())
+        N.testing.assert_array_equal(hits.get_normals(), N.c_[[0, 0, 1]])
+    
+    def test_subset(self):
+        """A subset of the hits restricts both ray and geometry data"""
+        dir = N.c_[[0, 0, -1], [0, 0, 1], [0, 0, -1]]
+        position = N.c_[[0, 0, 1], [1, 0, -1], [2, 0, 1]]
+        bund = RayBundle(position, dir, energy=N.r_[100, 200, 300])
+        
+        gm = FlatGeometryManager()
+        gm.find_intersections(N.eye(4), bund)
+        selector = N.arange(3)
+        gm.select_rays(selector)
+        hits = HitRecord(gm, bund, selector).subset(N.r_[1, 2])
+        
+        N.testing.assert_array_equal(hits.get_selector(), N.r_[1, 2])
+        N.testing.assert_array_equal(hits.get_energy(), N.r_[200, 300])
+        N.testing.assert_array_equal(hits.get_intersection_points(),
+            N.c_[[1, 0, 0], [2, 0, 0]])
+        N.testing.assert_array_equal(hits.get_normals(),
+            N.c_[[0, 0, -1], [0, 0, 1]])
+        
+        hits = hits.subset(N.r_[1])
+        N.testing.assert_array_equal(hits.get_selector(), N.r_[2])
+        N.testing.assert_array_equal(hits.get_intersection_points(),
+            N.c_[[2, 0, 0]])
+
 class TestRefractiveHomogenous(unittest.TestCase):
     def test_all_refracted(self):
         dir = N.c_[[1, 1, -1], [-1, 1, -1], [-1, -1, -1], [1, -1, -1]] / N.sqrt(3)
@@ -72,7 +128,7 @@ class TestRefractiveHomogenous(unittest.TestCase):
         refractive = optics_callables.RefractiveHomogenous(1,1.5)
         selector = N.array([0, 1, 3])
         gm.select_rays(selector)
-        outg = refractive(gm, bund, selector)
+        outg = refractive(HitRecord(gm, bund, selector))
         
         correct_pts = N.zeros((3,4))
         correct_pts[:2,0] = 1
@@ -100,7 +156,7 @@ class TestRefractiveHomogenous(unittest.TestCase):
         refractive = optics_callables.RefractiveHomogenous(1.,1.5)
         selector = N.r_[0]
         gm.select_rays(selector)
-        outg = refractive(gm, bund, selector)
+        outg = refractive(HitRecord(gm, bund, selector))
         
         self.failUnlessEqual(outg.get_vertices().shape, (3,1))
         N.testing.assert_array_equal(outg.get_directions(), 
@@ -108,6 +164,40 @@ class TestRefractiveHomogenous(unittest.TestCase):
         N.testing.assert_array_equal(outg.get_energy(), N.r_[100])
         N.testing.assert_array_equal(outg.get_parents(), N.r_[0])
 
+    def test_stochastic(self):
+        """Stochastic branching keeps ray count and the expected energy split"""
+        num_rays = 20000
+        dir = N.tile(N.c_[[1, 1, -1]] / N.sqrt(3), (1, num_rays))
+        position = N.tile(N.c_[[0, 0, 1]], (1, num_rays))
+        bund = RayBundle(position, dir, energy=N.ones(num_rays),
+            ref_index=N.ones(num_rays))
+        
+        gm = FlatGeometryManager()
+        gm.find_intersections(N.eye(4), bund)
+        selector = N.arange(num_rays)
+        gm.select_rays(selector)
+        hits = HitRecord(gm, bund, selector)
+        
+        split = optics_callables.RefractiveHomogenous(1, 1.5)(hits)
+        R = split.get_energy()[0]
+        
+        N.random.seed(7)
+        refractive = optics_callables.RefractiveHomogenous(1, 1.5, True)
+        outg = refractive(hits)
+        
+        self.failUnlessEqual(outg.get_num_rays(), num_rays)
+        N.testing.assert_array_equal(outg.get_energy(), 1.)
+        N.testing.assert_array_equal(outg.get_parents(), selector)
+        
+        reflected = outg.get_directions()[2] > 0
+        self.failUnlessAlmostEqual(reflected.mean(), R, 2)
+        N.testing.assert_array_equal(outg.get_ref_index(),
+            N.where(reflected, 1, 1.5))
+        N.testing.assert_array_equal(outg.get_directions()[:,reflected],
+            split.get_directions()[:,:num_rays][:,reflected])
+        N.testing.assert_array_equal(outg.get_directions()[:,~reflected],
+            split.get_directions()[:,num_rays:][:,~reflected])
+
 class TestAbsorberReflector(unittest.TestCase):
     def test_up_down(self):
         """Rays coming from below are absorbed, from above reflected"""
@@ -130,12 +220,49 @@ class TestAbsorberReflector(unittest.TestCase):
         absref = optics_callables.AbsorberReflector(0.)
         selector = N.arange(8)
         gm.select_rays(selector)
-        outg = absref(gm, bund, selector)
+        outg = absref(HitRecord(gm, bund, selector))
         
         e = outg.get_energy()
         N.testing.assert_array_equal(e[:4], 100)
         N.testing.assert_array_equal(e[4:], 0)
 
+class TestContributorTagger(unittest.TestCase):
+    def setUp(self):
+        dir = N.c_[[1, 1, -1], [-1, 1, -1], [-1, -1, -1], [1, -1, -1]] / N.sqrt(3)
+        position = N.c_[[0,0,1], [1,-1,1], [1,1,1], [-1,1,1]]
+        self._bund = RayBundle(position, dir, energy=N.r_[100, 200, 300, 400])
+        self.gm = FlatGeometryManager()
+        self.gm.find_intersections(N.eye(4), self._bund)
+        self.gm.select_rays(N.arange(4))
+    
+    def test_first_tag_kept(self):
+        """Rays are tagged by the first tagging surface only"""
+        bund = optics_callables.with_contributors(self._bund)
+        bund.set_contributor(N.r_[-1, 2, -1, 3])
+        tagger = optics_callables.ContributorTagger(
+            optics_callables.Reflective(0), 5)
+        outg = tagger(HitRecord(self.gm, bund, N.arange(4)))
+        N.testing.assert_array_equal(outg.get_contributor(), [5, 2, 5, 3])
+        
+        # Inherited by the next surface's rays:
+        receiver = optics_callables.ReflectiveReceiver()
+        gm = FlatGeometryManager()
+        gm.find_intersections(N.eye(4), outg.inherit(direction=
+            -outg.get_directions(), vertices=outg.get_vertices() + 1.))
+        gm.select_rays(N.r_[0, 1, 3])
+        receiver(HitRecord(gm, outg, N.r_[0, 1, 3]))
+        N.testing.assert_array_equal(receiver.get_contributions(7),
+            [0, 0, 200, 400, 0, 100, 0])
+        N.testing.assert_array_equal(receiver.get_all_contributors(),
+            [5, 2, 3])
+    
+    def test_untagged_receiver(self):
+        """Contributions need tagged rays"""
+        receiver = optics_callables.ReflectiveReceiver()
+        receiver(HitRecord(self.gm, self._bund, N.arange(4)))
+        self.assertRaises(ValueError, receiver.get_contributions)
+        self.assertRaises(ValueError, receiver.get_all_contributors)
+
 class TestLambertian(unittest.TestCase):
     def setUp(self):
         """Set up the ray bundle and geometry"""
@@ -151,7 +278,7 @@ class TestLambertian(unittest.TestCase):
         """A correct bundle from Lambertian, with energy reduced correctly"""
         lamb = optics_callables.LambertianReflector(0.1)
         self.gm.select_rays(N.arange(4))
-        outg = lamb(self.gm, self._bund, N.arange(4))
+        outg = lamb(HitRecord(self.gm, self._bund, N.arange(4)))
         
         correct_pts = N.zeros((3,4))
         correct_pts[:2,0] = 1
@@ -165,7 +292,7 @@ class TestLambertian(unittest.TestCase):
         """Perfect mirroring works"""
         reflective = optics_callables.Reflective(0)
         self.gm.select_rays(N.arange(4))
-        outg = reflective(self.gm, self._bund, N.arange(4))
+        outg = reflective(HitRecord(self.gm, self._bund, N.arange(4)))
         N.testing.assert_array_equal(outg.get_energy(), N.r_[100, 200, 300, 400])
     
     def test_receiver(self):
@@ -174,8 +301,9 @@ class TestLambertian(unittest.TestCase):
         self.gm.select_rays(N.arange(4))
         
         # Round one:
-        outg = receiver(self.gm, self._bund, N.arange(4))
-        N.testing.assert_array_equal(outg.get_energy(), 0)
+        self.assertTrue(receiver.is_terminal())
+        outg = receiver(HitRecord(self.gm, self._bund, N.arange(4)))
+        self.failUnlessEqual(outg.get_num_rays(), 0)
         absorbed, hits = receiver.get_all_hits()
         N.testing.assert_array_equal(absorbed, N.r_[100, 200, 300, 400])
         correct_pts = N.zeros((3,4))
@@ -183,7 +311,7 @@ class TestLambertian(unittest.TestCase):
         N.testing.assert_array_equal(hits, correct_pts)
         
         # Round two:
-        outg = receiver(self.gm, self._bund, N.arange(4))
+        outg = receiver(HitRecord(self.gm, self._bund, N.arange(4)))
         absorbed, hits = receiver.get_all_hits()
         N.testing.assert_array_equal(absorbed, N.tile(N.r_[100, 200, 300, 400], 2))
         N.testing.assert_array_equal(hits, N.tile(correct_pts, (1,2)))
@@ -0,0 +1,100 @@
+# Tests for the quasi-Monte Carlo samplers and their use in ray sources.
+
+import unittest
+import numpy as N
+
+from tracer import qmc
+from tracer.sources import solar_disk_bundle, pillbox_sunshape_directions
+
+class TestSobol(unittest.TestCase):
+    def test_unscrambled(self):
+        """The first points of the plain Sobol sequence are the known ones"""
+        pts = qmc.Sobol(scramble=False)(8, 2)
+        N.testing.assert_array_equal(pts[0],
+            N.r_[0, 0.5, 0.25, 0.75, 0.125, 0.625, 0.375, 0.875])
+        N.testing.assert_array_equal(pts[1],
+            N.r_[0, 0.5, 0.75, 0.25, 0.625, 0.125, 0.375, 0.875])
+
+    def check_stratified(self, pts, m):
+        """Each run of 2**m points has one point in each 2**-m interval."""
+        for run in xrange(pts.shape[1] // 2**m):
+            cells = N.floor(pts[:,run*2**m:(run + 1)*2**m]*2**m)
+            for dim in cells:
+                N.testing.assert_array_equal(N.sort(dim), N.arange(2**m))
+
+    def test_stratified(self):
+        """Scrambled Sobol points keep the stratification"""
+        sampler = qmc.Sobol(seed=5)
+        pts = sampler(256, 4)
+        self.assertTrue(N.all((pts >= 0) & (pts < 1)))
+        self.check_stratified(pts, 8)
+        self.check_stratified(pts, 5)
+
+        # Continuing the sequence continues the stratification:
+        self.check_stratified(sampler(256, 4), 8)
+
+    def test_chunks(self):
+        """Consecutive calls continue the sequence of a single draw"""
+        for scramble in (False, True):
+            whole = qmc.Sobol(scramble=scramble, seed=7)(1000, 3)
+            sampler = qmc.Sobol(scramble=scramble, seed=7)
+            chunks = N.hstack([sampler(num, 3) for num in (4, 2, 3, 91, 900)])
+            N.testing.assert_array_equal(chunks, whole)
+
+    def test_seed(self):
+        """Seeding reproduces the scrambling"""
+        N.testing.assert_array_equal(qmc.Sobol(seed=3)(16, 3),
+            qmc.Sobol(seed=3)(16, 3))
+        self.assertFalse(N.all(qmc.Sobol(seed=3)(16, 3) == \
+            qmc.Sobol(seed=4)(16, 3)))
+
+class TestHalton(unittest.TestCase):
+    def test_unscrambled(self):
+        """Plain Halton points are radical inverses in prime bases"""
+        pts = qmc.Halton(scramble=False)(5, 2)
+        N.testing.assert_array_almost_equal(pts[0],
+            N.r_[0.5, 0.25, 0.75, 0.125, 0.625])
+        N.testing.assert_array_almost_equal(pts[1],
+            N.r_[1./3, 2./3, 1./9, 4./9, 7./9])
+
+    def test_scrambled(self):
+        """Scrambling permutes digits, keeping base-b stratification"""
+        pts = qmc.Halton(shift=True, seed=2)(9, 2)
+        self.assertTrue(N.all((pts >= 0) & (pts < 1)))
+        # 9 consecutive points starting at index 1 still fill the 3
+        # intervals of a base-3 digit 3 times each:
+        N.testing.assert_array_equal(
+            N.bincount(N.floor(pts[1]*3).astype(N.int), minlength=3), 3)
+
+class TestLatinHypercube(unittest.TestCase):
+    def test_strata(self):
+        """One point per stratum in each dimension"""
+        pts = qmc.LatinHypercube(seed=1)(50, 3)
+        for dim in pts:
+            N.testing.assert_array_equal(N.sort(N.floor(dim*50)), N.arange(50))
+
+class TestSources(unittest.TestCase):
+    def test_disk_convergence(self):
+        """A Sobol solar disk integrates more accurately than pseudo-random"""
+        num_rays = 1024
+        center = N.c_[[0., 0., 0.]]
+        direct = N.r_[0., 0., -1.]
+        errors = []
+        for seed in xrange(5):
+            rays = solar_disk_bundle(num_rays, center, direct, 2., 0.01,
+                sampler=qmc.Sobol(seed=seed))
+            # The mean of r**2 over a uniform disk is R**2/2.
+            r2 = N.sum(rays.get_vertices()[:2]**2, axis=0)
+            errors.append(r2.mean() - 2.)
+        mean, error = qmc.replicate_error(N.r_[errors])
+        self.assertTrue(N.all(N.abs(errors) < 0.01))
+        self.assertTrue(error < 0.005)
+
+    def test_directions(self):
+        """Sampled directions are within the pillbox"""
+        dirs = pillbox_sunshape_directions(100, 0.1, qmc.Halton(seed=1))
+        N.testing.assert_array_almost_equal(N.sum(dirs**2, axis=0), 1)
+        self.assertTrue(N.all(dirs[2] >= N.cos(0.1) - 1e-12))
+
+if __name__ == '__main__':
+    unittest.main()
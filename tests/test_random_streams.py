@@ -0,0 +1,105 @@
+# Tests for reproducible random streams and parallel tracing with them.
+
+import unittest
+import numpy as N
+
+from tracer.random_streams import RandomStream, as_stream
+from tracer.sources import solar_disk_bundle, solar_disk_bundle_chunks
+from tracer.parallel import trace_chunks, map_forked
+from tracer.tracer_engine import TracerEngine
+from tracer.assembly import Assembly
+from tracer.object import AssembledObject
+from tracer.surface import Surface
+from tracer.flat_surface import FlatGeometryManager
+import tracer.optics_callables as opt
+
+class TestRandomStream(unittest.TestCase):
+    def test_reproducible(self):
+        """A stream is determined by its seed and key"""
+        N.testing.assert_array_equal(RandomStream(5).uniform(size=10),
+            RandomStream(5).uniform(size=10))
+        N.testing.assert_array_equal(RandomStream(5).spawn(3).uniform(size=10),
+            RandomStream(5, (3,)).uniform(size=10))
+        self.assertFalse(N.all(RandomStream(5).uniform(size=10) == \
+            RandomStream(5).spawn(0).uniform(size=10)))
+
+    def test_spawn_independent_of_draws(self):
+        """Substreams do not depend on the parent's position"""
+        stream = RandomStream(8)
+        first = stream.spawn(2).uniform(size=5)
+        stream.uniform(size=100)
+        N.testing.assert_array_equal(stream.spawn(2).uniform(size=5), first)
+
+    def test_no_seed(self):
+        """A seed is generated and can reproduce the stream"""
+        stream = RandomStream()
+        vals = stream.uniform(size=5)
+        N.testing.assert_array_equal(
+            RandomStream(stream.get_seed()).uniform(size=5), vals)
+        self.assertTrue(as_stream(stream) is stream)
+
+    def test_source(self):
+        """Sources draw from a given stream"""
+        args = (100, N.c_[[0., 0., 0.]], N.r_[0., 0., -1.], 1., 0.01)
+        b1 = solar_disk_bundle(*args, prng=RandomStream(3))
+        b2 = solar_disk_bundle(*args, prng=RandomStream(3))
+        N.testing.assert_array_equal(b1.get_vertices(), b2.get_vertices())
+        N.testing.assert_array_equal(b1.get_directions(), b2.get_directions())
+
+class TestParallelTrace(unittest.TestCase):
+    """
+    A diffuse floor reflecting to a receiving ceiling, so that the hits on
+    the receiver depend on the random numbers of the optics.
+    """
+    def setUp(self):
+        self.receiver = opt.ReflectiveReceiver()
+        floor = Surface(FlatGeometryManager(), opt.LambertianReflector(0.5))
+        ceiling = Surface(FlatGeometryManager(), self.receiver,
+            location=N.r_[0., 0., 2.])
+        self.engine = TracerEngine(Assembly(objects=[
+            AssembledObject(surfs=[floor, ceiling])]))
+
+        self.stream = RandomStream(42)
+        self.source_args = (N.c_[[0., 0., 1.]], N.r_[0., 0., -1.], 1., 0.1,
+            1000.)
+
+    def source(self, chunk_idx):
+        chunks = solar_disk_bundle_chunks(400, 100, *self.source_args,
+            seed=self.stream.spawn(0))
+        for i, bund in enumerate(chunks):
+            if i == chunk_idx:
+                return bund
+
+    def serial(self):
+        chunks = solar_disk_bundle_chunks(400, 100, *self.source_args,
+            seed=self.stream.spawn(0))
+        self.engine.ray_tracer(chunks, 10, 1e-6, prng=self.stream.spawn(1))
+        return self.receiver.get_all_hits()
+
+    def test_serial_reproducible(self):
+        """The same streams give the same trace"""
+        absorbed, hits = self.serial()
+        self.receiver.reset()
+        absorbed2, hits2 = self.serial()
+        N.testing.assert_array_equal(hits, hits2)
+        N.testing.assert_array_equal(absorbed, absorbed2)
+        self.failUnlessEqual(len(absorbed), 400)
+
+    def test_parallel(self):
+        """A parallel trace is bit-identical to a serial one"""
+        absorbed, hits = self.serial()
+        for processes in (1, 3):
+            results = trace_chunks(self.engine, self.source, 4, 10, 1e-6,
+                [self.receiver], self.stream.spawn(1), processes)
+            N.testing.assert_array_equal(results[0][0], absorbed)
+            N.testing.assert_array_equal(results[0][1], hits)
+
+    def test_map_forked(self):
+        """Workers share an unpicklable job and return results in order"""
+        job = lambda item: item**2
+        for processes in (1, 3):
+            self.failUnlessEqual(map_forked(lambda job, item: job(item), job,
+                range(5), processes), [0, 1, 4, 9, 16])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,7 +7,14 @@ import numpy as N
 from scipy import stats
 
 import tracer.ray_bundle as RB
-from tracer.sources import solar_disk_bundle
+from tracer.sources import solar_disk_bundle, solar_disk_bundle_chunks, \
+    chunk_prng, rect_apertures_bundle
+from tracer.surface import Surface
+from tracer.flat_surface import RectPlateGM
+from tracer.object import AssembledObject
+from tracer.assembly import Assembly
+from tracer.tracer_engine import TracerEngine
+import tracer.optics_callables as opt
 
 class TestInheritance(unittest.TestCase):
     def test_inherit_empty_from_empty(self):
@@ -184,6 +191,65 @@ class TestDistributions(unittest.TestCase):
 
         rays = solar_disk_bundle(5000, center, dir, R, theta_max, flux=1000.)
         N.testing.assert_array_equal(rays.get_energy(), N.pi*4/5.)
+    
+    def test_chunks(self):
+        """Chunked solar disk: consistent energy, reproducible chunks"""
+        dir = N.array([0., 0, 1])
+        center = N.array([0,  0, 0]).reshape(-1, 1)
+        R = 2; theta_max = N.pi/100.
         
+        chunks = list(solar_disk_bundle_chunks(5000, 2000, center, dir, R,
+            theta_max, 1000., seed=17))
+        self.failUnlessEqual([c.get_num_rays() for c in chunks],
+            [2000, 2000, 1000])
+        for c in chunks:
+            N.testing.assert_array_equal(c.get_energy(), N.pi*4/5.)
+            self.assert_radius(c.get_vertices(), center, R)
+        self.assertFalse(N.any(
+            chunks[0].get_vertices()[:2,:1000] == chunks[2].get_vertices()[:2]))
+        
+        # Any chunk may be regenerated alone:
+        again = solar_disk_bundle(1000, center, dir, R, theta_max,
+            prng=chunk_prng(17, 2))
+        N.testing.assert_array_equal(again.get_vertices(),
+            chunks[2].get_vertices())
+        N.testing.assert_array_equal(again.get_directions(),
+            chunks[2].get_directions())
+        
+class TestRectApertures(unittest.TestCase):
+    def setUp(self):
+        self.lower = Surface(RectPlateGM(2., 2.), opt.ReflectiveReceiver())
+        self.upper = Surface(RectPlateGM(2., 2.), opt.ReflectiveReceiver(),
+            location=N.r_[1., 0., 1.])
+        self.assembly = Assembly(objects=[
+            AssembledObject(surfs=[self.lower, self.upper])])
+    
+    def test_single(self):
+        """Rays aimed at one plate hit it with the projected-area energy"""
+        direct = N.r_[N.sin(N.pi/3), 0., -N.cos(N.pi/3)]
+        rays = rect_apertures_bundle([self.lower], 1000, direct, 0.005, 10.)
+        
+        N.testing.assert_array_almost_equal(rays.get_energy(), 4*10*0.5/1000.)
+        dirs = rays.get_directions()
+        t = -rays.get_vertices()[2]/dirs[2]
+        hits = rays.get_vertices() + t*dirs
+        self.assertTrue(N.all(abs(hits[:2]) <= 1 + 1e-10))
+    
+    def test_overlap(self):
+        """Overlapping apertures share the light falling on both"""
+        rays = rect_apertures_bundle([self.lower, self.upper], 2000,
+            N.r_[0., 0., -1.], 0., 1.)
+        vz = rays.get_vertices()[2]
+        self.assertTrue(N.all(vz == vz[0]) and vz[0] > 1.)
+        
+        e = TracerEngine(self.assembly)
+        e.ray_tracer(rays, 1, 0.05)
+        lower_e = self.lower.get_optics_manager().get_all_hits()[0].sum()
+        upper_e = self.upper.get_optics_manager().get_all_hits()[0].sum()
+        self.assertAlmostEqual(upper_e, 4., 1)
+        self.assertAlmostEqual(lower_e, 2., 1)
+        self.assertAlmostEqual(lower_e + upper_e, 6., 1)
+        self.assertAlmostEqual(lower_e + upper_e, rays.get_energy().sum())
+
 if __name__ == '__main__':
     unittest.main()
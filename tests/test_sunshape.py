@@ -0,0 +1,83 @@
+# Tests for tabulated sunshapes.
+
+import unittest
+import os
+import tempfile
+import numpy as N
+
+from tracer import sunshape
+from tracer.sources import solar_disk_bundle
+
+class TestTabulated(unittest.TestCase):
+    def test_pillbox(self):
+        """A constant profile reproduces the pillbox distribution"""
+        a = 4.65e-3
+        shape = sunshape.TabulatedSunshape(N.r_[0, a], N.r_[1., 1.])
+        xi = N.linspace(0, 1, 101)
+        correct = N.arccos(1 - xi*(1 - N.cos(a)))
+        N.testing.assert_allclose(shape.angles(xi), correct, atol=a*1e-4)
+        self.failUnlessEqual(shape.get_max_angle(), a)
+
+    def test_directions(self):
+        """Drawn directions are unit vectors within the profile"""
+        shape = sunshape.TabulatedSunshape(N.r_[0, 0.01, 0.02, 0.03],
+            N.r_[1., 1., 0.1, 0.])
+        dirs = shape.directions(1000)
+        N.testing.assert_array_almost_equal(N.sum(dirs**2, axis=0), 1)
+        self.assertTrue(N.all(dirs[2] >= N.cos(0.03)))
+        self.failUnlessEqual(shape.get_max_angle(), 0.03)
+
+    def test_bad_profile(self):
+        """Profiles that are not increasing in angle are rejected"""
+        self.assertRaises(ValueError, sunshape.TabulatedSunshape,
+            N.r_[0, 0.02, 0.01], N.ones(3))
+
+class TestBuie(unittest.TestCase):
+    def test_csr(self):
+        """The circumsolar fraction of drawn angles is close to the CSR"""
+        shape = sunshape.buie_sunshape(0.1)
+        theta = shape.angles(N.linspace(0, 1, 100001))
+        self.assertAlmostEqual((theta > 4.65e-3).mean(), 0.1, 2)
+        self.assertTrue(theta.max() <= 43.6e-3)
+
+    def test_cached(self):
+        """The lookup table is calculated once per CSR"""
+        self.assertTrue(sunshape.buie_sunshape(0.05) is \
+            sunshape.buie_sunshape(0.05))
+        self.assertFalse(sunshape.buie_sunshape(0.05) is \
+            sunshape.buie_sunshape(0.2))
+
+class TestLoad(unittest.TestCase):
+    def setUp(self):
+        fd, self.fname = tempfile.mkstemp(suffix='.txt')
+        f = os.fdopen(fd, 'w')
+        f.write("# angle [mrad], radiance\n0 1\n4 1\n5 0.01\n20 0.001\n")
+        f.close()
+
+    def tearDown(self):
+        os.remove(self.fname)
+
+    def test_load(self):
+        """A profile file is read in the given angle units"""
+        shape = sunshape.load_sunshape(self.fname)
+        theta, radiance = shape.get_profile()
+        N.testing.assert_array_almost_equal(theta, N.r_[0, 4, 5, 20]*1e-3)
+        N.testing.assert_array_equal(radiance, N.r_[1, 1, 0.01, 0.001])
+        self.assertTrue(sunshape.load_sunshape(self.fname) is shape)
+
+        shape = sunshape.load_sunshape(self.fname, 'deg')
+        N.testing.assert_array_almost_equal(shape.get_profile()[0],
+            N.radians(N.r_[0, 4, 5, 20]))
+
+    def test_disk_bundle(self):
+        """A solar disk with a tabulated sunshape"""
+        shape = sunshape.load_sunshape(self.fname)
+        direct = N.r_[0., 1., 0.]
+        rays = solar_disk_bundle(1000, N.c_[[0., 0., 0.]], direct, 1., None,
+            flux=1000., sunshape=shape)
+        cos_dev = N.dot(direct, rays.get_directions())
+        self.assertTrue(N.all(cos_dev >= N.cos(20e-3)))
+        self.assertAlmostEqual(rays.get_energy().sum(), 1000*N.pi)
+
+if __name__ == '__main__':
+    unittest.main()
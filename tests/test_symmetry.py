@@ -0,0 +1,122 @@
+# Test the tracing of axisymmetric assemblies in a sector.
+
+import unittest
+import numpy as N
+
+from tracer.ray_bundle import RayBundle
+from tracer.surface import Surface
+from tracer.object import AssembledObject
+from tracer.assembly import Assembly
+from tracer.tracer_engine import TracerEngine
+from tracer.paraboloid import ParabolicDishGM
+from tracer.flat_surface import RoundPlateGM
+from tracer.sources import solar_disk_bundle
+from tracer.symmetry import sector_bundle, radial_flux
+from tracer.spatial_geometry import translate, rotx
+import tracer.optics_callables as opt
+
+class TestDeclaration(unittest.TestCase):
+    def setUp(self):
+        self.asm = Assembly()
+        self.asm.set_symmetry(4, 2., (-1., 1.))
+
+    def test_walls(self):
+        """Declaring a symmetry adds the sector's walls, and removes them"""
+        self.failUnlessEqual(self.asm.get_symmetry(), 4)
+        self.failUnlessEqual(len(self.asm.get_surfaces()), 2)
+
+        self.asm.set_symmetry(8, 2., (-1., 1.))
+        self.failUnlessEqual(len(self.asm.get_surfaces()), 2)
+        self.asm.clear_symmetry()
+        self.failUnlessEqual(self.asm.get_symmetry(), None)
+        self.failUnlessEqual(len(self.asm.get_objects()), 0)
+
+    def test_bad_walls(self):
+        """A failed declaration leaves the previous one in place"""
+        self.assertRaises(ValueError, self.asm.set_symmetry, 1, 2., (-1., 1.))
+        self.assertRaises(ValueError, self.asm.set_symmetry, 6, -2., (-1., 1.))
+        self.assertRaises(ValueError, self.asm.set_symmetry, 6, 2., (1., -1.))
+        self.failUnlessEqual(self.asm.get_symmetry(), 4)
+        self.failUnlessEqual(len(self.asm.get_surfaces()), 2)
+
+        asm = Assembly()
+        self.assertRaises(ValueError, asm.set_symmetry, 6, None, (-1., 1.))
+        self.failUnlessEqual(asm.get_symmetry(), None)
+        self.failUnlessEqual(len(asm.get_objects()), 0)
+
+    def test_reflection(self):
+        """Rays leaving the sector are reflected back into it"""
+        # Heading out through the wall on the XZ plane, and through the wall
+        # on the YZ plane:
+        bund = RayBundle(N.c_[[1., 0.5, 0.], [0.5, 1., 0.]],
+            N.c_[[0., -1., 0.], [-1., 0., 0.]], energy=N.r_[1., 1.],
+            ref_index=N.r_[1., 1.])
+        engine = TracerEngine(self.asm)
+        engine.ray_tracer(bund, 1, 1e-9)
+
+        out = engine.tree[-1]
+        N.testing.assert_array_almost_equal(out.get_vertices(),
+            N.c_[[1., 0., 0.], [0., 1., 0.]])
+        N.testing.assert_array_almost_equal(out.get_directions(),
+            N.c_[[0., 1., 0.], [1., 0., 0.]])
+
+    def test_bundle(self):
+        """The source covers the sector with the full disk's ray density"""
+        self.asm.set_transform(N.dot(translate(1., 2., 3.), rotx(N.pi)))
+        bund = sector_bundle(self.asm, 1000, 0.5, 1.5, 0.01, flux=100.)
+        self.assertAlmostEqual(bund.get_energy().sum(), 100*N.pi*1.5**2/4)
+
+        local = N.dot(rotx(N.pi)[:3,:3].T, bund.get_vertices() - \
+            N.c_[[1., 2., 3.]])
+        N.testing.assert_array_almost_equal(local[2], 0.5)
+        self.failUnless((local[:2] >= 0).all())
+        self.failUnless((N.sum(local[:2]**2, axis=0) <= 1.5**2).all())
+        # Pointing down the local Z axis, i.e. up in global coordinates:
+        self.failUnless((bund.get_directions()[2] > N.cos(0.01)).all())
+
+        self.assertRaises(ValueError, sector_bundle, Assembly(), 10, 0.5, 1.5,
+            0.01)
+
+class TestDish(unittest.TestCase):
+    def plant(self):
+        dish = AssembledObject(surfs=[Surface(ParabolicDishGM(2., 1.),
+            opt.perfect_mirror)])
+        rec = opt.ReflectiveReceiver(1.)
+        rec_obj = AssembledObject(surfs=[Surface(RoundPlateGM(0.1), rec)],
+            transform=translate(0., 0., 1.))
+        return Assembly(objects=[dish, rec_obj]), rec
+
+    def test_full_dish(self):
+        """A sector's radial flux agrees with the full dish's"""
+        num, order = 20000, 6
+        asm, rec = self.plant()
+        bund = solar_disk_bundle(num*order, N.c_[[0., 0., 2.]],
+            N.r_[0., 0., -1.], 1., 0.00465, flux=1000.,
+            prng=N.random.RandomState(0))
+        bund.set_ref_index(N.ones(num*order))
+        TracerEngine(asm).ray_tracer(bund, 100, 1e-9, tree=False)
+        energy, hits = rec.get_all_hits()
+        full, edges = radial_flux(energy, hits, N.eye(4), 1, 0.02, 10)
+
+        asm, rec = self.plant()
+        asm.set_symmetry(order, 1.5, (-1., 3.))
+        bund = sector_bundle(asm, num, 2., 1., 0.00465, flux=1000.,
+            prng=N.random.RandomState(1))
+        bund.set_ref_index(N.ones(num))
+        TracerEngine(asm).ray_tracer(bund, 100, 1e-9, tree=False)
+        s_energy, s_hits = rec.get_all_hits()
+        sector, s_edges = radial_flux(s_energy, s_hits, N.eye(4), order,
+            0.02, 10)
+
+        # The walls keep the flux in the sector:
+        angs = N.arctan2(s_hits[1], s_hits[0])
+        self.failUnless((angs > -1e-9).all() and \
+            (angs < 2*N.pi/order + 1e-9).all())
+
+        N.testing.assert_array_equal(s_edges, edges)
+        self.assertAlmostEqual(s_energy.sum()*order/energy.sum(), 1., 2)
+        # The focal spot, where most of the energy is:
+        N.testing.assert_allclose(sector[:4], full[:4], rtol=0.05)
+
+if __name__ == '__main__':
+    unittest.main()
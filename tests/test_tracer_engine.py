@@ -284,3 +284,36 @@ class TestNestedAssemblies(unittest.TestCase):
 
 if __name__ == '__main__':
     unittest.main()
+
+class TestTerminalSurface(unittest.TestCase):
+    """
+    Rays hitting a fully absorbing receiver are accounted for by its optics
+    manager, and leave no rays in the tree.
+    """
+    def setUp(self):
+        dir = N.array([[1,1,-1],[-1,1,-1],[-1,-1,-1],[1,-1,-1]]).T/math.sqrt(3)
+        position = N.c_[[0,0,1],[1,-1,1],[1,1,1],[-1,1,1]]
+        self._bund = RayBundle(position, dir, energy=N.r_[1., 2., 3., 4.])
+        
+        self.receiver = Surface(FlatGeometryManager(), opt.ReflectiveReceiver())
+        self.assembly = Assembly(objects=[AssembledObject(surfs=[self.receiver])])
+        self.engine = TracerEngine(self.assembly)
+    
+    def test_absorbed(self):
+        """A terminal receiver records hits and ends the trace"""
+        self.assertTrue(self.receiver.is_terminal())
+        v, d = self.engine.ray_tracer(self._bund, 10, 0.05)
+        
+        self.failUnlessEqual(v.shape, (3, 0))
+        self.failUnlessEqual(self.engine.tree.num_bunds(), 1)
+        absorbed, hits = self.receiver.get_optics_manager().get_all_hits()
+        N.testing.assert_array_equal(absorbed, N.r_[1., 2., 3., 4.])
+    
+    def test_chunks(self):
+        """Tracing a sequence of bundles accumulates hits from all of them"""
+        v, d = self.engine.ray_tracer(iter([self._bund, self._bund]), 10, 0.05)
+        
+        self.failUnlessEqual(v.shape, (3, 0))
+        absorbed, hits = self.receiver.get_optics_manager().get_all_hits()
+        N.testing.assert_array_equal(absorbed, N.tile(N.r_[1., 2., 3., 4.], 2))
+
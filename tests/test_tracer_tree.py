@@ -130,7 +130,7 @@ class TestLowEnergyParenting(unittest.TestCase):
     bundle.
     """
     def setUp(self):
-        absorptive = Surface(RectPlateGM(1., 1.), opt.Reflective(1.),
+        absorptive = Surface(RectPlateGM(1., 1.), opt.Reflective(0.99),
             location=N.r_[ 0.5, 0., 1.])
         reflective = Surface(RectPlateGM(1., 1.), opt.Reflective(0.),
             location=N.r_[-0.5, 0., 1.])
@@ -151,6 +151,19 @@ class TestLowEnergyParenting(unittest.TestCase):
         
         parents = engine.tree.ordered_parents()
         N.testing.assert_equal(parents, [N.r_[2,3, 0, 1]])
+    
+    def test_terminal_not_recorded(self):
+        """Rays absorbed by a terminal surface are not recorded"""
+        absorptive = Surface(RectPlateGM(1., 1.), opt.Reflective(1.),
+            location=N.r_[ 0.5, 0., 1.])
+        reflective = Surface(RectPlateGM(1., 1.), opt.Reflective(0.),
+            location=N.r_[-0.5, 0., 1.])
+        engine = TracerEngine(Assembly(
+            objects=[AssembledObject(surfs=[absorptive, reflective])]))
+        engine.ray_tracer(self.bund, 300, .05)
+        
+        parents = engine.tree.ordered_parents()
+        N.testing.assert_equal(parents, [N.r_[2,3]])
 
 if __name__ == '__main__':
     unittest.main()
@@ -13,7 +13,11 @@ class Assembly(HasFrame):
     Attributes:
     _objects - a list of the objects the assembly contains
     _assemblies - a list of the sub assemblies the assembly contains
+    _symmetry - the declared rotational symmetry order, or None
     """
+    _symmetry = None
+    _sector_walls = None
+
     def __init__(self, objects=None, subassemblies=None, location=None, rotation=None):
         """
         Arguments:
@@ -92,6 +96,48 @@ class Assembly(HasFrame):
         assembly.set_transform(transform)
         self.transform_children()
 
+    def set_symmetry(self, order, radius, z_range):
+        """
+        Declare that the assembly is symmetric about its local Z axis, so it
+        may be traced in one sector of 2*pi/order radians (see
+        tracer.symmetry). The sector is bounded by perfect mirrors, added to
+        the assembly's objects, that reflect rays back into it.
+        
+        Arguments:
+        order - the number of sectors in a full circle.
+        radius - the extent of the boundaries away from the axis. Should
+            cover all of the assembly's surfaces.
+        z_range - a 2-sequence with the lowest and highest Z coordinate of
+            the boundaries, in the assembly's frame. Should cover all of the
+            assembly's surfaces and the source.
+        """
+        if order < 2:
+            raise ValueError("Symmetry order must be at least 2")
+        from .symmetry import sector_walls
+        walls = sector_walls(order, radius, z_range)
+        
+        self.clear_symmetry()
+        self.add_object(walls)
+        self._sector_walls = walls
+        self._symmetry = order
+    
+    def clear_symmetry(self):
+        """
+        Remove a symmetry declared with set_symmetry(), with the sector's
+        boundaries. Does nothing if none was declared.
+        """
+        if self._sector_walls is not None:
+            self._objects.remove(self._sector_walls)
+        self._sector_walls = None
+        self._symmetry = None
+    
+    def get_symmetry(self):
+        """
+        Returns the order of the assembly's declared symmetry about its local
+        Z axis, or None if none was declared.
+        """
+        return self._symmetry
+    
     def set_rotation(self, rotation):
         """
         A recursive version of the parent's set_rotation. Changes the rotation
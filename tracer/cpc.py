@@ -0,0 +1,401 @@
+"""
+Geometry managers of compound parabolic concentrators (CPCs), whose walls
+are exact parabolic profiles, so that a whole CPC is one surface.
+
+The CPC's axis is the local Z axis, with its exit aperture on the XY plane
+and its entrance aperture above it. Each wall's profile is a parabola whose
+focus is the opposite edge of the exit, and whose axis is tilted by the
+acceptance angle from the CPC's axis. A full CPC reaches up to where the
+profile is parallel to the axis; it may be truncated lower.
+
+Intersections are found from the parabola's implicit equation. Along a ray
+it is a quadratic equation for a trough's plane walls, and a quartic one for
+a rotational CPC, solved for all rays at once by the eigenvalues of its
+companion matrix and refined by Newton iterations.
+
+References:
+.. [1] Welford W.T. and Winston R., High Collection Nonimaging Optics, 1989,
+   Academic Press, ch. 4.
+"""
+
+import numpy as N
+from geometry_manager import GeometryManager
+
+# Hits closer than this to the ray's vertex are the vertex's own surface,
+# as in TracerEngine.intersect_ray().
+_MIN_PARAM = 1e-6
+
+def _polymul(a, b):
+    """
+    Multiply polynomials given as arrays of coefficients, lowest order first,
+    with one column per polynomial.
+    """
+    prod = N.zeros((a.shape[0] + b.shape[0] - 1,) + a.shape[1:])
+    for i in xrange(a.shape[0]):
+        for j in xrange(b.shape[0]):
+            prod[i + j] += a[i]*b[j]
+    return prod
+
+def _polyadd(a, b):
+    """Add polynomials given as in _polymul()."""
+    if a.shape[0] < b.shape[0]:
+        a, b = b, a
+    total = a.copy()
+    total[:b.shape[0]] += b
+    return total
+
+def _real_roots(coeffs, newton_steps=2):
+    """
+    Find the real roots of many polynomials at once.
+
+    Arguments:
+    coeffs - a (k+1) by n array, the coefficients of each polynomial of
+        degree up to k, lowest order first.
+    newton_steps - the roots are refined by this many Newton iterations on
+        the polynomial, to undo the companion matrix's loss of precision.
+
+    Returns:
+    a k by n array of the real roots of each polynomial, NaN-padded.
+    """
+    degree, num = coeffs.shape[0] - 1, coeffs.shape[1]
+    roots = N.empty((degree, num))
+    roots.fill(N.nan)
+
+    # A polynomial's degree is that of its last coefficient not negligible
+    # relative to the largest one:
+    scale = abs(coeffs).max(axis=0)
+    significant = abs(coeffs) > 1e-12*scale
+    eff_deg = degree - N.argmax(significant[::-1], axis=0)
+    eff_deg[scale == 0] = 0
+
+    for deg in xrange(1, degree + 1):
+        polys = eff_deg == deg
+        if not polys.any():
+            continue
+        monic = coeffs[:deg, polys]/coeffs[deg, polys]
+        companion = N.zeros((polys.sum(), deg, deg))
+        companion[:, N.arange(1, deg), N.arange(deg - 1)] = 1.
+        companion[:,:,-1] = -monic.T
+        eig = N.linalg.eigvals(companion).T
+
+        # Nearly double roots come out slightly complex:
+        real = abs(eig.imag) <= 1e-6*(1 + abs(eig.real))
+        sub = N.where(real, eig.real, N.nan)
+        roots[:deg, polys] = sub
+
+    deriv = coeffs[1:]*N.arange(1, degree + 1)[:,None]
+    for step in xrange(newton_steps):
+        val = N.zeros_like(roots)
+        slope = N.zeros_like(roots)
+        for power in xrange(degree, -1, -1):
+            val = val*roots + coeffs[power]
+            if power > 0:
+                slope = slope*roots + deriv[power - 1]
+        fix = slope != 0
+        roots[fix] -= val[fix]/slope[fix]
+
+    return roots
+
+class CPCGM(GeometryManager):
+    """
+    A base class for CPC geometry managers. Subclasses define the distance
+    of a point from the CPC's axis, and solve for the candidate
+    intersections:
+
+    _radius(local) - the distance from the axis of each of an array of local
+        points, whose first dimension is the coordinate.
+    _radial(local) - the unit vectors in the local XY plane pointing away
+        from the axis at each point of a 3 by n array.
+    _candidates(v, d) - a k by n array of parametric positions where the
+        rays, with local vertices v and directions d, may hit the profile or
+        its reflection about the axis.
+    _in_bounds(local) - which points, as in _radius(), are within any extra
+        bounds of the surface.
+    """
+    def __init__(self, exit_radius, accept_angle, height=None):
+        """
+        Arguments:
+        exit_radius - the distance of the exit aperture's edge from the axis.
+        accept_angle - the acceptance half-angle of the CPC, in radians.
+        height - of the CPC's entrance above its exit. By default, the full
+            height, where the profile becomes parallel to the axis.
+        """
+        self._a = exit_radius
+        self._sin = N.sin(accept_angle)
+        self._cos = N.cos(accept_angle)
+        # The parabola's focal length:
+        self._f = exit_radius*(1 + self._sin)
+
+        full_height = self._f*self._cos/self._sin**2
+        if height is None:
+            height = full_height
+        elif height > full_height:
+            raise ValueError("A CPC with acceptance angle %g is at most %g " \
+                "high." % (accept_angle, full_height))
+        self._h = height
+
+    def get_height(self):
+        return self._h
+
+    def get_entrance_radius(self):
+        return self.profile(self._h)
+
+    def profile(self, z):
+        """
+        Find the distance of the wall from the axis at given heights.
+
+        Arguments:
+        z - an array of heights above the exit aperture.
+
+        Returns:
+        an array of the same shape, the wall's distance from the axis at each.
+        """
+        # The positive root of the implicit equation (see _implicit()) in
+        # the distance from the focus, at each height:
+        c2, S = self._cos**2, self._sin
+        w = 2*self._f + self._cos*z
+        s = (-w*S + N.sqrt((w*S)**2 - c2*(z**2 - w**2)))/c2
+        return s - self._a
+
+    def _implicit(self, r, z):
+        """
+        The parabola's implicit function, zero on the wall profile, and its
+        gradient, at points given by their distance from the axis and their
+        height. The distance from the profile's focus along the radial
+        direction is s = a + r. [1]
+
+        Returns:
+        F, F_r, F_z - arrays of the function's value and partial derivatives.
+        """
+        s = self._a + r
+        w = 2*self._f + self._cos*z
+        F = (self._cos*s)**2 + 2*w*self._sin*s + z**2 - w**2
+        F_r = 2*self._cos**2*s + 2*w*self._sin
+        F_z = 2*z - 2*w*self._cos + 2*self._cos*self._sin*s
+        return F, F_r, F_z
+
+    def _profile_polys(self, v, d, radius2):
+        """
+        The implicit function along rays is E + G*r for distance r from the
+        axis; on the reflection of the profile about the axis it is E - G*r.
+
+        Arguments:
+        v, d - the local vertices and directions of the rays, 3 by n arrays.
+        radius2 - the squared distance from the axis along the rays, as
+            polynomials in the rays' parameter (see _polymul()).
+
+        Returns:
+        E, G - polynomials in the rays' parameter, of degree 2 and 1.
+        """
+        a, c, S = self._a, self._cos, self._sin
+        z = N.vstack((v[2], d[2]))
+        w = N.vstack((2*self._f + c*v[2], c*d[2]))
+        E = _polyadd(c**2*radius2, _polyadd(
+            _polymul(z, z) - _polymul(w, w), 2*S*a*w))
+        E[0] += (c*a)**2
+        G = 2*S*w
+        G[0] += 2*c**2*a
+        return E, G
+
+    def find_intersections(self, frame, ray_bundle):
+        """
+        Register the working frame and ray bundle, calculate intersections
+        and save the parametric locations of intersection on the surface.
+
+        Arguments:
+        frame - the current frame, represented as a homogenous transformation
+            matrix stored in a 4x4 array.
+        ray_bundle - a RayBundle object with the incoming rays' data.
+
+        Returns:
+        A 1D array with the parametric position of intersection along each of
+            the rays. Rays that missed the surface return +infinity.
+        """
+        GeometryManager.find_intersections(self, frame, ray_bundle)
+        d = N.dot(frame[:3,:3].T, ray_bundle.get_directions())
+        v = N.dot(N.linalg.inv(frame), N.vstack((ray_bundle.get_vertices(),
+            N.ones(d.shape[1]))))[:3]
+
+        # Missing candidates are NaN, and fail all comparisons quietly:
+        oldsettings = N.seterr(invalid='ignore')
+        params = self._candidates(v, d)
+        local = v[:,None,:] + params[None]*d[:,None,:]
+        r = self._radius(local)
+        F = self._implicit(r, local[2])[0]
+        # The candidates on the profile's reflection about the axis:
+        reflected = self._implicit(-r, local[2])[0]
+
+        valid = (params > _MIN_PARAM) & (abs(F) <= abs(reflected)) & \
+            (local[2] >= 0) & (local[2] <= self._h) & self._in_bounds(local)
+        N.seterr(**oldsettings)
+        params[~valid] = N.inf
+
+        first = N.argmin(params, axis=0)
+        cols = N.arange(params.shape[1])
+        self._local = local[:,first,cols]
+        self._params = params[first, cols]
+        return self._params
+
+    def select_rays(self, idxs):
+        """
+        With this method, the ray tracer informs the surface that of the
+        registered rays, only those with the given indexes will be used next.
+        This is used here to trim the internal data structures and save memory.
+
+        Arguments:
+        idx - an array of indexes referring to the rays registered in
+            register_incoming()
+        """
+        self._idxs = idxs
+        local = self._local[:,idxs]
+
+        F, F_r, F_z = self._implicit(self._radius(local), local[2])
+        normals = N.vstack((F_r*self._radial(local), F_z))
+        normals /= N.sqrt(N.sum(normals**2, axis=0))
+
+        # Face the incoming rays:
+        dirs = self._working_bundle.get_directions()[:,idxs]
+        normals = N.dot(self._working_frame[:3,:3], normals)
+        normals[:, N.sum(normals*dirs, axis=0) > 0] *= -1
+        self._norm = normals
+
+        self._global = N.dot(self._working_frame[:3,:3], local) + \
+            self._working_frame[:3,3][:,None]
+        del self._local
+        del self._params
+
+    def get_normals(self):
+        """
+        Report the normal to the surface at the hit point of selected rays in
+        the working bundle.
+        """
+        return self._norm
+
+    def get_intersection_points_global(self):
+        """
+        Get the ray/surface intersection points in the global coordinates.
+
+        Returns:
+        A 3-by-n array for 3 spatial coordinates and n rays selected.
+        """
+        return self._global
+
+    def done(self):
+        """
+        Discard internal data structures. This should be called after all
+        information on the latest bundle's results have been extracted already.
+        """
+        for attr in ('_local', '_params', '_global', '_norm', '_idxs'):
+            if hasattr(self, attr):
+                delattr(self, attr)
+        GeometryManager.done(self)
+
+    def _in_bounds(self, local):
+        return N.ones(local.shape[1:], dtype=N.bool)
+
+    def _heights(self, resolution):
+        return N.linspace(0, self._h, max(2, int(N.ceil(self._h*resolution)) + 1))
+
+class RotationalCPCGM(CPCGM):
+    """
+    A 3D CPC, made by rotating the profile about the axis, with a circular
+    exit aperture.
+    """
+    def _radius(self, local):
+        return N.sqrt(local[0]**2 + local[1]**2)
+
+    def _radial(self, local):
+        return local[:2]/self._radius(local)
+
+    def _candidates(self, v, d):
+        # Squaring E = -G*r gives a quartic in the rays' parameter:
+        radius2 = N.vstack((v[0]**2 + v[1]**2, 2*(v[0]*d[0] + v[1]*d[1]),
+            d[0]**2 + d[1]**2))
+        E, G = self._profile_polys(v, d, radius2)
+        quartic = _polymul(E, E) - _polymul(_polymul(G, G), radius2)
+        return _real_roots(quartic)
+
+    def mesh(self, resolution):
+        """
+        Represent the surface as a mesh in local coordinates. Uses cylindrical
+        bins, i.e. the points are equally distributed by angle and height,
+        not by x,y.
+
+        Arguments:
+        resolution - in points per unit length (so the number of points
+            returned is O(A*resolution**2) for area A)
+
+        Returns:
+        x, y, z - each a 2D array holding in its (i,j) cell the x, y, and z
+            coordinate (respectively) of point (i,j) in the mesh.
+        """
+        z = self._heights(resolution)
+        r = self.profile(z)
+        R = self.get_entrance_radius()
+        ang_end = 2*N.pi + 1./(R*resolution)
+        angs = N.r_[0:ang_end:1./(R*resolution)]
+
+        x = N.outer(r, N.cos(angs))
+        y = N.outer(r, N.sin(angs))
+        z = N.tile(z[:,None], (1, len(angs)))
+        return x, y, z
+
+class TroughCPCGM(CPCGM):
+    """
+    A 2D CPC trough, with two plane walls at either side of the YZ plane,
+    extending along the local Y axis.
+    """
+    def __init__(self, exit_radius, accept_angle, length, height=None):
+        """
+        Arguments:
+        exit_radius - half the width of the exit aperture.
+        accept_angle - the acceptance half-angle of the CPC, in radians.
+        length - of the trough along the Y axis, centered on the origin.
+        height - of the CPC's entrance above its exit. By default, the full
+            height, where the profile becomes parallel to the axis.
+        """
+        CPCGM.__init__(self, exit_radius, accept_angle, height)
+        self._half_l = length/2.
+
+    def _radius(self, local):
+        return abs(local[0])
+
+    def _radial(self, local):
+        return N.vstack((N.sign(local[0]), N.zeros(local.shape[1])))
+
+    def _in_bounds(self, local):
+        return abs(local[1]) <= self._half_l
+
+    def _candidates(self, v, d):
+        # The walls at positive and negative x solve E + G*x = 0 and
+        # E - G*x = 0 respectively, each a quadratic:
+        x = N.vstack((v[0], d[0]))
+        E, G = self._profile_polys(v, d, _polymul(x, x))
+        Gx = _polymul(G, x)
+        return N.vstack([_real_roots(E + side*Gx) for side in (1, -1)])
+
+    def mesh(self, resolution):
+        """
+        Represent the surface as a mesh in local coordinates. Rows go down
+        the wall at negative x and up the wall at positive x, so the mesh
+        also joins the walls across the exit aperture.
+
+        Arguments:
+        resolution - in points per unit length (so the number of points
+            returned is O(A*resolution**2) for area A)
+
+        Returns:
+        x, y, z - each a 2D array holding in its (i,j) cell the x, y, and z
+            coordinate (respectively) of point (i,j) in the mesh.
+        """
+        z = self._heights(resolution)
+        r = self.profile(z)
+        ys = N.linspace(-self._half_l, self._half_l,
+            max(2, int(N.ceil(2*self._half_l*resolution)) + 1))
+
+        xs = N.r_[-r[::-1], r]
+        zs = N.r_[z[::-1], z]
+        x = N.tile(xs[:,None], (1, len(ys)))
+        y = N.tile(ys, (len(xs), 1))
+        z = N.tile(zs[:,None], (1, len(ys)))
+        return x, y, z
@@ -0,0 +1,261 @@
+"""
+Geometry managers of surfaces that are invariant along one axis - the local
+Y axis - such as the mirrors and absorbers of parabolic troughs and linear
+Fresnel collectors. Intersections are solved for the profile in the local
+XZ plane alone. The rays' parameters there are also their 3D parameters,
+so the axial coordinate of the hits follows from each ray's axial direction
+component without further work.
+
+Surfaces with a length are bounded along their axis, for tracing a finite
+collector in full 3D. Surfaces without a length (the default) are infinite,
+for the translation-invariant (2.5D) mode: when all surfaces of a collector
+share the axis and are infinite, rays need only be sampled across the
+collector, at one axial position (see sources.transverse_bundle()). The end
+losses of a collector of finite length are then accounted for analytically
+by the receiver, see optics_callables.AxialStart and EndLossReceiver.
+"""
+
+import numpy as N
+from geometry_manager import GeometryManager
+import kernels
+
+# Hits closer than this to the ray's vertex are the vertex's own surface,
+# as in TracerEngine.intersect_ray().
+_MIN_PARAM = 1e-6
+
+class ExtrudedGM(GeometryManager):
+    """
+    A base class for surfaces extruded along the local Y axis. Subclasses
+    define the profile in the local XZ plane:
+
+    _profile_intersections(v, d) - given the X,Z components of the local ray
+        vertices and directions (2 by n arrays), return a k by n array of
+        candidate parametric positions of intersection with the profile, NaN
+        or infinite where there is none.
+    _profile_normals(p) - given the X,Z components of local points on the
+        profile (2 by n), return the unit normals of its front side there,
+        as a 2 by n array.
+    _profile_mesh(resolution) - X and Z arrays of points along the profile.
+    """
+    def __init__(self, length=None):
+        """
+        Arguments:
+        length - the extent along the local Y axis, centered on the origin,
+            or None for an infinite surface.
+        """
+        self._length = length
+
+    def get_length(self):
+        return self._length
+
+    def find_intersections(self, frame, ray_bundle):
+        """
+        Register the working frame and ray bundle, calculate intersections
+        and save the parametric locations of intersection on the surface.
+
+        Arguments:
+        frame - the current frame, represented as a homogenous transformation
+            matrix stored in a 4x4 array.
+        ray_bundle - a RayBundle object with the incoming rays' data.
+
+        Returns:
+        A 1D array with the parametric position of intersection along each of
+            the rays. Rays that missed the surface return +infinity.
+        """
+        GeometryManager.find_intersections(self, frame, ray_bundle)
+        d = N.dot(frame[:3,:3].T, ray_bundle.get_directions())
+        v = N.dot(N.linalg.inv(frame), N.vstack((ray_bundle.get_vertices(),
+            N.ones(d.shape[1]))))[:3]
+
+        params = self._profile_intersections(v[::2], d[::2])
+        params[~(params > _MIN_PARAM) | N.isnan(params)] = N.inf
+        if self._length is not None:
+            axial = v[1] + params*d[1]
+            params[~(abs(axial) <= self._length/2.)] = N.inf
+        params = params.min(axis=0)
+
+        self._local = v + N.where(N.isinf(params), 0, params)*d
+        self._local_dirs = d
+        return params
+
+    def select_rays(self, idxs):
+        """
+        With this method, the ray tracer informs the surface that of the
+        registered rays, only those with the given indexes will be used next.
+        This is used here to trim the internal data structures and save memory.
+
+        Arguments:
+        idx - an array of indexes referring to the rays registered in
+            register_incoming()
+        """
+        self._idxs = idxs
+        local = self._local[:,idxs]
+        front = self._profile_normals(local[::2])
+        normals = N.vstack((front[0], N.zeros(front.shape[1]), front[1]))
+
+        # Rays coming from behind see the normal reversed:
+        self._backside = N.sum(normals*self._local_dirs[:,idxs], axis=0) > 0
+        normals[:,self._backside] *= -1
+        self._norm = N.dot(self._working_frame[:3,:3], normals)
+
+        self._global = N.dot(self._working_frame[:3,:3], local) + \
+            self._working_frame[:3,3][:,None]
+        del self._local
+        del self._local_dirs
+
+    def get_normals(self):
+        """
+        Report the normal to the surface at the hit point of selected rays in
+        the working bundle, facing the incoming ray.
+        """
+        return self._norm
+
+    def get_backside(self):
+        """
+        Report which of the selected rays hit the surface from its back side.
+
+        Returns:
+        a boolean array, True for each selected ray hitting the back side.
+        """
+        return self._backside
+
+    def get_intersection_points_global(self):
+        """
+        Get the ray/surface intersection points in the global coordinates.
+
+        Returns:
+        A 3-by-n array for 3 spatial coordinates and n rays selected.
+        """
+        return self._global
+
+    def done(self):
+        """
+        Discard internal data structures. This should be called after all
+        information on the latest bundle's results have been extracted already.
+        """
+        for attr in ('_local', '_local_dirs', '_global', '_norm', '_backside',
+                '_idxs'):
+            if hasattr(self, attr):
+                delattr(self, attr)
+        GeometryManager.done(self)
+
+    def mesh(self, resolution):
+        """
+        Represent the surface as a mesh in local coordinates. An infinite
+        surface is meshed along a length equal to its profile's largest
+        extent.
+
+        Arguments:
+        resolution - in points per unit length (so the number of points
+            returned is O(A*resolution**2) for area A)
+
+        Returns:
+        x, y, z - each a 2D array holding in its (i,j) cell the x, y, and z
+            coordinate (respectively) of point (i,j) in the mesh.
+        """
+        px, pz = self._profile_mesh(resolution)
+        length = self._length
+        if length is None:
+            length = max(px.max() - px.min(), pz.max() - pz.min())
+        ys = N.linspace(-length/2., length/2.,
+            max(2, int(N.ceil(length*resolution)) + 1))
+
+        x = N.tile(px[:,None], (1, len(ys)))
+        y = N.tile(ys, (len(px), 1))
+        z = N.tile(pz[:,None], (1, len(ys)))
+        return x, y, z
+
+    def _profile_points(self, extent, resolution):
+        return max(2, int(N.ceil(extent*resolution)) + 1)
+
+class ExtrudedFlatGM(ExtrudedGM):
+    """
+    A flat strip on the local XY plane, extending along the local X axis
+    for its width, and facing the local +Z direction.
+    """
+    def __init__(self, width, length=None):
+        """
+        Arguments:
+        width - the extent along the local X axis, centered on the origin.
+        length - the extent along the local Y axis, or None for infinite.
+        """
+        ExtrudedGM.__init__(self, length)
+        self._half_w = width/2.
+
+    def _profile_intersections(self, v, d):
+        params = -v[1]/d[1]
+        params[~(abs(v[0] + params*d[0]) <= self._half_w)] = N.inf
+        return params[None]
+
+    def _profile_normals(self, p):
+        return N.tile(N.c_[[0., 1.]], (1, p.shape[1]))
+
+    def _profile_mesh(self, resolution):
+        x = N.linspace(-self._half_w, self._half_w,
+            self._profile_points(2*self._half_w, resolution))
+        return x, N.zeros_like(x)
+
+class ParabolicTroughGM(ExtrudedGM):
+    """
+    A parabolic trough mirror, z = x**2/(4f) in the local XZ plane, with its
+    focal line along the local Y axis at z = f. The front side is the
+    concave one.
+    """
+    def __init__(self, width, focal_length, length=None):
+        """
+        Arguments:
+        width - the aperture width, along the local X axis.
+        focal_length - the distance of the focal line from the vertex line.
+        length - the extent along the local Y axis, or None for infinite.
+        """
+        ExtrudedGM.__init__(self, length)
+        self._half_w = width/2.
+        self._a = 1./(4*focal_length)
+
+    def _profile_intersections(self, v, d):
+        A = self._a*d[0]**2
+        B = 2*self._a*v[0]*d[0] - d[1]
+        C = self._a*v[0]**2 - v[1]
+        params = kernels.get_kernel('quadric_roots')(A, B, C)
+        params[~(abs(v[0] + params*d[0]) <= self._half_w)] = N.inf
+        return params
+
+    def _profile_normals(self, p):
+        normals = N.vstack((-2*self._a*p[0], N.ones(p.shape[1])))
+        return normals/N.sqrt(N.sum(normals**2, axis=0))
+
+    def _profile_mesh(self, resolution):
+        x = N.linspace(-self._half_w, self._half_w,
+            self._profile_points(2*self._half_w, resolution))
+        return x, self._a*x**2
+
+class ExtrudedCircleGM(ExtrudedGM):
+    """
+    A tube around the local Y axis, e.g. the absorber of a trough. The front
+    side is the outside.
+    """
+    def __init__(self, diameter, length=None):
+        """
+        Arguments:
+        diameter - of the tube.
+        length - the extent along the local Y axis, or None for infinite.
+        """
+        ExtrudedGM.__init__(self, length)
+        self._R = diameter/2.
+
+    def _profile_intersections(self, v, d):
+        A = N.sum(d**2, axis=0)
+        B = 2*N.sum(v*d, axis=0)
+        C = N.sum(v**2, axis=0) - self._R**2
+        params = kernels.get_kernel('quadric_roots')(A, B, C)
+        # Rays along the axis never cross the tube:
+        params[:, A <= 1e-10] = N.inf
+        return params
+
+    def _profile_normals(self, p):
+        return p/N.sqrt(N.sum(p**2, axis=0))
+
+    def _profile_mesh(self, resolution):
+        angs = N.linspace(0, 2*N.pi,
+            self._profile_points(2*N.pi*self._R, resolution))
+        return self._R*N.cos(angs), self._R*N.sin(angs)
@@ -7,6 +7,7 @@
 from numpy import linalg as LA
 import numpy as N
 from geometry_manager import GeometryManager
+import kernels
 
 class FlatGeometryManager(GeometryManager):
     """
@@ -29,29 +30,11 @@ class FlatGeometryManager(GeometryManager):
             the rays. Rays that missed the surface return +infinity.
         """
         GeometryManager.find_intersections(self, frame, ray_bundle)
-        
-        d = ray_bundle.get_directions()
-        v = ray_bundle.get_vertices() - frame[:3,3][:,None]
-        n = ray_bundle.get_num_rays()
-        
-        # Vet out parallel rays:
-        dt = N.dot(d.T, frame[:3,2])
-        unparallel = abs(dt) > 1e-10
-        
-        # `params` holds the parametric location of intersections along the ray 
-        params = N.empty(n)
-        params.fill(N.inf)
-        
-        vt = N.dot(frame[:3,2], v[:,unparallel])
-        params[unparallel] = -vt/dt[unparallel]
-        
-        # Takes into account a negative depth
-        # Note that only the 3rd row of params is relevant here!
-        negative = params < 0
-        params[negative] = N.Inf
+        params, backside = kernels.get_kernel('flat_intersections')(frame,
+            ray_bundle.get_vertices(), ray_bundle.get_directions())
         
         self._params = params
-        self._backside = dt > 0
+        self._backside = backside
         
         return params
         
@@ -80,10 +63,40 @@ class FlatGeometryManager(GeometryManager):
         Report the normal to the surface at the hit point of selected rays in
         the working bundle.
         """
-        norms = N.tile(self._working_frame[:3,2].copy()[:,None], (1, len(self._idxs)))
+        norms = self.get_broadcast_normals()
+        if norms.shape[1] != len(self._idxs):
+            norms = N.tile(norms, (1, len(self._idxs)))
+        return norms
+    
+    def get_broadcast_normals(self):
+        """
+        Report the normal to the surface at the hit point of selected rays in
+        the working bundle. Unless the surface is hit from both sides, the
+        normal is the same for all rays, and it is returned once as a 3 by 1
+        array.
+        """
+        normal = self._working_frame[:3,2][:,None].copy()
+        if len(self._backside) == 0:
+            return normal
+        if len(self._backside) == len(self._idxs):
+            return -normal
+        
+        norms = N.tile(normal, (1, len(self._idxs)))
         norms[:,self._backside] *= -1
         return norms
     
+    def get_backside(self):
+        """
+        Report which of the selected rays hit the surface from below, i.e.
+        travelling along the local Z axis.
+        
+        Returns:
+        a boolean array, True for each selected ray hitting the back side.
+        """
+        backside = N.zeros(len(self._idxs), dtype=N.bool)
+        backside[self._backside] = True
+        return backside
+    
     def get_intersection_points_global(self):
         """
         Get the ray/surface intersection points in the global coordinates.
@@ -180,15 +193,24 @@ class RectPlateGM(FiniteFlatGM):
         
         self._half_dims = N.c_[[width, height]]/2.
         FiniteFlatGM.__init__(self)
+    
+    def get_half_dims(self):
+        """
+        Returns a 2-array with half the extents of the rectangle along the
+        local x and y axes.
+        """
+        return self._half_dims[:,0]
         
     def find_intersections(self, frame, ray_bundle):
         """
         Extends the parent flat geometry manager by discarding in advance
         impact points outside a centered rectangle.
         """
-        ray_prms = FiniteFlatGM.find_intersections(self, frame, ray_bundle)
-        ray_prms[N.any(abs(self._local[:2]) > self._half_dims, axis=0)] = N.inf
-        del self._local
+        GeometryManager.find_intersections(self, frame, ray_bundle)
+        ray_prms, self._backside, self._global = \
+            kernels.get_kernel('rect_plate_intersections')(frame,
+            ray_bundle.get_vertices(), ray_bundle.get_directions(),
+            self._half_dims[:,0])
         return ray_prms
     
     def mesh(self, resolution):
@@ -233,9 +255,10 @@ class RoundPlateGM(FiniteFlatGM):
         Extends the parent flat geometry manager by discarding in advance
         impact points outside a centered circle.
         """
-        ray_prms = FiniteFlatGM.find_intersections(self, frame, ray_bundle)
-        ray_prms[N.sum(self._local[:2]**2, axis=0) > self._R**2] = N.inf
-        del self._local
+        GeometryManager.find_intersections(self, frame, ray_bundle)
+        ray_prms, self._backside, self._global = \
+            kernels.get_kernel('round_plate_intersections')(frame,
+            ray_bundle.get_vertices(), ray_bundle.get_directions(), self._R)
         return ray_prms
     
     def mesh(self, resolution):
@@ -32,6 +32,13 @@ class GeometryManager(object):
         """
         return self._working_frame[:3,2]
     
+    def get_working_frame(self):
+        """
+        Returns the 4x4 homogenous transform of the surface's frame in global
+        coordinates, as registered for the current bundle.
+        """
+        return self._working_frame
+    
     def done(self):
         """
         Discard internal data structures. After calling done(), the information
@@ -54,6 +61,27 @@ class GeometryManager(object):
         """
         pass
     
+    def get_broadcast_normals(self):
+        """
+        Like get_normals(), but a surface whose normal is the same for all of
+        the selected hit points may return it once, as a 3 by 1 array that
+        broadcasts against per-ray arrays. This default implementation
+        returns get_normals().
+        """
+        return self.get_normals()
+    
+    def get_backside(self):
+        """
+        Report which of the previously selected rays hit the surface from its
+        back side. Geometry managers that may be used with two-sided optics
+        (see Surface) must override this.
+        
+        Returns:
+        a boolean array, True for each selected ray hitting the back side.
+        """
+        raise TypeError("%s does not distinguish the sides of its surface" % \
+            self.__class__.__name__)
+    
     def get_intersection_points_global(self):
         """
         Return the intersection points of the previously selected rays, in
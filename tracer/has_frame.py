@@ -18,8 +18,13 @@ class HasFrame(object):
     Tentative transformations are held in _temp_frame, which allows to preserve the
     relative transform while holding a global transform.
     
+    The transform and global frame may also be arrays shared with other
+    objects and updated in place by their owner, see share_frames().
+    
     .. [1] John J. Craig, Introduction to Robotics, 3rd ed., 2005.
     """
+    _on_frame_change = None
+    
     def __init__(self,  location=None,  rotation=None):
         # default location and rotation:
         if location is None:
@@ -43,6 +48,7 @@ class HasFrame(object):
         """Sets the location within the object"""
         if location.shape != (3, ):
             raise ValueError("location must be a 1D 3-component array")
+        self._frame_changed()
         self._loc = location
         self._transform[:3,3] = location
     
@@ -50,6 +56,7 @@ class HasFrame(object):
         """Sets the rotation within the object"""
         if  rotation.shape != (3, 3):
             raise ValueError("rotation must be a 3x3 array")
+        self._frame_changed()
         self._rot = rotation
         self._transform[:3,:3] = rotation
 
@@ -59,6 +66,7 @@ class HasFrame(object):
         
         Arguments:
         transform - a 2D array defining the 4 by 4 transformation matrix."""
+        self._frame_changed()
         self._transform = transform
         self._loc = self._transform[:3,3]
         self._rot = self._transform[:3,:3]
@@ -66,10 +74,47 @@ class HasFrame(object):
     def get_transform(self):
         return self._transform
 
+    def get_global_transform(self):
+        """
+        Returns the transformation matrix from the local frame to the global
+        coordinates, as last set by transform_frame().
+        """
+        return self._temp_frame
+
     def transform_frame(self, transform):
         """Updates the transformation matrix that puts the surface into the global
         coordinates. I.e., if the object the surface is in is rotated, than the surface
         is also rotated.  It then defines a temporary rotated frame for use of
         calculations."""
+        self._frame_changed()
         self._temp_frame = N.dot(transform, self._transform)
+    
+    def share_frames(self, transform=None, frame=None, on_change=None):
+        """
+        Use arrays owned by someone else, e.g. views into the arrays of a
+        tracer.object.TransformBatch, as the transform and global frame. The
+        owner updates them in place, and is told when they no longer apply.
+        
+        Arguments:
+        transform - a 4x4 array to use as the transform (see set_transform()),
+            or None to keep the current one.
+        frame - a 4x4 array to use as the global frame (see
+            get_global_transform()), or None to keep the current one.
+        on_change - called without arguments the next time the transform or
+            frame is replaced by other means, e.g. set_transform() or
+            transform_frame(). Replaces the callback of an earlier call.
+        """
+        self._on_frame_change = None
+        if transform is not None:
+            HasFrame.set_transform(self, transform)
+        if frame is not None:
+            self._temp_frame = frame
+        self._on_frame_change = on_change
+    
+    def _frame_changed(self):
+        """Tell the owner of shared frames, if any, that they were replaced."""
+        if self._on_frame_change is not None:
+            on_change = self._on_frame_change
+            self._on_frame_change = None
+            on_change()
 
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# The information an optics manager gets about the rays hitting its surface.
+
+import numpy as N
+
+class HitRecord(object):
+    """
+    Describes the rays that hit a surface in one trace iteration: the
+    incoming ray bundle, which of its rays hit, and the geometry manager that
+    knows the hit points and surface normals.
+
+    Per-ray data of the hitting rays is gathered out of the incoming bundle on
+    first request and kept, so an optics manager (see
+    tracer.optics_callables) may ask for the same data several times without
+    repeating the fancy indexing into the full bundle.
+    """
+    def __init__(self, geometry, rays, selector, hit_idxs=None, prng=None):
+        """
+        Arguments:
+        geometry - the GeometryManager of the hit surface, after its
+            select_rays() was called with ``selector``.
+        rays - the incoming RayBundle (all of it, not just the hitting rays).
+        selector - an array of indices into ``rays``, of the rays that hit.
+        hit_idxs - optionally, indices into ``selector`` restricting the
+            record to some of the hits. The geometry manager's per-hit data
+            is then restricted in the same way.
+        prng - the source of random numbers for stochastic optics, a
+            tracer.random_streams.RandomStream. If None, the global
+            numpy.random generator is used.
+        """
+        self._geom = geometry
+        self._rays = rays
+        self._geom_selector = selector
+        self._hit_idxs = hit_idxs
+        if hit_idxs is None:
+            self._selector = selector
+        else:
+            self._selector = selector[hit_idxs]
+        self._prng = prng
+        self._gathered = {}
+
+    def subset(self, hit_idxs):
+        """
+        Make a record of some of the hits in this one, e.g. those hitting one
+        side of the surface.
+
+        Arguments:
+        hit_idxs - indices into this record's hits.
+
+        Returns:
+        a new HitRecord.
+        """
+        if self._hit_idxs is not None:
+            hit_idxs = self._hit_idxs[hit_idxs]
+        return HitRecord(self._geom, self._rays, self._geom_selector, hit_idxs,
+            self._prng)
+
+    def get_geometry(self):
+        return self._geom
+
+    def get_prng(self):
+        """
+        The object optics managers should draw random numbers from: a
+        RandomStream if the trace was given one, otherwise numpy.random.
+        Either one has uniform(low, high, size) etc.
+        """
+        if self._prng is None:
+            return N.random
+        return self._prng
+
+    def get_rays(self):
+        """The full incoming bundle, for use with its inherit() method."""
+        return self._rays
+
+    def get_selector(self):
+        """
+        Indices into the incoming bundle of the hitting rays. These are also
+        the parent indices of rays generated from the hits.
+        """
+        return self._selector
+
+    def get_num_hits(self):
+        return len(self._selector)
+
+    def get_property(self, propname):
+        """
+        Get the value of any ray property (see RayBundle) for the hitting rays
+        only, gathering it from the incoming bundle the first time.
+
+        Arguments:
+        propname - the property's name, e.g. 'energy'.
+        """
+        if propname not in self._gathered:
+            getter = getattr(self._rays, 'get_' + propname)
+            self._gathered[propname] = getter(self._selector)
+        return self._gathered[propname]
+
+    def get_directions(self):
+        """A 3 by n array of the hitting rays' directions."""
+        return self.get_property('directions')
+
+    def get_energy(self):
+        return self.get_property('energy')
+
+    def get_ref_index(self):
+        return self.get_property('ref_index')
+
+    def get_normals(self):
+        """
+        The surface normals at the hit points, as returned by the geometry
+        manager's get_broadcast_normals(): a 3 by n array, or a 3 by 1 array
+        when all hits share the same normal. Either way it broadcasts against
+        the 3 by n arrays of per-ray data.
+        """
+        if 'normals' not in self._gathered:
+            normals = self._geom.get_broadcast_normals()
+            if self._hit_idxs is not None and normals.shape[1] > 1:
+                normals = normals[:,self._hit_idxs]
+            self._gathered['normals'] = normals
+        return self._gathered['normals']
+
+    def restrict(self, values):
+        """
+        Restrict per-hit data of the geometry manager, given for all of the
+        rays it selected (e.g. InstancedGM.get_instance_indices()), to the
+        hits of this record.
+        """
+        if self._hit_idxs is None:
+            return values
+        return values[...,self._hit_idxs]
+
+    def get_intersection_points(self):
+        """A 3 by n array of the hit points, in global coordinates."""
+        if self._hit_idxs is None:
+            return self._geom.get_intersection_points_global()
+        if 'intersection_points' not in self._gathered:
+            self._gathered['intersection_points'] = \
+                self._geom.get_intersection_points_global()[:,self._hit_idxs]
+        return self._gathered['intersection_points']
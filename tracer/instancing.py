@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+Instanced geometry: many identical surfaces (e.g. the heliostats of a field
+or the facets of a dish) represented by one Surface, whose geometry manager
+holds a single prototype geometry manager and an array of per-instance
+transforms.
+
+Compared to an AssembledObject per copy, this saves the per-copy Python
+objects and lets the tracer engine treat all copies as one surface, so its
+per-surface arrays do not grow with the number of copies. Rays are
+intersected with all instances at once: for rectangular prototypes by a
+vectorized kernel (see tracer.kernels), otherwise by intersecting the
+prototype in each instance's frame in turn.
+
+The optics manager of the instanced surface is shared by all instances; the
+instance hit by each ray is available from the geometry manager's
+get_instance_indices().
+"""
+
+import numpy as N
+
+from .geometry_manager import GeometryManager
+from .flat_surface import FlatGeometryManager, RectPlateGM
+from . import kernels
+
+# Intersections closer than this to a ray's vertex are ignored, like the
+# tracer engine does for whole surfaces, so that a ray leaving one instance
+# may still hit another.
+_MIN_PARAM = 1e-6
+
+class InstancedGM(GeometryManager):
+    """
+    The geometry of copies of a prototype surface, each placed by its own
+    transform relative to the frame of the instanced surface.
+    """
+    def __init__(self, prototype, transforms):
+        """
+        Arguments:
+        prototype - a GeometryManager instance, the geometry of one copy in
+            its own local frame. It is used for all copies, so should not be
+            used by another surface.
+        transforms - an (n,4,4) array, the transform of each copy's frame
+            into the frame of the surface using this geometry manager.
+        """
+        self._proto = prototype
+        self.set_transforms(transforms)
+
+    def get_prototype(self):
+        return self._proto
+
+    def get_num_instances(self):
+        return self._transforms.shape[0]
+
+    def get_transforms(self):
+        """The (n,4,4) array of instance transforms."""
+        return self._transforms
+
+    def set_transforms(self, transforms):
+        """
+        Move the instances.
+
+        Arguments:
+        transforms - an (n,4,4) array, as in the constructor. Must not
+            change during a trace iteration.
+        """
+        self._transforms = N.asarray(transforms, dtype=N.float64)
+
+    def find_intersections(self, frame, ray_bundle):
+        """
+        Find the nearest instance hit by each ray.
+
+        Arguments:
+        frame - the current frame of the instanced surface, represented as a
+            homogenous transformation matrix stored in a 4x4 array.
+        ray_bundle - a RayBundle object with the incoming rays' data.
+
+        Returns:
+        A 1D array with the parametric position of intersection along each of
+            the rays. Rays that missed all instances return +infinity.
+        """
+        GeometryManager.find_intersections(self, frame, ray_bundle)
+        self._frames = N.matmul(frame, self._transforms)
+
+        if isinstance(self._proto, RectPlateGM):
+            params, owner = kernels.get_kernel('instanced_rect_intersections')(
+                self._frames, ray_bundle.get_vertices(),
+                ray_bundle.get_directions(), self._proto.get_half_dims(),
+                _MIN_PARAM)
+        else:
+            params, owner = self._intersect_each(ray_bundle)
+
+        self._params = params
+        self._owner = owner
+        return params
+
+    def _intersect_each(self, ray_bundle):
+        """
+        Intersect the prototype in each instance's frame, keeping the nearest
+        hit for each ray.
+        """
+        params = N.empty(ray_bundle.get_num_rays())
+        params.fill(N.inf)
+        owner = N.empty(ray_bundle.get_num_rays(), dtype=N.int_)
+        owner.fill(-1)
+
+        for inst, inst_frame in enumerate(self._frames):
+            prm = self._proto.find_intersections(inst_frame, ray_bundle)
+            self._proto.done()
+            closer = (prm > _MIN_PARAM) & (prm < params)
+            params[closer] = prm[closer]
+            owner[closer] = inst
+        return params, owner
+
+    def select_rays(self, idxs):
+        """
+        Inform the geometry manager that only the given rays are to be used,
+        so that internal data size is kept small.
+
+        Arguments:
+        idxs - an index array stating which rays of the working bundle
+            are active.
+        """
+        self._idxs = idxs
+        self._sel_owner = self._owner[idxs]
+        del self._owner
+
+        d = self._working_bundle.get_directions()[:,idxs]
+        if isinstance(self._proto, FlatGeometryManager):
+            v = self._working_bundle.get_vertices()[:,idxs]
+            self._global = v + self._params[idxs]*d
+            normals = self._frames[self._sel_owner,:3,2].T
+            self._backside = N.sum(d*normals, axis=0) > 0
+            self._normals = N.where(self._backside, -normals, normals)
+        else:
+            self._select_each(idxs)
+        del self._params
+
+    def _select_each(self, idxs):
+        """
+        Get the hit data of a general prototype by intersecting it again in
+        the frame of each hit instance, with only the rays hitting it.
+        """
+        num_sel = len(idxs)
+        self._global = N.empty((3, num_sel))
+        self._normals = N.empty((3, num_sel))
+        self._backside = N.zeros(num_sel, dtype=N.bool)
+        sides_known = True
+
+        for inst in N.unique(self._sel_owner):
+            group = N.nonzero(self._sel_owner == inst)[0]
+            self._proto.find_intersections(self._frames[inst],
+                self._working_bundle.inherit(idxs[group]))
+            self._proto.select_rays(N.arange(len(group)))
+            self._global[:,group] = self._proto.get_intersection_points_global()
+            self._normals[:,group] = self._proto.get_normals()
+            if sides_known:
+                try:
+                    self._backside[group] = self._proto.get_backside()
+                except TypeError:
+                    sides_known = False
+            self._proto.done()
+
+        if not sides_known:
+            self._backside = None
+
+    def get_instance_indices(self):
+        """
+        Report which instance each of the selected rays hit.
+
+        Returns:
+        an integer array with an index into the instance transforms for each
+            selected ray.
+        """
+        return self._sel_owner
+
+    def get_normals(self):
+        """
+        Report the normal to the surface at the hit point of selected rays in
+        the working bundle.
+        """
+        return self._normals
+
+    def get_backside(self):
+        """
+        Report which of the selected rays hit their instance from its back
+        side, if the prototype distinguishes sides.
+        """
+        if self._backside is None:
+            return GeometryManager.get_backside(self._proto)
+        return self._backside
+
+    def get_intersection_points_global(self):
+        """
+        Get the ray/surface intersection points in the global coordinates.
+
+        Returns:
+        A 3-by-n array for 3 spatial coordinates and n rays selected.
+        """
+        return self._global
+
+    def done(self):
+        """
+        Discard internal data structures. This should be called after all
+        information on the latest bundle's results have been extracted already.
+        """
+        GeometryManager.done(self)
+        for attr in ('_frames', '_params', '_owner', '_idxs', '_sel_owner',
+                '_global', '_normals', '_backside'):
+            if hasattr(self, attr):
+                delattr(self, attr)
+
+class GridInstancedGM(InstancedGM):
+    """
+    Instances of a rectangle, indexed in a uniform 2D grid over the x, y
+    positions of their centers in the frame of the instanced surface (e.g.
+    the ground positions of heliostats in a field). Each ray is walked
+    through the grid cells its projection on the XY plane crosses, within
+    the height range of the instances, and tested only against the instances
+    overlapping those cells. All rays are walked together, one cell per
+    step, so a trace takes time close to proportional to the number of rays
+    when the instances are spread over a large area.
+    
+    References:
+    .. [1] J. Amanatides and A. Woo, A fast voxel traversal algorithm for ray
+       tracing, Eurographics '87, 3-10 (1987).
+    """
+    def __init__(self, prototype, transforms, cell_size=None):
+        """
+        Arguments:
+        prototype - a RectPlateGM instance.
+        transforms - as in InstancedGM.
+        cell_size - the side of a grid cell. By default it is the diagonal
+            of the rectangle, so each instance overlaps at most 4 cells.
+        """
+        if not isinstance(prototype, RectPlateGM):
+            raise TypeError("Grid instancing requires a RectPlateGM prototype")
+        self._radius = N.sqrt(N.sum(prototype.get_half_dims()**2))
+        if cell_size is None:
+            cell_size = 2*self._radius
+        self._cell_size = float(cell_size)
+        InstancedGM.__init__(self, prototype, transforms)
+
+    def set_transforms(self, transforms):
+        """
+        Move the instances, and rebuild the grid if their centers moved.
+
+        Arguments:
+        transforms - an (n,4,4) array, as in the constructor.
+        """
+        old = getattr(self, '_transforms', None)
+        InstancedGM.set_transforms(self, transforms)
+        if old is None or old.shape != self._transforms.shape or \
+                N.any(old[:,:3,3] != self._transforms[:,:3,3]):
+            self._build_grid()
+
+    def _build_grid(self):
+        """
+        Register each instance in all the cells overlapped by the square
+        bounding its footprint, as compressed lists of instances per cell.
+        """
+        centers = self._transforms[:,:3,3]
+        r = self._radius
+        self._grid_min = centers[:,:2].min(axis=0) - r
+        self._grid_shape = N.maximum(1, N.ceil(
+            (centers[:,:2].max(axis=0) + r - self._grid_min)/self._cell_size
+            ).astype(N.int_))
+        self._z_range = N.r_[centers[:,2].min() - r, centers[:,2].max() + r]
+
+        low = self._cell_of(centers[:,:2] - r)
+        high = self._cell_of(centers[:,:2] + r)
+        extent = high - low + 1
+        counts = extent[:,0]*extent[:,1]
+
+        inst = N.repeat(N.arange(len(centers)), counts)
+        offset = N.arange(counts.sum()) - N.repeat(N.cumsum(counts) - counts,
+            counts)
+        cells_x = low[inst,0] + offset // extent[inst,1]
+        cells_y = low[inst,1] + offset % extent[inst,1]
+        cell_ids = cells_x*self._grid_shape[1] + cells_y
+
+        order = N.argsort(cell_ids, kind='mergesort')
+        self._cell_items = inst[order]
+        self._cell_start = N.r_[0, N.cumsum(N.bincount(cell_ids,
+            minlength=N.prod(self._grid_shape)))]
+
+    def _cell_of(self, xy):
+        """The grid cell indices of an (n,2) array of points, clipped."""
+        cells = N.floor((xy - self._grid_min)/self._cell_size).astype(N.int_)
+        return N.clip(cells, 0, self._grid_shape - 1)
+
+    def find_intersections(self, frame, ray_bundle):
+        """
+        Find the nearest instance hit by each ray, walking the grid.
+
+        Arguments:
+        frame - the current frame of the instanced surface, represented as a
+            homogenous transformation matrix stored in a 4x4 array.
+        ray_bundle - a RayBundle object with the incoming rays' data.
+
+        Returns:
+        A 1D array with the parametric position of intersection along each of
+            the rays. Rays that missed all instances return +infinity.
+        """
+        GeometryManager.find_intersections(self, frame, ray_bundle)
+        self._frames = N.matmul(frame, self._transforms)
+
+        # Work in the instanced surface's frame, where the grid is:
+        rot = frame[:3,:3]
+        verts = N.dot(rot.T, ray_bundle.get_vertices() - frame[:3,3][:,None])
+        dirs = N.dot(rot.T, ray_bundle.get_directions())
+        num_rays = verts.shape[1]
+
+        params = N.empty(num_rays)
+        params.fill(N.inf)
+        owner = N.empty(num_rays, dtype=N.int_)
+        owner.fill(-1)
+
+        # The part of each ray inside the grid's box:
+        box_min = N.r_[self._grid_min, self._z_range[0]]
+        box_max = N.r_[self._grid_min + self._grid_shape*self._cell_size,
+            self._z_range[1]]
+        oldsettings = N.seterr(divide='ignore', invalid='ignore')
+        t_low = (box_min[:,None] - verts)/dirs
+        t_high = (box_max[:,None] - verts)/dirs
+        parallel = dirs == 0
+        inside = (verts >= box_min[:,None]) & (verts <= box_max[:,None])
+        t_low[parallel] = N.where(inside[parallel], -N.inf, N.inf)
+        t_high[parallel] = N.where(inside[parallel], N.inf, -N.inf)
+        t_enter = N.maximum(N.minimum(t_low, t_high).max(axis=0), 0)
+        t_exit = N.maximum(t_low, t_high).min(axis=0)
+        N.seterr(**oldsettings)
+
+        active = N.nonzero(t_enter <= t_exit)[0]
+        if len(active) == 0:
+            self._params = params
+            self._owner = owner
+            return params
+
+        # Grid walk setup, after [1]:
+        v = verts[:2,active]
+        d = dirs[:2,active]
+        t_cur = t_enter[active]
+        t_end = t_exit[active]
+        cells = self._cell_of((v + t_cur*d).T).T
+        step = N.where(d >= 0, 1, -1)
+        oldsettings = N.seterr(divide='ignore', invalid='ignore')
+        next_bound = self._grid_min[:,None] + \
+            (cells + (step > 0))*self._cell_size
+        t_next = N.where(d != 0, (next_bound - v)/d, N.inf)
+        t_delta = N.where(d != 0, self._cell_size/abs(d), N.inf)
+        N.seterr(**oldsettings)
+
+        while len(active):
+            cell_exit = N.minimum(t_next.min(axis=0), t_end)
+            prm, inst = self._test_cells(active, cells, verts, dirs)
+            found = prm <= cell_exit
+            params[active[found]] = prm[found]
+            owner[active[found]] = inst[found]
+
+            # Advance to the next cell along the nearer cell boundary:
+            axis = N.argmin(t_next, axis=0)
+            cols = N.arange(len(active))
+            cells[axis, cols] += step[axis, cols]
+            t_next[axis, cols] += t_delta[axis, cols]
+
+            keep = ~found & (cell_exit < t_end) & \
+                N.all((cells >= 0) & (cells < self._grid_shape[:,None]), axis=0)
+            active = active[keep]
+            cells = cells[:,keep]
+            step = step[:,keep]
+            t_next = t_next[:,keep]
+            t_delta = t_delta[:,keep]
+            t_end = t_end[keep]
+
+        self._params = params
+        self._owner = owner
+        return params
+
+    def _test_cells(self, rays, cells, verts, dirs):
+        """
+        Intersect each ray with the instances registered in its current
+        cell.
+
+        Arguments:
+        rays - indices of the tested rays.
+        cells - a 2 by len(rays) array of their current cell indices.
+        verts, dirs - the full bundle's vertices and directions, in the
+            frame of the grid.
+
+        Returns:
+        params - for each ray, the parametric position of its nearest hit
+            among the cell's instances, or +inf.
+        owner - the instance of that hit, or -1.
+        """
+        cell_ids = cells[0]*self._grid_shape[1] + cells[1]
+        starts = self._cell_start[cell_ids]
+        counts = self._cell_start[cell_ids + 1] - starts
+
+        pair_ray = N.repeat(N.arange(len(rays)), counts)
+        pair_inst = self._cell_items[N.repeat(starts - N.cumsum(counts) + \
+            counts, counts) + N.arange(counts.sum())]
+
+        frames = self._transforms[pair_inst]
+        v = verts[:,rays[pair_ray]].T - frames[:,:3,3]
+        d = dirs[:,rays[pair_ray]].T
+
+        oldsettings = N.seterr(divide='ignore', invalid='ignore')
+        dt = N.sum(d*frames[:,:3,2], axis=1)
+        prm = -N.sum(v*frames[:,:3,2], axis=1)/dt
+        prm[~((abs(dt) > 1e-10) & (prm > _MIN_PARAM))] = N.inf
+        half_dims = self._proto.get_half_dims()
+        for axis in xrange(2):
+            local = N.sum((v + prm[:,None]*d)*frames[:,:3,axis], axis=1)
+            prm[~(abs(local) <= half_dims[axis])] = N.inf
+        N.seterr(**oldsettings)
+
+        params = N.empty(len(rays))
+        params.fill(N.inf)
+        owner = N.empty(len(rays), dtype=N.int_)
+        owner.fill(-1)
+        if len(pair_ray) == 0:
+            return params, owner
+
+        # Nearest hit per ray: sort the pairs by ray, then by parameter.
+        order = N.lexsort((prm, pair_ray))
+        first = N.r_[True, pair_ray[order][1:] != pair_ray[order][:-1]]
+        nearest = order[first]
+        params[pair_ray[nearest]] = prm[nearest]
+        hit = N.isfinite(prm[nearest])
+        owner[pair_ray[nearest[hit]]] = pair_inst[nearest[hit]]
+        return params, owner
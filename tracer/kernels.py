@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+A registry of the numerical kernels used in the inner loops of a trace: the
+ray/surface intersection of the flat geometry managers, the root finding of
+quadric surfaces, and the optics laws of tracer.optics.
+
+Each kernel is registered under a name for some backend. The 'numpy' backend
+holds the reference implementation, written as whole-array NumPy operations,
+and is always available. Other backends may supply any subset of the kernels;
+kernels missing from the active backend are taken from the reference.
+
+The 'numba' backend (see tracer.numba_kernels) is only available when Numba is
+installed. It compiles each kernel to a single fused loop over rays, without
+the intermediate arrays of the reference implementation.
+
+Example::
+
+    from tracer import kernels
+    if 'numba' in kernels.available_backends():
+        kernels.set_backend('numba')
+"""
+
+import numpy as N
+from . import optics
+
+# Approximate number of values in the temporary arrays of kernels that
+# process many surfaces at once.
+_BLOCK_ELEMENTS = 2**20
+
+# Holds a dictionary of kernel name -> callable for each backend name.
+_backends = {}
+_active = 'numpy'
+
+def register_kernel(backend, name, kernel):
+    """
+    Make a kernel available under a given backend.
+
+    Arguments:
+    backend - the name of the backend, e.g. 'numpy'.
+    name - the name of the kernel, the same for all backends implementing it.
+    kernel - a callable with the same signature and return values as the
+        reference implementation of the named kernel.
+    """
+    _backends.setdefault(backend, {})[name] = kernel
+
+def available_backends():
+    """
+    Returns a list of the backend names that may be passed to set_backend().
+    Optional backends whose dependencies are missing are not listed.
+    """
+    _load_optional_backends()
+    return sorted(_backends.keys())
+
+def set_backend(backend):
+    """
+    Choose the backend whose kernels are used from now on.
+
+    Arguments:
+    backend - a name out of available_backends().
+    """
+    global _active
+    if backend not in available_backends():
+        raise ValueError("Kernel backend %s is not available" % backend)
+    _active = backend
+
+def get_backend():
+    """Returns the name of the active backend."""
+    return _active
+
+def get_kernel(name):
+    """
+    Find the implementation of a kernel in the active backend, or in the
+    reference backend if the active one does not implement it.
+
+    Arguments:
+    name - the kernel's name.
+
+    Returns:
+    the kernel callable.
+    """
+    kernel = _backends[_active].get(name)
+    if kernel is None:
+        kernel = _backends['numpy'][name]
+    return kernel
+
+def _load_optional_backends():
+    """
+    Register backends that depend on optional packages, the first time they
+    are asked for, so that importing Tracer does not pay for them.
+    """
+    if 'numba' in _backends:
+        return
+    try:
+        from .numba_kernels import KERNELS
+    except ImportError:
+        return
+    for name, kernel in KERNELS.iteritems():
+        register_kernel('numba', name, kernel)
+
+# Reference implementations:
+def flat_intersections(frame, vertices, directions):
+    """
+    Intersect rays with the infinite XY plane of a frame.
+
+    Arguments:
+    frame - a 4x4 homogenous transform of the plane's frame.
+    vertices, directions - each a 3 by n array, of the rays' starting points
+        and unit directions respectively.
+
+    Returns:
+    params - the parametric position of intersection along each ray, or +inf
+        for rays that miss.
+    backside - a boolean array, True for rays hitting the plane from its
+        negative-Z side.
+    """
+    v = vertices - frame[:3,3][:,None]
+
+    # Vet out parallel rays:
+    dt = N.dot(directions.T, frame[:3,2])
+    unparallel = abs(dt) > 1e-10
+
+    params = N.empty(vertices.shape[1])
+    params.fill(N.inf)
+
+    vt = N.dot(frame[:3,2], v[:,unparallel])
+    params[unparallel] = -vt/dt[unparallel]
+    params[params < 0] = N.inf
+
+    return params, dt > 0
+
+def _finite_flat_intersections(frame, vertices, directions):
+    """
+    Extends flat_intersections() by also returning the global and local
+    coordinates of the intersection points, for trimming by the finite flat
+    kernels.
+    """
+    params, backside = flat_intersections(frame, vertices, directions)
+
+    # Invalid values belong to rays that missed and can't be selected anyway.
+    oldsettings = N.seterr(invalid='ignore')
+    glob = vertices + params[None,:]*directions
+    N.seterr(**oldsettings)
+    local = N.dot(N.linalg.inv(frame), N.vstack((glob, N.ones(glob.shape[1]))))
+
+    return params, backside, glob, local
+
+def rect_plate_intersections(frame, vertices, directions, half_dims):
+    """
+    Intersect rays with a rectangle centered on the origin of a frame's XY
+    plane.
+
+    Arguments:
+    frame, vertices, directions - as in flat_intersections()
+    half_dims - a 2-array, half the rectangle's extent along the local x and
+        y axes.
+
+    Returns:
+    params, backside - as in flat_intersections()
+    glob - a 3 by n array with the global intersection points (undefined for
+        rays that miss).
+    """
+    params, backside, glob, local = \
+        _finite_flat_intersections(frame, vertices, directions)
+    params[N.any(abs(local[:2]) > N.c_[half_dims], axis=0)] = N.inf
+    return params, backside, glob
+
+def instanced_rect_intersections(frames, vertices, directions, half_dims,
+        min_param=1e-6):
+    """
+    Intersect rays with many copies of one rectangle, each centered on the
+    origin of its own frame's XY plane, and find the nearest copy hit by each
+    ray. The copies are processed in blocks, so that the temporary arrays
+    hold about _BLOCK_ELEMENTS values each.
+
+    Arguments:
+    frames - an (m,4,4) array, the frame of each copy.
+    vertices, directions - as in flat_intersections().
+    half_dims - as in rect_plate_intersections().
+    min_param - intersections this close to a ray's vertex are ignored, so
+        that a ray leaving one copy is not found to hit it again.
+
+    Returns:
+    params - the parametric position of each ray's nearest intersection, or
+        +inf for rays that miss all copies.
+    owner - the index of the copy hit by each ray, or -1 for a miss.
+    """
+    num_rays = vertices.shape[1]
+    params = N.empty(num_rays)
+    params.fill(N.inf)
+    owner = N.empty(num_rays, dtype=N.int_)
+    owner.fill(-1)
+    block = max(1, _BLOCK_ELEMENTS//max(num_rays, 1))
+    rays = N.arange(num_rays)
+
+    oldsettings = N.seterr(divide='ignore', invalid='ignore')
+    for start in xrange(0, frames.shape[0], block):
+        f = frames[start:start + block]
+        origins = f[:,:3,3]
+
+        dt = N.dot(f[:,:3,2], directions)
+        vt = N.dot(f[:,:3,2], vertices) - \
+            N.sum(f[:,:3,2]*origins, axis=1)[:,None]
+        prm = -vt/dt
+        prm[~((abs(dt) > 1e-10) & (prm > min_param))] = N.inf
+
+        for axis in xrange(2):
+            local = N.dot(f[:,:3,axis], vertices) - \
+                N.sum(f[:,:3,axis]*origins, axis=1)[:,None] + \
+                prm*N.dot(f[:,:3,axis], directions)
+            prm[~(abs(local) <= half_dims[axis])] = N.inf
+
+        nearest = N.argmin(prm, axis=0)
+        block_prm = prm[nearest, rays]
+        closer = block_prm < params
+        params[closer] = block_prm[closer]
+        owner[closer] = nearest[closer] + start
+    N.seterr(**oldsettings)
+
+    return params, owner
+
+def round_plate_intersections(frame, vertices, directions, R):
+    """
+    Intersect rays with a circle of radius R centered on the origin of a
+    frame's XY plane. Arguments and return values are as in
+    rect_plate_intersections(), except the radius replacing half_dims.
+    """
+    params, backside, glob, local = \
+        _finite_flat_intersections(frame, vertices, directions)
+    params[N.sum(local[:2]**2, axis=0) > R**2] = N.inf
+    return params, backside, glob
+
+def triangle_intersections(frame, vertices, directions, tri_verts):
+    """
+    Intersect rays with a triangle on a frame's XY plane, whose vertices are
+    the frame's origin and two more points, using barycentric coordinates.
+    Arguments and return values are as in rect_plate_intersections(), except
+    tri_verts (a 3x2 array whose columns are the two non-origin vertices, in
+    local coordinates) replacing half_dims.
+    """
+    params, backside, glob, local = \
+        _finite_flat_intersections(frame, vertices, directions)
+    
+    # Transform the charachteristic vertices to the global systenm, then
+    # project the global intersection points to get barycentric
+    # coordinates, see references in tracer.triangular_face.
+    glob_verts = N.dot(frame, N.vstack((tri_verts, N.array([1,1]))))
+    rel_glob = glob_verts[:3].T - frame[:3,3]
+    w = glob.T - frame[:3,3]
+
+    uv = N.dot(tri_verts[:,0], tri_verts[:,1])
+    rel_dots = N.dot(w, rel_glob.T)
+    norms_sq = N.sum(tri_verts**2, axis=0)
+
+    bc = (uv*rel_dots[:,::-1] - norms_sq[::-1]*rel_dots) / \
+        (uv**2 - norms_sq[0]*norms_sq[1])
+
+    outside = N.any(bc < 0, axis=1) | (bc.sum(axis=1) > 1)
+    params[outside] = N.inf
+
+    return params, backside, glob
+
+def quadric_roots(A, B, C):
+    """
+    Solve the quadratic equation A*t**2 + B*t + C = 0 for each ray, falling
+    back to the linear solution where A is negligible.
+
+    Arguments:
+    A, B, C - 1D arrays with the equation's coefficients for each ray.
+
+    Returns:
+    a 2 by n array with the smaller root in the first row and the larger in
+    the second for A > 0 (equal roots for the linear case). Both are NaN for rays with no
+    real root.
+    """
+    hits = N.empty((2, len(A)))
+    hits.fill(N.nan)
+
+    delta = B**2 - 4*A*C
+    any_inters = delta >= 0
+    A = A[any_inters]
+    B = B[any_inters]
+    C = C[any_inters]
+    delta = N.sqrt(delta[any_inters])
+
+    roots = N.empty((2, len(A)))
+    almost_planar = A <= 1e-10
+    really_quadric = ~almost_planar
+    roots[:,almost_planar] = N.tile(-C[almost_planar]/B[almost_planar], (2,1))
+    roots[:,really_quadric] = (-B[really_quadric] + \
+        N.c_[[-1, 1]]*delta[really_quadric])/(2*A[really_quadric])
+    hits[:,any_inters] = roots
+
+    return hits
+
+def quadric_select_positive(prm):
+    """
+    The default choice between two intersection points of a ray with a
+    quadric: the first one not behind the ray's vertex.
+
+    Arguments:
+    prm - a 2 by n array of parametric positions of intersections.
+
+    Returns:
+    A 1D float array with the index (0 or 1) of the selected intersection, or
+    NaN if neither will do.
+    """
+    is_positive = prm > 0
+    select = N.empty(prm.shape[1])
+
+    # If both are negative, it is a miss
+    # This line also catches the cases of the last xor.
+    select[~N.logical_or(*is_positive)] = N.nan
+
+    # If both are positive, use the smaller one
+    select[N.logical_and(*is_positive)] = 0
+
+    # If either one is negative, use the positive one
+    one_pos = N.logical_xor(*is_positive)
+    select[one_pos] = N.nonzero(is_positive.T[one_pos,:])[1]
+
+    return select
+
+for _name, _kernel in [
+    ('flat_intersections', flat_intersections),
+    ('rect_plate_intersections', rect_plate_intersections),
+    ('round_plate_intersections', round_plate_intersections),
+    ('instanced_rect_intersections', instanced_rect_intersections),
+    ('triangle_intersections', triangle_intersections),
+    ('quadric_roots', quadric_roots),
+    ('quadric_select_positive', quadric_select_positive),
+    ('reflections', optics.reflections),
+    ('refractions', optics.refractions),
+    ('fresnel', optics.fresnel)]:
+    register_kernel('numpy', _name, _kernel)
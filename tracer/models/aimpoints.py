@@ -0,0 +1,267 @@
+"""
+Aim point strategies for a heliostat field, evaluated without re-tracing.
+
+The flux on the receiver is the sum of the contributions of the
+heliostats, and each contribution depends (nearly) only on where its own
+heliostat is aimed. So the flux image of each heliostat is traced for each
+of a few aim point offsets - the basis - and the flux of any strategy
+assigning a basis offset to each heliostat is then a weighted sum of these
+images, i.e. one matrix product. The whole field is traced once per offset,
+and the receiver's hits are split into images by the heliostat that
+reflected them, so the field must tag contributors (see HeliostatField).
+The interaction of heliostats through shading and blocking is taken from
+the traces, where all heliostats share the same offset.
+
+Example::
+
+    field = HeliostatField(positions, 2., 2., 0.1, 50., contributors=True)
+    plant = Assembly(objects=[rec_obj], subassemblies=[field])
+    offsets = N.c_[N.zeros(5), N.zeros(5), N.linspace(-2, 2, 5)]
+    images = trace_flux_images(field, plant, rec_surf, 8., 8., offsets,
+        azimuth, elevation, 200, 0.00465, (40, 40))
+    assignment = optimize_aimpoints(images, peak_limit=1000.)
+    field.aim_to_sun(azimuth, elevation, offsets[assignment])
+"""
+
+import numpy as N
+
+from ..tracer_engine import TracerEngine
+from ..random_streams import as_stream
+from .heliostat_field import field_bundle
+
+class FluxImages(object):
+    """
+    The receiver flux image of each heliostat for each aim point offset of a
+    basis.
+    """
+    def __init__(self, images, width, height):
+        """
+        Arguments:
+        images - an (n,k,ny,nx) array, the flux of heliostat i aimed with
+            basis offset j on each receiver pixel. Rows go along the
+            receiver's local y axis and columns along its x axis.
+        width, height - the receiver's extent along its local x and y axes.
+        """
+        self._images = images
+        self._flat = images.reshape(images.shape[0]*images.shape[1], -1)
+        self._width = width
+        self._height = height
+
+    def get_images(self):
+        return self._images
+
+    def get_num_heliostats(self):
+        return self._images.shape[0]
+
+    def get_num_offsets(self):
+        return self._images.shape[1]
+
+    def get_pixel_area(self):
+        ny, nx = self._images.shape[2:]
+        return self._width*self._height/(nx*ny)
+
+    def weights(self, assignment):
+        """
+        Convert an assignment of one offset per heliostat to the weights of
+        the images.
+
+        Arguments:
+        assignment - an integer array with the basis index of each heliostat.
+
+        Returns:
+        an (n,k) array, 1 for the assigned offset and 0 elsewhere.
+        """
+        weights = N.zeros(self._images.shape[:2])
+        weights[N.arange(len(assignment)), assignment] = 1.
+        return weights
+
+    def flux(self, assignment):
+        """
+        The receiver flux of an aiming strategy.
+
+        Arguments:
+        assignment - an integer array with the basis index of each heliostat,
+            or an (n,k) array of weights of the images, e.g. for splitting
+            each heliostat's time between aim points.
+
+        Returns:
+        an (ny,nx) array, the flux on each pixel of the receiver.
+        """
+        if assignment.ndim == 1:
+            assignment = self.weights(assignment)
+        return N.dot(assignment.flatten().astype(self._flat.dtype),
+            self._flat).reshape(
+            self._images.shape[2:])
+
+    def intercepted(self, assignment):
+        """The total power on the receiver with a given assignment."""
+        return self.flux(assignment).sum()*self.get_pixel_area()
+
+def trace_flux_images(field, assembly, receiver, width, height, offsets,
+        azimuth, elevation, rays_per_heliostat, ang_range, bins, reps=100,
+        min_energy=1e-9, prng=None, **kwds):
+    """
+    Trace the flux image of each heliostat on a flat rectangular receiver,
+    for each aim point offset of a basis.
+
+    For each offset, all heliostats are aimed with that offset and the
+    whole field is traced once. Each hit on the receiver goes to the image
+    of the heliostat that last reflected its ray, so a heliostat's image
+    also holds the energy it reflects from rays aimed at its neighbours.
+    The field is left aimed with the last offset.
+
+    Arguments:
+    field - the HeliostatField, made with contributors=True.
+    assembly - the plant's assembly, holding the field and the receiver.
+    receiver - the receiver's Surface, centered on its local XY plane. Its
+        optics manager should have get_all_hits() and
+        get_all_contributors(), like ReflectiveReceiver.
+    width, height - the receiver's extent along its local x and y axes.
+    offsets - a (k,3) array, the basis of aim point offsets from the tower's
+        target.
+    azimuth, elevation - the sun's position, as in solar_vector().
+    rays_per_heliostat, ang_range, kwds - passed on to field_bundle().
+    bins - the number of image pixels along the x and y axes.
+    reps, min_energy - passed on to TracerEngine.ray_tracer().
+    prng - a RandomStream or seed. Offset j's rays are drawn from
+        prng.spawn(j).spawn(0), and traced with prng.spawn(j).spawn(1).
+
+    Returns:
+    a FluxImages object with the traced images, of flux per unit of direct
+        normal irradiance, in single precision.
+    """
+    if not field.tags_contributors():
+        raise ValueError("The field must tag contributors to split the " \
+            "flux by heliostat")
+
+    engine = TracerEngine(assembly)
+    optics = receiver.get_optics_manager()
+    stream = as_stream(prng)
+    num_hstats = field.get_positions().shape[0]
+    nx, ny = bins
+    num_pixels = nx*ny
+
+    images = N.empty((num_hstats, len(offsets), ny, nx), dtype=N.float32)
+    for offs_idx, offset in enumerate(offsets):
+        offs_stream = stream.spawn(offs_idx)
+        field.aim_to_sun(azimuth, elevation, offset)
+        rays = field_bundle(field, rays_per_heliostat, azimuth, elevation, 1.,
+            ang_range, prng=offs_stream.spawn(0), **kwds)
+
+        optics.reset()
+        engine.ray_tracer(rays, reps, min_energy, tree=False,
+            prng=offs_stream.spawn(1))
+
+        energy, hits = optics.get_all_hits()
+        pixels, inside = _pixel_indices(hits, receiver, width, height, bins)
+        hstats = optics.get_all_contributors()
+        inside &= hstats >= 0
+        energy = N.bincount(hstats[inside]*num_pixels + pixels[inside],
+            energy[inside], minlength=num_hstats*num_pixels)
+        images[:,offs_idx] = energy.reshape(num_hstats, ny, nx)*(
+            num_pixels/(width*height))
+
+    optics.reset()
+    return FluxImages(images, width, height)
+
+def _pixel_indices(hits, receiver, width, height, bins):
+    """
+    Find the pixel of a flat rectangular receiver's flux map that each hit
+    falls in, see bin_flux().
+
+    Returns:
+    pixels - the index of each hit's pixel in the flattened (ny,nx) map.
+    inside - a boolean array, True for hits that fall in the map.
+    """
+    nx, ny = bins
+    to_local = N.linalg.inv(receiver.get_global_transform())
+    local = N.dot(to_local[:2,:3], hits) + to_local[:2,3][:,None]
+    inside = (abs(local[0]) <= width/2.) & (abs(local[1]) <= height/2.)
+
+    # The far edges belong to the last pixels, as in N.histogram2d():
+    col = N.minimum(((local[0]/width + 0.5)*nx).astype(N.int_), nx - 1)
+    row = N.minimum(((local[1]/height + 0.5)*ny).astype(N.int_), ny - 1)
+    return N.where(inside, row*nx + col, 0), inside
+
+def bin_flux(energy, hits, receiver, width, height, bins):
+    """
+    Make a flux map of the hits on a flat rectangular receiver.
+
+    Arguments:
+    energy - the energy absorbed at each hit.
+    hits - a 3 by n array, the global coordinates of the hits.
+    receiver - the receiver's Surface, centered on its local XY plane.
+    width, height - the receiver's extent along its local x and y axes.
+    bins - the number of pixels along the x and y axes.
+
+    Returns:
+    an (ny,nx) array, the energy per unit area in each pixel. Rows go along
+        the receiver's local y axis and columns along its x axis.
+    """
+    nx, ny = bins
+    pixels, inside = _pixel_indices(hits, receiver, width, height, bins)
+    image = N.bincount(pixels[inside], energy[inside], minlength=nx*ny)
+    return image.reshape(ny, nx)*(nx*ny)/(width*height)
+
+def optimize_aimpoints(images, peak_limit=None, start=None, candidates=20,
+        max_moves=None):
+    """
+    Find an aiming strategy with a low peak flux, by moving one heliostat at
+    a time to the basis offset that most reduces the peak.
+
+    At each step, the heliostats and offsets that most reduce the flux at
+    the current peak pixel are tried, and the move that gives the lowest
+    peak over the whole receiver is made, if it lowers the peak. Since
+    moving heliostats from the receiver's center usually spills some of
+    their energy, the search stops as soon as the peak is within the limit.
+
+    Arguments:
+    images - a FluxImages object.
+    peak_limit - the allowed peak flux. If None, the peak is reduced as far
+        as single moves allow.
+    start - the initial assignment of a basis index to each heliostat. By
+        default all heliostats are aimed with offset 0.
+    candidates - the number of moves tried at each step.
+    max_moves - stop after this many moves. By default, after two moves per
+        heliostat.
+
+    Returns:
+    an integer array with the basis index of each heliostat.
+    """
+    num_hstats = images.get_num_heliostats()
+    num_offs = images.get_num_offsets()
+    flat = images.get_images().reshape(num_hstats, num_offs, -1)
+
+    if start is None:
+        assignment = N.zeros(num_hstats, dtype=N.int_)
+    else:
+        assignment = N.array(start, dtype=N.int_)
+    if max_moves is None:
+        max_moves = 2*num_hstats
+
+    flux = images.flux(assignment).flatten()
+    hstats = N.arange(num_hstats)
+    for move in xrange(max_moves):
+        peak_pixel = N.argmax(flux)
+        peak = flux[peak_pixel]
+        if peak_limit is not None and peak <= peak_limit:
+            break
+
+        # Change of the peak pixel's flux for each possible move:
+        at_peak = flat[:,:,peak_pixel]
+        delta = at_peak - at_peak[hstats, assignment][:,None]
+        tried = N.argsort(delta, axis=None)[:candidates]
+        tried = tried[delta.flat[tried] < 0]
+        if len(tried) == 0:
+            break
+
+        hidx, oidx = N.unravel_index(tried, delta.shape)
+        new_flux = flux + flat[hidx, oidx] - flat[hidx, assignment[hidx]]
+        best = N.argmin(new_flux.max(axis=1))
+        if new_flux[best].max() >= peak:
+            break
+
+        assignment[hidx[best]] = oidx[best]
+        flux = new_flux[best]
+
+    return assignment
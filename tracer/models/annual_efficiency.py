@@ -0,0 +1,265 @@
+"""
+Annual performance from a table of optical efficiencies over sun positions.
+
+Tracing a plant for every hour of a year is rarely affordable. Instead, the
+optical efficiency is traced for a grid of a few hundred sun positions, in
+parallel, and interpolated for any time of the year. Where the plant is
+symmetric, some of the grid positions are copied from their mirror images
+instead of being traced.
+
+Sun positions follow the conventions of heliostat_field.solar_vector(): the
+azimuth is in radians from east, through south at noon in the northern
+hemisphere, and the "elevation" is the sun's angle from the zenith.
+
+Example::
+
+    evaluate = field_evaluator(field, plant, receiver, 100, 0.00465)
+    table = efficiency_table(evaluate, N.linspace(0, 2*N.pi, 37),
+        N.linspace(0, N.pi/2, 10), mirror_azimuth=N.pi/2, prng=1234)
+    hourly = table.at_times(days, hours, latitude)
+"""
+
+import numpy as N
+
+from ..tracer_engine import TracerEngine
+from ..random_streams import as_stream
+from ..parallel import map_forked
+from .heliostat_field import field_bundle, solar_vector
+
+def sun_position(day, hour, latitude):
+    """
+    Calculate the sun's position using Cooper's declination and the hour
+    angle of solar time.
+
+    Arguments:
+    day - the day of the year, 1 to 365.
+    hour - the solar time, in hours, 12 being solar noon.
+    latitude - of the plant, in radians, positive to the north.
+
+    Returns:
+    azimuth, elevation - the sun's position, as in solar_vector(). The
+        elevation is larger than pi/2 when the sun is below the horizon.
+    """
+    decl = N.radians(23.45)*N.sin(2*N.pi*(284 + N.asarray(day))/365.)
+    hour_ang = N.radians(15.)*(N.asarray(hour) - 12)
+
+    east = -N.cos(decl)*N.sin(hour_ang)
+    north = N.cos(latitude)*N.sin(decl) - \
+        N.sin(latitude)*N.cos(decl)*N.cos(hour_ang)
+    up = N.sin(latitude)*N.sin(decl) + \
+        N.cos(latitude)*N.cos(decl)*N.cos(hour_ang)
+
+    return N.arctan2(-north, east) % (2*N.pi), N.arccos(N.clip(up, -1, 1))
+
+class EfficiencyTable(object):
+    """
+    Efficiencies tabulated on a grid of sun positions, with bilinear
+    interpolation between them.
+    """
+    def __init__(self, azimuths, elevations, efficiencies):
+        """
+        Arguments:
+        azimuths, elevations - increasing 1D arrays, the grid's sun positions.
+        efficiencies - an array with a row for each azimuth and a column for
+            each elevation.
+        """
+        self._azims = N.asarray(azimuths, dtype=N.float_)
+        self._elevs = N.asarray(elevations, dtype=N.float_)
+        self._effs = N.asarray(efficiencies, dtype=N.float_)
+
+    def get_azimuths(self):
+        return self._azims
+
+    def get_elevations(self):
+        return self._elevs
+
+    def get_efficiencies(self):
+        return self._effs
+
+    def __call__(self, azimuth, elevation):
+        """
+        Interpolate the efficiency at sun positions. Positions outside the
+        table take the values at its edges.
+
+        Arguments:
+        azimuth, elevation - arrays of the same shape, or scalars.
+
+        Returns:
+        an array of the shape of the arguments, the efficiency at each sun
+            position.
+        """
+        a_idx, a_frac = _grid_cell(self._azims, azimuth)
+        e_idx, e_frac = _grid_cell(self._elevs, elevation)
+
+        effs = self._effs
+        return (1 - a_frac)*(1 - e_frac)*effs[a_idx, e_idx] + \
+            a_frac*(1 - e_frac)*effs[a_idx + 1, e_idx] + \
+            (1 - a_frac)*e_frac*effs[a_idx, e_idx + 1] + \
+            a_frac*e_frac*effs[a_idx + 1, e_idx + 1]
+
+    def at_times(self, day, hour, latitude):
+        """
+        Interpolate the efficiency at given times, see sun_position(). When
+        the sun is below the horizon the efficiency is 0.
+
+        Arguments:
+        day, hour, latitude - as in sun_position().
+
+        Returns:
+        an array with the efficiency at each time.
+        """
+        azimuth, elevation = sun_position(day, hour, latitude)
+        return N.where(elevation < N.pi/2, self(azimuth, elevation), 0.)
+
+def _grid_cell(grid, values):
+    """
+    Find the cell of a 1D grid containing each value, and the value's
+    relative position in it.
+
+    Returns:
+    index - the index of each cell's lower grid point.
+    frac - the part of the cell below each value, 0 to 1.
+    """
+    values = N.clip(values, grid[0], grid[-1])
+    if len(grid) == 1:
+        return N.zeros(N.shape(values), dtype=N.int_), N.zeros(N.shape(values))
+    index = N.clip(N.searchsorted(grid, values, side='right') - 1, 0,
+        len(grid) - 2)
+    frac = (values - grid[index])/(grid[index + 1] - grid[index])
+    return index, frac
+
+def efficiency_table(evaluate, azimuths, elevations, mirror_azimuth=None,
+        prng=None, processes=None):
+    """
+    Trace the efficiency of a plant for a grid of sun positions, each in a
+    parallel worker process.
+
+    Positions with the sun at the zenith are traced once, as the azimuth is
+    meaningless there. If the plant is symmetric about the vertical plane
+    holding the sun at ``mirror_azimuth`` (see field_is_symmetric()), each
+    position is only traced once with its mirror image azimuth
+    2*mirror_azimuth - azimuth (modulo 2*pi), when both are in the grid.
+
+    Arguments:
+    evaluate - a function of (azimuth, elevation, prng) that aims the plant,
+        e.g. using HeliostatField.aim_to_sun() or by setting a dish's
+        transform, traces it and returns its efficiency. prng is the
+        RandomStream to draw all random numbers of the trace from. See
+        field_evaluator().
+    azimuths, elevations - increasing 1D arrays, the grid's sun positions.
+    mirror_azimuth - the azimuth of the plant's plane of symmetry, or None
+        if it has none.
+    prng - a RandomStream or seed; the trace at azimuth index i and elevation
+        index j uses prng.spawn(i*len(elevations) + j).
+    processes - number of worker processes. None means one per CPU; 1
+        traces in this process.
+
+    Returns:
+    an EfficiencyTable.
+    """
+    azimuths = N.asarray(azimuths, dtype=N.float_)
+    elevations = N.asarray(elevations, dtype=N.float_)
+    source = _grid_sources(azimuths, elevations, mirror_azimuth)
+    to_trace = N.unique(source)
+
+    traced = map_forked(_evaluate_one,
+        (evaluate, azimuths, elevations, as_stream(prng)), to_trace, processes)
+
+    effs = N.empty(source.size)
+    effs[to_trace] = traced
+    effs = effs[source].reshape(len(azimuths), len(elevations))
+    return EfficiencyTable(azimuths, elevations, effs)
+
+def _evaluate_one(job, flat_idx):
+    """Trace the grid position with a given flat index, for a job."""
+    evaluate, azimuths, elevations, prng = job
+    az_idx, elev_idx = divmod(flat_idx, len(elevations))
+    return evaluate(azimuths[az_idx], elevations[elev_idx],
+        prng.spawn(flat_idx))
+
+def _grid_sources(azimuths, elevations, mirror_azimuth=None):
+    """
+    Find for each grid position the position whose trace gives its
+    efficiency.
+
+    Returns:
+    an array with the flat index (az_idx*len(elevations) + elev_idx) of the
+        traced position for each flat index of the grid.
+    """
+    num_elevs = len(elevations)
+    def same_azimuth(az1, az2):
+        return abs((az1 + N.pi - az2) % (2*N.pi) - N.pi) < 1e-9
+
+    # Each azimuth takes the lowest index of the same azimuth (modulo 2*pi)
+    # or of its mirror image:
+    equiv = same_azimuth(azimuths[None,:], azimuths[:,None])
+    if mirror_azimuth is not None:
+        equiv |= same_azimuth(azimuths[None,:],
+            2*mirror_azimuth - azimuths[:,None])
+    az_source = N.argmax(equiv, axis=1)
+
+    source = (az_source[:,None]*num_elevs + N.arange(num_elevs)).flatten()
+    zenith = N.nonzero(elevations == 0)[0]
+    if len(zenith) > 0:
+        source.reshape(-1, num_elevs)[:,zenith] = zenith
+    return source
+
+def field_is_symmetric(positions, mirror_azimuth, tol=1e-6):
+    """
+    Check whether heliostat positions are symmetric about the vertical plane
+    through the tower holding the sun at a given azimuth, so that sun
+    positions mirrored about that plane have the same efficiency.
+
+    Arguments:
+    positions - an (n,3) array of heliostat positions.
+    mirror_azimuth - the sun azimuth in the plane of symmetry.
+    tol - the largest distance of a mirrored position from a heliostat
+        position.
+
+    Returns:
+    True if each mirrored position is also a heliostat position.
+    """
+    in_plane = solar_vector(mirror_azimuth, N.pi/2)
+    perp = N.r_[-in_plane[1], in_plane[0], 0.]
+    mirrored = positions - 2*N.dot(positions, perp)[:,None]*perp
+
+    keys = N.round(positions/tol).astype(N.int64)
+    mirrored_keys = N.round(mirrored/tol).astype(N.int64)
+    return set(map(tuple, keys)) == set(map(tuple, mirrored_keys))
+
+def field_evaluator(field, assembly, receiver, rays_per_heliostat, ang_range,
+        reps=100, min_energy=1e-9, **kwds):
+    """
+    Make an efficiency function of a heliostat field for efficiency_table().
+
+    The efficiency is the energy absorbed by the receiver, divided by the
+    direct normal irradiance on the total mirror area of the field.
+
+    Arguments:
+    field - the HeliostatField.
+    assembly - the plant's assembly, holding the field and the receiver.
+    receiver - the receiver's optics manager, with an get_all_hits() method,
+        e.g. a ReflectiveReceiver.
+    rays_per_heliostat, ang_range, kwds - passed on to field_bundle().
+    reps, min_energy - passed on to TracerEngine.ray_tracer().
+
+    Returns:
+    a function of (azimuth, elevation, prng) returning the efficiency.
+    """
+    engine = TracerEngine(assembly)
+    mirror_area = 4*N.prod(field.get_heliostat_half_dims())* \
+        field.get_positions().shape[0]
+
+    def evaluate(azimuth, elevation, prng):
+        field.aim_to_sun(azimuth, elevation)
+        rays = field_bundle(field, rays_per_heliostat, azimuth, elevation, 1.,
+            ang_range, prng=prng.spawn(0), **kwds)
+
+        receiver.reset()
+        engine.ray_tracer(rays, reps, min_energy, tree=False,
+            prng=prng.spawn(1))
+        absorbed = receiver.get_all_hits()[0].sum()
+        receiver.reset()
+        return absorbed/mirror_area
+
+    return evaluate
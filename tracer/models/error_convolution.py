@@ -0,0 +1,122 @@
+"""
+Add optical errors to flux maps traced with ideal optics, instead of
+tracing the errors.
+
+A small angular error of a ray leaving the concentrator moves its hit
+point on the receiver by about the error angle times the distance to the
+receiver - the focal length. The flux map with errors is then the ideal
+flux map convolved with the error distribution, projected to the receiver
+plane. The convolution is done by FFT, and the transform of the ideal map
+is reused for all kernels of an error sweep.
+
+Example::
+
+    H, xbins, ybins = receiver.histogram_hits(50)
+    pixel = (xbins[1] - xbins[0], ybins[1] - ybins[0])
+    kernels = [project_kernel(gaussian_pdf(2*s), 8*s, focal, pixel)
+        for s in slope_errors]
+    maps = convolve_sweep(H, kernels, 'reflect')
+"""
+
+import numpy as N
+
+def gaussian_pdf(sigma):
+    """
+    Make the density of a round Gaussian distribution of ray angles, e.g.
+    that of rays reflected by a mirror with a slope error of sigma/2.
+
+    Arguments:
+    sigma - the standard deviation of the angle in each direction.
+
+    Returns:
+    a function of the x and y angles (arrays of the same shape) returning
+        the density at each angle.
+    """
+    def pdf(ang_x, ang_y):
+        return N.exp(-(ang_x**2 + ang_y**2)/(2.*sigma**2))/(2*N.pi*sigma**2)
+    return pdf
+
+def project_kernel(pdf, max_angle, focal_length, pixel_size, oversample=5):
+    """
+    Project an angular error distribution to a convolution kernel on the
+    pixels of a receiver's flux map.
+
+    Arguments:
+    pdf - the density of the angular errors, a function of the x and y
+        angles, e.g. from gaussian_pdf().
+    max_angle - the kernel covers errors up to this angle in each direction.
+    focal_length - the distance from the concentrator to the receiver.
+    pixel_size - a tuple, the size of a pixel along the map's first and
+        second axes.
+    oversample - the density is averaged over this many points along each
+        axis of a pixel, so that kernels narrower than a pixel are not lost.
+
+    Returns:
+    a 2D array with an odd number of pixels along each axis, centered on the
+        zero error and summing to 1.
+    """
+    axes = []
+    for size in pixel_size:
+        half = int(N.ceil(max_angle*focal_length/size - 0.5))
+        sub = (N.arange((2*half + 1)*oversample) + 0.5)/oversample - \
+            (half + 0.5)
+        axes.append(sub*size/focal_length)
+
+    ang_x, ang_y = N.meshgrid(axes[0], axes[1], indexing='ij')
+    dens = pdf(ang_x, ang_y)
+    shape = (len(axes[0])//oversample, oversample,
+        len(axes[1])//oversample, oversample)
+    kernel = dens.reshape(shape).sum(axis=3).sum(axis=1)
+    return kernel/kernel.sum()
+
+def convolve_sweep(flux, kernels, boundary='fill'):
+    """
+    Convolve one flux map with each of several kernels, transforming the
+    map only once.
+
+    Arguments:
+    flux - a 2D array, e.g. the energy on each pixel of a receiver.
+    kernels - a list of 2D arrays with an odd number of pixels along each
+        axis, centered on their middle pixel, e.g. from project_kernel().
+    boundary - what happens to energy moved past the map's edges: 'fill'
+        loses it, as for a receiver that the rays miss; 'reflect' folds it
+        back as a mirror at each edge would, as for the walls of a
+        homogenizer at the receiver. Only symmetric kernels are folded
+        correctly.
+
+    Returns:
+    a list with the convolved map for each kernel, of the shape of flux.
+    """
+    half = N.max([k.shape for k in kernels], axis=0)//2
+    if boundary == 'reflect':
+        # Mirroring the map is the same as folding back the spread energy,
+        # for kernels symmetric about their center. Wide kernels fold
+        # several times.
+        work = N.pad(flux, ((half[0], half[0]), (half[1], half[1])),
+            'symmetric')
+    elif boundary == 'fill':
+        work = flux
+    else:
+        raise ValueError("Unknown boundary: %s" % boundary)
+
+    shape = tuple(N.array(work.shape) + 2*half)
+    work_fft = N.fft.rfft2(work, shape)
+
+    convolved = []
+    for kernel in kernels:
+        # Pad the kernel to the common size, keeping it centered:
+        pad = half - N.array(kernel.shape)//2
+        kernel = N.pad(kernel, ((pad[0], pad[0]), (pad[1], pad[1])),
+            'constant')
+        conv = N.fft.irfft2(work_fft*N.fft.rfft2(kernel, shape), shape)
+        conv = conv[half[0]:half[0] + work.shape[0],
+            half[1]:half[1] + work.shape[1]]
+        if boundary == 'reflect':
+            conv = conv[half[0]:half[0] + flux.shape[0],
+                half[1]:half[1] + flux.shape[1]]
+        convolved.append(conv)
+    return convolved
+
+def convolve_flux(flux, kernel, boundary='fill'):
+    """Convolve a flux map with one kernel, see convolve_sweep()."""
+    return convolve_sweep(flux, [kernel], boundary)[0]
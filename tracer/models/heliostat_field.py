@@ -13,11 +13,17 @@ References:
 import numpy as N
 
 from ..assembly import Assembly
+from ..object import AssembledObject, TransformBatch
+from ..surface import Surface
+from ..flat_surface import RectPlateGM
+from ..instancing import InstancedGM, GridInstancedGM
+from .. import optics_callables as opt
 from .one_sided_mirror import rect_one_sided_mirror
-from ..spatial_geometry import rotx, roty, rotz
+from ..sources import rects_bundle
 
 class HeliostatField(Assembly):
-    def __init__(self, positions, width, height, absorpt, aim_height):
+    def __init__(self, positions, width, height, absorpt, aim_height,
+            instanced=False, grid=False, contributors=False):
         """
         Generates a field of heliostats, each being a rectangular one-sided
         mirror, initially pointing downward - for safety reasons, of course :)
@@ -29,30 +35,148 @@ class HeliostatField(Assembly):
             heliostat.
         apsorpt - part of incident energy absorbed by the heliostat.
         aim_height - the height (Z coordinate) of the target for aiming
+        instanced - if True, all heliostats are instances of one surface
+            (see tracer.instancing) instead of an object each, which saves
+            memory and setup time for large fields.
+        grid - if True, the field is instanced, and the heliostats are
+            indexed in a grid over their ground positions (see
+            tracer.instancing.GridInstancedGM), so that each ray is only
+            tested against nearby heliostats. Recommended for large fields.
+        contributors - if True, rays reflected by the heliostats are tagged
+            with the heliostat's index (see
+            tracer.optics_callables.ContributorTagger), so receivers can
+            break down their energy by heliostat. field_bundle() then tags
+            its rays as not yet reflected.
         """
         self._pos = positions  # Save collecting positions from the hstats.
         self._th = aim_height
-        face_down = rotx(N.pi)
+        self._half_dims = N.r_[width, height]/2.
+        self._parent_transform = N.eye(4)
+        self._batch = None
+        self._contributors = contributors
+        num_hstats = positions.shape[0]
         
-        self._heliostats = []
-        for pos in positions:
-            hstat = rect_one_sided_mirror(width, height, absorpt)
-            trans = face_down.copy()
-            trans[:3,3] = pos
-            hstat.set_transform(trans)
-            self._heliostats.append(hstat)
+        if instanced or grid:
+            gm_class = GridInstancedGM if grid else InstancedGM
+            init_trans = N.tile(N.eye(4), (num_hstats, 1, 1))
+            init_trans[:,:3,3] = positions
             
-        Assembly.__init__(self, objects=self._heliostats)
+            optics = opt.Reflective(absorpt)
+            if contributors:
+                optics = opt.ContributorTagger(optics)
+            
+            self._heliostats = []
+            self._mirror = Surface(gm_class(RectPlateGM(width, height),
+                init_trans), optics, back_optics=opt.Reflective(1.))
+            Assembly.__init__(self,
+                objects=[AssembledObject(surfs=[self._mirror])])
+        else:
+            self._mirror = None
+            self._heliostats = [rect_one_sided_mirror(width, height, absorpt,
+                hidx if contributors else None) for hidx in xrange(num_hstats)]
+            Assembly.__init__(self, objects=self._heliostats)
+            self._batch = TransformBatch(self._heliostats)
+        
+        # Face down is a rotation of pi around the x axis:
+        self.set_heliostat_transforms(heliostat_transforms(positions,
+            N.tile(N.r_[0., 0., -1.], (num_hstats, 1)),
+            N.tile(N.r_[1., 0., 0.], (num_hstats, 1))))
     
     def get_heliostats(self):
-        """Access the list of one-sided mirrors representing the heliostats"""
+        """
+        Access the list of one-sided mirrors representing the heliostats. An
+        instanced field has no per-heliostat objects, and returns an empty
+        list; see get_instanced_surface().
+        """
         return self._heliostats
     
+    def get_instanced_surface(self):
+        """
+        Returns:
+        the Surface holding all heliostats of an instanced field, whose
+            geometry manager is an InstancedGM; or None if the field is not
+            instanced.
+        """
+        return self._mirror
+    
+    def tags_contributors(self):
+        """True if rays are tagged with the heliostat reflecting them."""
+        return self._contributors
+    
+    def get_heliostat_transforms(self):
+        """
+        Returns:
+        an (n,4,4) array with the transform of each heliostat relative to
+            the field.
+        """
+        if self._mirror is not None:
+            return self._mirror.get_geometry_manager().get_transforms()
+        return self._batch.get_transforms()
+    
+    def get_heliostat_frames(self):
+        """
+        Returns:
+        an (n,4,4) array with the global frame of each heliostat's mirror.
+        """
+        return self.heliostat_frames(self.get_heliostat_transforms())
+    
+    def heliostat_frames(self, transforms):
+        """
+        The global frames that heliostats would have with given transforms,
+        without moving them.
+        
+        Arguments:
+        transforms - an (n,4,4) array of heliostat transforms relative to
+            the field, e.g. from heliostat_transforms().
+        
+        Returns:
+        an (n,4,4) array with the global frame of each heliostat's mirror.
+        """
+        return N.matmul(N.dot(self._parent_transform, self.get_transform()),
+            transforms)
+    
+    def get_heliostat_half_dims(self):
+        """A 2-array, half the width and height of each heliostat."""
+        return self._half_dims
+    
+    def set_heliostat_transforms(self, transforms):
+        """
+        Move all heliostats at once, updating the global frames of their
+        surfaces in one batch (see tracer.object.TransformBatch).
+        
+        Arguments:
+        transforms - an (n,4,4) array with the transform of each heliostat
+            relative to the field.
+        """
+        if self._mirror is not None:
+            self._mirror.get_geometry_manager().set_transforms(transforms)
+            return
+        self._batch.set_transforms(transforms,
+            N.dot(self._parent_transform, self.get_transform()))
+    
+    def transform_children(self, assembly_transform=N.eye(4)):
+        """
+        Transforms the entire field, moving the heliostats in one batch once
+        they have transforms (see set_heliostat_transforms()).
+        """
+        self._parent_transform = assembly_transform
+        if self._batch is None or self._batch.get_transforms() is None:
+            Assembly.transform_children(self, assembly_transform)
+        else:
+            self.set_heliostat_transforms(self._batch.get_transforms())
+    
+    def get_positions(self):
+        """The (n,3) array of heliostat positions given to the constructor."""
+        return self._pos
+    
+    def get_aim_height(self):
+        return self._th
+    
     def set_aim_height(self, h):
         """Change the verical position of the tower's target."""
         self._th = h
     
-    def aim_to_sun(self, azimuth, elevation):
+    def aim_to_sun(self, azimuth, elevation, aim_offsets=None):
         """
         Aim the heliostats in a direction that brings the incident energy to
         the tower.
@@ -61,25 +185,95 @@ class HeliostatField(Assembly):
         azimuth - the sun's azimuth, in radians from east, counterclockwise.
         elevation - angle created between the solar vector and the Z axis, 
             in radians.
+        aim_offsets - optionally, a 3-array or an (n,3) array, the offset of
+            each heliostat's aim point from the tower's target.
         """
-        sun_vec = solar_vector(azimuth, elevation)
-        tower_vec = -self._pos 
-        tower_vec[:,2] += self._th
-        tower_vec /= N.sqrt(N.sum(tower_vec**2, axis=1)[:,None])
-        hstat = sun_vec + tower_vec
-        hstat /= N.sqrt(N.sum(hstat**2, axis=1)[:,None])
-        
-        hstat_az = N.arctan2(hstat[:,1], hstat[:,0])
-        hstat_elev = N.arccos(hstat[:,2])
-        
-        for hidx in xrange(self._pos.shape[0]):
-            az_rot = rotz(hstat_az[hidx])
-            elev_rot = roty(hstat_elev[hidx])
-            
-            trans = N.dot(az_rot, elev_rot)
-            trans[:3,3] = self._pos[hidx]
-            
-            self._heliostats[hidx].set_transform(trans)
+        hstat = aim_normals(self._pos, self._th,
+            solar_vector(azimuth, elevation), aim_offsets)
+        self.set_heliostat_transforms(heliostat_transforms(self._pos, hstat))
+
+def aim_normals(positions, aim_height, sun_vec, aim_offsets=None):
+    """
+    Find the heliostat normals that reflect the sun to the tower's target.
+    
+    Arguments:
+    positions - an (n,3) array, the location of each heliostat.
+    aim_height - the height of the target, above the origin.
+    sun_vec - a unit 3-array pointing at the sun, see solar_vector().
+    aim_offsets - optionally, a 3-array or an (n,3) array, the offset of
+        each heliostat's aim point from the target.
+    
+    Returns:
+    an (n,3) array of unit normals.
+    """
+    tower_vec = -positions
+    tower_vec[:,2] += aim_height
+    if aim_offsets is not None:
+        tower_vec += aim_offsets
+    tower_vec /= N.sqrt(N.sum(tower_vec**2, axis=1)[:,None])
+    hstat = sun_vec + tower_vec
+    hstat /= N.sqrt(N.sum(hstat**2, axis=1)[:,None])
+    return hstat
+
+def heliostat_transforms(positions, normals, x_axes=None):
+    """
+    Calculate the transforms of many heliostats at once.
+    
+    Arguments:
+    positions - an (n,3) array, the location of each heliostat.
+    normals - an (n,3) array of unit vectors, the direction to which each
+        heliostat's local +z axis is turned.
+    x_axes - optionally, an (n,3) array of unit vectors perpendicular to the
+        normals, the directions of the local +x axes. By default the
+        heliostat is tilted about a horizontal axis after turning in
+        azimuth, i.e. the transform is rotz(azimuth)*roty(tilt) with the
+        azimuth and tilt of the normal.
+    
+    Returns:
+    an (n,4,4) array of homogenous transforms.
+    """
+    if x_axes is None:
+        horiz = N.sqrt(normals[:,0]**2 + normals[:,1]**2)
+        oldsettings = N.seterr(invalid='ignore', divide='ignore')
+        cos_az = N.where(horiz > 0, normals[:,0]/horiz, 1.)
+        sin_az = N.where(horiz > 0, normals[:,1]/horiz, 0.)
+        N.seterr(**oldsettings)
+        x_axes = N.c_[cos_az*normals[:,2], sin_az*normals[:,2], -horiz]
+    
+    trans = N.zeros((positions.shape[0], 4, 4))
+    trans[:,:3,0] = x_axes
+    trans[:,:3,1] = N.cross(normals, x_axes)
+    trans[:,:3,2] = normals
+    trans[:,:3,3] = positions
+    trans[:,3,3] = 1.
+    return trans
+
+def field_bundle(field, rays_per_heliostat, azimuth, elevation, flux,
+        ang_range, **kwds):
+    """
+    Generate sun rays aimed directly at the heliostats of a field, see
+    tracer.sources.rect_apertures_bundle() and rects_bundle().
+    
+    Arguments:
+    field - a HeliostatField.
+    rays_per_heliostat - number of rays aimed at each heliostat.
+    azimuth, elevation - the sun's position, as in solar_vector().
+    flux - the direct normal irradiance.
+    ang_range - the half-angle of a pillbox sunshape.
+    kwds - passed on to rect_apertures_bundle(), e.g. sunshape, sampler.
+    
+    Returns:
+    a RayBundle, with the rays aimed at each heliostat in the order of the
+        field's positions. If the field tags contributors, the rays have the
+        contributor property, set to -1.
+    """
+    frames = field.get_heliostat_frames()
+    half_dims = N.tile(field.get_heliostat_half_dims(), (frames.shape[0], 1))
+    rays = rects_bundle(frames, half_dims, rays_per_heliostat,
+        -solar_vector(azimuth, elevation), ang_range, flux, **kwds)
+    if field.tags_contributors():
+        rays = opt.with_contributors(rays)
+    return rays
 
 def solar_vector(azimuth, elevation):
     """
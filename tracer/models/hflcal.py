@@ -0,0 +1,192 @@
+"""
+An analytic model of the flux of a heliostat field on a flat receiver, in
+the manner of HFLCAL: the image of each heliostat is a round Gaussian beam,
+whose width combines the sunshape, the slope and tracking errors, and the
+heliostat's size, and which is cut obliquely by the receiver plane.
+
+The model is evaluated for all heliostats at once, and takes a small part
+of the time of a trace, so it is useful for screening aiming strategies and
+layouts before tracing the best of them. compare_to_trace() compares it to
+a trace on the same receiver pixels.
+
+All angular errors are standard deviations of the deviation of a ray from
+its nominal direction in one plane, in radians. A pillbox sunshape of
+half-angle r has r/2 as its standard deviation.
+"""
+
+import numpy as N
+
+from ..tracer_engine import TracerEngine
+from ..random_streams import as_stream
+from .heliostat_field import solar_vector, field_bundle
+from .shading_blocking import field_shading_blocking
+from .layout_optimizer import attenuation
+from .aimpoints import bin_flux
+
+# Approximate number of values in the temporary arrays of the flux sums.
+_BLOCK_ELEMENTS = 2**20
+
+def beam_sigmas(distance, cos_incidence, width, height, sigma_sun=0.00465/2,
+        sigma_slope=0.002, sigma_track=0.):
+    """
+    Calculate the width of each heliostat's beam where it meets the
+    receiver, in the plane normal to the beam.
+
+    Arguments:
+    distance - an array, the distance of each heliostat from its aim point.
+    cos_incidence - an array, the cosine of each heliostat's angle of
+        incidence.
+    width, height - of the heliostats.
+    sigma_sun, sigma_slope, sigma_track - the sunshape, mirror slope and
+        tracking errors. Slope and tracking errors turn the mirror normal, so
+        they deviate the reflected rays by twice their angle.
+
+    Returns:
+    an array, the standard deviation of each beam's flux profile.
+    """
+    angular = sigma_sun**2 + 4*sigma_slope**2 + 4*sigma_track**2
+    # A flat heliostat's beam is its projected area, taken as a uniform
+    # distribution and averaged over the two axes:
+    mirror = (width**2 + (height*cos_incidence)**2)/24.
+    return N.sqrt(distance**2*angular + mirror)
+
+def hflcal_flux(field, azimuth, elevation, receiver_frame, width, height,
+        bins, dni=1., reflectivity=1., atmosphere=True, shading=False,
+        per_heliostat=False, **kwds):
+    """
+    Model the flux of a heliostat field, as currently aimed, on a flat
+    rectangular receiver.
+
+    Each heliostat's beam leaves its center along the reflection of the sun
+    vector, and carries the direct normal irradiance on the heliostat's
+    projected area, less the reflection and atmospheric losses and,
+    optionally, shading and blocking.
+
+    Arguments:
+    field - a HeliostatField.
+    azimuth, elevation - the sun's position, as in solar_vector().
+    receiver_frame - the 4x4 global frame of the receiver, which is centered
+        on the frame's XY plane and faces its +Z direction.
+    width, height - the receiver's extent along its local x and y axes.
+    bins - the number of pixels along the receiver's x and y axes.
+    dni - the direct normal irradiance.
+    reflectivity - of the heliostats.
+    atmosphere - if True, the beams are attenuated as in
+        layout_optimizer.attenuation().
+    shading - if True, the power of each heliostat is reduced by its
+        shading and blocking factors (see shading_blocking).
+    per_heliostat - if True, return the flux image of each heliostat instead
+        of their sum.
+    kwds - the errors passed on to beam_sigmas().
+
+    Returns:
+    an (ny,nx) array of the flux at each receiver pixel's center, or an
+        (n,ny,nx) array of each heliostat's flux if per_heliostat is True.
+        Rows go along the receiver's local y axis.
+    """
+    sun_vec = solar_vector(azimuth, elevation)
+    frames = field.get_heliostat_frames()
+    centers = frames[:,:3,3]
+    normals = frames[:,:3,2]
+    cos_inc = N.dot(normals, sun_vec)
+    beams = 2*cos_inc[:,None]*normals - sun_vec
+
+    # Where each beam meets the receiver plane:
+    rec_normal = receiver_frame[:3,2]
+    rec_center = receiver_frame[:3,3]
+    cos_rec = -N.dot(beams, rec_normal)
+    dist = N.dot(rec_center - centers, rec_normal)/-cos_rec
+    hits = centers + dist[:,None]*beams
+
+    hstat_width, hstat_height = 2*field.get_heliostat_half_dims()
+    power = dni*reflectivity*hstat_width*hstat_height*cos_inc
+    if atmosphere:
+        power *= attenuation(dist)
+    if shading:
+        shaded, blocked = field_shading_blocking(field, azimuth, elevation)
+        power *= 1 - shaded - blocked
+    # Beams hitting the back of the receiver, or coming from behind the
+    # heliostat, bring nothing:
+    power[(cos_rec <= 0) | (cos_inc <= 0)] = 0.
+    sigmas = beam_sigmas(dist, cos_inc, hstat_width, hstat_height, **kwds)
+
+    # Global coordinates of the pixel centers:
+    nx, ny = bins
+    xs = (N.arange(nx) + 0.5)/nx*width - width/2.
+    ys = (N.arange(ny) + 0.5)/ny*height - height/2.
+    local = N.c_[N.tile(xs, ny), N.repeat(ys, nx)]
+    pixels = rec_center + N.dot(local, receiver_frame[:3,:2].T)
+
+    num_hstats = len(power)
+    if per_heliostat:
+        flux = N.empty((num_hstats, ny*nx))
+    else:
+        flux = N.zeros(ny*nx)
+    block = max(1, _BLOCK_ELEMENTS//(ny*nx))
+    for start in xrange(0, num_hstats, block):
+        sl = slice(start, start + block)
+        # Distance of each pixel from each beam's axis:
+        rel = pixels[None,:,:] - hits[sl,None,:]
+        along = N.sum(rel*beams[sl,None,:], axis=2)
+        perp2 = N.sum(rel**2, axis=2) - along**2
+        # The flux density normal to the beam, times the obliquity:
+        images = (power[sl]*cos_rec[sl]/(2*N.pi*sigmas[sl]**2))[:,None]* \
+            N.exp(-perp2/(2*sigmas[sl,None]**2))
+        if per_heliostat:
+            flux[sl] = images
+        else:
+            flux += images.sum(axis=0)
+
+    return flux.reshape(flux.shape[:-1] + (ny, nx))
+
+def compare_to_trace(field, assembly, receiver, width, height, bins,
+        azimuth, elevation, rays_per_heliostat, ang_range, reps=100,
+        min_energy=1e-9, prng=None, **kwds):
+    """
+    Compare the analytic flux of a field to a trace of it, on the same
+    receiver pixels. The field is traced as currently aimed, with a pillbox
+    sunshape, the ideal optics of the assembly and no atmosphere, so the
+    model is run likewise unless given otherwise in kwds.
+
+    Arguments:
+    field - the HeliostatField, and assembly - the plant's assembly holding
+        it and the receiver.
+    receiver - the receiver's Surface, centered on its local XY plane and
+        facing its +Z direction; its optics manager should have
+        get_all_hits(), like ReflectiveReceiver.
+    width, height, bins - of the receiver and its flux map.
+    azimuth, elevation - the sun's position, as in solar_vector().
+    rays_per_heliostat, ang_range - passed on to field_bundle().
+    reps, min_energy - passed on to TracerEngine.ray_tracer().
+    prng - a RandomStream or seed. The rays are drawn from prng.spawn(0),
+        and traced with prng.spawn(1).
+    kwds - more arguments of hflcal_flux(), e.g. reflectivity.
+
+    Returns:
+    model, traced - the (ny,nx) flux maps, per unit of direct normal
+        irradiance. The model is evaluated at the pixel centers and the trace
+        averaged over each pixel.
+    rms - the root mean square difference of the maps, relative to the
+        traced peak flux.
+    power_ratio - the ratio of the model's total power on the receiver to
+        the traced one.
+    """
+    model_kwds = {'sigma_sun': ang_range/2., 'sigma_slope': 0.,
+        'sigma_track': 0., 'atmosphere': False}
+    model_kwds.update(kwds)
+    model = hflcal_flux(field, azimuth, elevation,
+        receiver.get_global_transform(), width, height, bins, **model_kwds)
+
+    stream = as_stream(prng)
+    rays = field_bundle(field, rays_per_heliostat, azimuth, elevation, 1.,
+        ang_range, prng=stream.spawn(0))
+    optics = receiver.get_optics_manager()
+    optics.reset()
+    TracerEngine(assembly).ray_tracer(rays, reps, min_energy, tree=False,
+        prng=stream.spawn(1))
+    energy, hits = optics.get_all_hits()
+    optics.reset()
+    traced = bin_flux(energy, hits, receiver, width, height, bins)
+
+    rms = N.sqrt(N.mean((model - traced)**2))/traced.max()
+    return model, traced, rms, model.sum()/traced.sum()
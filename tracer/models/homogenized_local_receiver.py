@@ -9,11 +9,12 @@ from ..assembly import Assembly
 from ..object import AssembledObject
 
 from .one_sided_mirror import one_sided_receiver
-from .homogenizer import rect_homogenizer
+from .homogenizer import rect_homogenizer, light_pipe as pipe_object
+from .error_convolution import gaussian_pdf, project_kernel, convolve_sweep
 
 class HomogenizedLocalReceiver(Assembly):
     def __init__(self, main_reflector, receiver_pos, receiver_dims, \
-        homogenizer_depth, homog_opt_eff):
+        homogenizer_depth, homog_opt_eff, light_pipe=False):
         """
         Arguments:
         main_reflector - a Surface object representing the reflector that
@@ -26,6 +27,10 @@ class HomogenizedLocalReceiver(Assembly):
         homogenizer_depth - the homogenizer has base dimensions to fit the PV
             square, and this height.
         homog_opt_eff - the optical efficiency of each mirror in the homogenizer
+        light_pipe - if True, the homogenizer is a light pipe object, whose
+            reflections are all calculated when rays enter it, instead of an
+            assembly of mirrors needing a trace iteration per reflection. See
+            homogenizer.light_pipe().
         """
         if type(receiver_dims) is type(tuple()):
             self._sides = receiver_dims
@@ -37,20 +42,28 @@ class HomogenizedLocalReceiver(Assembly):
         receiver_frame = N.dot(sp.translate(0, 0, receiver_pos), sp.rotx(N.pi))
         rec_obj.set_transform(receiver_frame)
         
-        self._hom = rect_homogenizer(self._sides[0], self._sides[1], \
+        if light_pipe:
+            make_homogenizer = pipe_object
+        else:
+            make_homogenizer = rect_homogenizer
+        self._hom = make_homogenizer(self._sides[0], self._sides[1], \
             homogenizer_depth, homog_opt_eff)
         self._hom.set_transform(receiver_frame)
         
         self._mr = main_reflector
         refl = AssembledObject(surfs=[main_reflector])
-        Assembly.__init__(self, objects=[rec_obj, refl], subassemblies=[self._hom])
+        if light_pipe:
+            Assembly.__init__(self, objects=[rec_obj, refl, self._hom])
+        else:
+            Assembly.__init__(self, objects=[rec_obj, refl], \
+                subassemblies=[self._hom])
     
     def get_receiver_surf(self):
         """for anyone wishing to directly access the receiver"""
         return self._rec
     
     def get_homogenizer(self):
-        """Direct access to the homogenizer subassembly"""
+        """Direct access to the homogenizer subassembly or light pipe object"""
         return self._hom
     
     def get_main_reflector(self):
@@ -81,3 +94,30 @@ class HomogenizedLocalReceiver(Assembly):
         H, xbins, ybins = N.histogram2d(x, y, bins, \
             range=([-rngx,rngx], [-rngy,rngy]), weights=energy)
         return H, xbins, ybins
+    
+    def histogram_with_errors(self, slope_errors, bins=50, truncate=4.):
+        """
+        Adds the slope errors of the main reflector to the histogram of an
+        ideal-optics trace, by convolving it with the spread of the reflected
+        rays projected through the receiver distance. The energy spread past
+        the receiver's edges is folded back, as the homogenizer walls would,
+        without their losses. Each error value reuses the same trace.
+        
+        Arguments:
+        slope_errors - a list of standard deviations of the reflector's
+            Gaussian slope error, in radians.
+        bins - hom many bins per axis to use (default 50)
+        truncate - the error kernels cover this many standard deviations of
+            the reflected rays' spread.
+        
+        Returns:
+        Hs - a list with the histogram for each slope error, each as H from
+            histogram_hits()
+        xbins, ybins - the edges of the bins, as in histogram_hits()
+        """
+        H, xbins, ybins = self.histogram_hits(bins)
+        pixel = (xbins[1] - xbins[0], ybins[1] - ybins[0])
+        # Reflection doubles the angular error:
+        kernels = [project_kernel(gaussian_pdf(2*sigma), truncate*2*sigma, \
+            self._rec_pos, pixel) for sigma in slope_errors]
+        return convolve_sweep(H, kernels, 'reflect'), xbins, ybins
@@ -1,10 +1,15 @@
-# Model a simple specular-reflective homogenizer using one-sided mirror.
+# Model a simple specular-reflective homogenizer using one-sided mirror, or
+# as a light pipe whose wall reflections are calculated all at once.
 
 import numpy as N
+import types
 
 from ..assembly import Assembly
 from ..object import AssembledObject
-from .one_sided_mirror import rect_one_sided_mirror
+from ..surface import Surface
+from ..flat_surface import RectPlateGM
+from .one_sided_mirror import rect_one_sided_mirror, \
+    surfaces_for_next_iteration
 
 from .. import spatial_geometry as sp
 
@@ -41,3 +46,167 @@ def rect_homogenizer(aperture_xdim, aperture_ydim, height, opt_eff):
         N.dot(sp.translate(0, -aperture_ydim/2., height/2.), sp.rotx(-N.pi/2.)))
     
     return Assembly(objects=[wall_xp, wall_xn, wall_yp, wall_yn])
+
+def _fold(coord, side):
+    """
+    Fold coordinates of the unfolded (kaleidoscope) images of a pipe of width
+    `side`, centered on 0, back into the pipe.
+    
+    Returns:
+    folded - the coordinates inside the pipe.
+    cell - the index of the image each coordinate was in; its absolute value
+        is the number of walls crossed, and odd images are mirrored.
+    """
+    cell = N.floor((coord + side/2.)/side).astype(N.int_)
+    offset = coord + side/2. - cell*side
+    mirrored = cell % 2 == 1
+    return N.where(mirrored, side/2. - offset, offset - side/2.), cell
+
+def unfold_pipe(vertices, directions, aperture_xdim, aperture_ydim):
+    """
+    Follow rays through a rectangular light pipe with specular walls, from
+    anywhere inside it to its exit on the local z=0 plane. Instead of
+    reflecting a ray off each wall it meets, the pipe is mirrored about its
+    walls and the ray goes straight through the images, so any number of
+    reflections costs the same.
+    
+    Arguments:
+    vertices - a 3 by n array, the local coordinates of each ray's starting
+        point inside the pipe, at z > 0.
+    directions - a 3 by n array, the local direction of each ray, going
+        toward the exit (negative z component).
+    aperture_xdim, aperture_ydim - the pipe's extents along the local x and
+        y axes. The walls are at +-xdim/2 and +-ydim/2.
+    
+    Returns:
+    exits - a 3 by n array, where each ray leaves the pipe.
+    exit_dirs - a 3 by n array, each ray's direction as it leaves.
+    bounces - the number of wall reflections of each ray.
+    last - a 3 by n array, the point of each ray's last reflection, or its
+        starting point if it was not reflected.
+    """
+    dist = vertices[2]/-directions[2]
+    unfolded = vertices + dist*directions
+    exits = unfolded.copy()
+    exit_dirs = directions.copy()
+    bounces = N.zeros(vertices.shape[1], dtype=N.int_)
+    last_dist = N.zeros(vertices.shape[1])
+    
+    for axis, side in ((0, aperture_xdim), (1, aperture_ydim)):
+        exits[axis], cell = _fold(unfolded[axis], side)
+        exit_dirs[axis] = N.where(cell % 2 == 1, -1, 1)*directions[axis]
+        bounces += abs(cell)
+        
+        # The last wall crossed is the one bounding the exit's image:
+        crossed = cell != 0
+        wall = cell[crossed]*side - N.sign(cell[crossed])*side/2.
+        last_dist[crossed] = N.maximum(last_dist[crossed],
+            (wall - vertices[axis, crossed])/directions[axis, crossed])
+    
+    last = vertices + last_dist*directions
+    last[0] = _fold(last[0], aperture_xdim)[0]
+    last[1] = _fold(last[1], aperture_ydim)[0]
+    return exits, exit_dirs, bounces, last
+
+class LightPipeOptics(object):
+    """
+    The optics of a rectangular light pipe's entrance aperture. Each ray
+    entering it is taken through all of its reflections off the pipe walls
+    at once (see unfold_pipe()), and leaves from the point of its last
+    reflection toward the exit, with the energy left after the walls'
+    absorption. Rays crossing the aperture from inside the pipe go on
+    unchanged.
+    
+    The energy absorbed by the walls from each entering ray, and its number
+    of reflections, are kept until reset().
+    """
+    def __init__(self, aperture_xdim, aperture_ydim, height, opt_eff):
+        """
+        Arguments:
+        aperture_xdim, aperture_ydim - the pipe's extents along the local x
+            and y axes of the aperture.
+        height - the distance from the aperture to the pipe's exit, along the
+            aperture's local -z direction.
+        opt_eff - the optical efficiency of each wall reflection.
+        """
+        self._dims = (aperture_xdim, aperture_ydim)
+        self._height = height
+        self._eff = opt_eff
+        self.reset()
+    
+    def reset(self):
+        """Clear the memory of absorbed energy (best done before a new trace)."""
+        self._absorbed = []
+        self._bounces = []
+    
+    def __call__(self, hits):
+        frame = hits.get_geometry().get_working_frame()
+        rot = frame[:3,:3]
+        origin = frame[:3,3][:,None]
+        
+        vertices = hits.get_intersection_points().copy()
+        directions = hits.get_directions().copy()
+        energy = hits.get_energy().copy()
+        
+        local_dirs = N.dot(rot.T, directions)
+        entering = local_dirs[2] < 0
+        if entering.any():
+            # Local coordinates of the pipe, whose exit is at z=0:
+            local = N.dot(rot.T, vertices[:,entering] - origin)
+            local[2] = self._height
+            exits, exit_dirs, bounces, last = unfold_pipe(local,
+                local_dirs[:,entering], *self._dims)
+            last[2] -= self._height
+            
+            vertices[:,entering] = N.dot(rot, last) + origin
+            directions[:,entering] = N.dot(rot, exit_dirs)
+            passed = energy[entering]*self._eff**bounces
+            self._absorbed.append(energy[entering] - passed)
+            self._bounces.append(bounces)
+            energy[entering] = passed
+        
+        selector = hits.get_selector()
+        return hits.get_rays().inherit(selector, vertices=vertices,
+            direction=directions, energy=energy, parents=selector)
+    
+    def get_absorbed(self):
+        """
+        Aggregate the wall losses of all rays entering the pipe, in all
+        stages of tracing.
+        
+        Returns:
+        absorbed - the energy absorbed by the walls from each entering ray.
+        bounces - the number of wall reflections of each entering ray.
+        """
+        if not len(self._absorbed):
+            return N.array([]), N.array([], dtype=N.int_)
+        return N.hstack(self._absorbed), N.hstack(self._bounces)
+
+def light_pipe(aperture_xdim, aperture_ydim, height, opt_eff):
+    """
+    Generate an object representing a rectangular homogenizer, placed like
+    the one from rect_homogenizer(), but whose wall reflections are
+    calculated for all rays at once, instead of one reflection per trace
+    iteration (see LightPipeOptics). Its only surface is the entrance
+    aperture at z=height, whose optics manager holds the wall losses. Unlike
+    the homogenizer's walls, the light pipe does not block rays passing
+    outside it, and rays going back up the pipe (e.g. reflected by a
+    receiver at its exit) are not reflected by the walls.
+    
+    Arguments:
+    aperure_xdim - the length of the aperture along the local x axis
+    aperure_ydim - the length of the aperture along the local y axis
+    height - the pipe extends from z=0 (its exit) to z=height (its entrance)
+    opt_eff - the optical efficiency of each mirror (the complement of its 
+        absorption)
+    
+    Returns:
+    An AssembledObject instance, with the aperture surface.
+    """
+    aperture = Surface(RectPlateGM(aperture_xdim, aperture_ydim),
+        LightPipeOptics(aperture_xdim, aperture_ydim, height, opt_eff),
+        location=N.r_[0., 0., height])
+    obj = AssembledObject(surfs=[aperture])
+    obj.surfaces_for_next_iteration = types.MethodType(
+        surfaces_for_next_iteration, obj, obj.__class__)
+    return obj
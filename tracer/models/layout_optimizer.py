@@ -0,0 +1,354 @@
+"""
+Optimize the layout of a heliostat field, searching the parameters of a
+radial-stagger layout with a cheap surrogate of the field's performance, and
+checking the best candidates with full traces from time to time.
+
+The surrogate efficiency of each heliostat is the product of its cosine
+efficiency, atmospheric attenuation, the unshaded and unblocked fraction of
+its area (see shading_blocking), and the fraction of a Gaussian image that
+hits a round receiver, averaged over weighted sun positions. All of these
+are vectorized over the heliostats, so a layout is evaluated in about the
+time of a single small trace.
+
+Example::
+
+    layout = stagger_family(-N.pi/2, N.pi/2, 100., 800.)
+    surrogate = LayoutSurrogate(10., 10., 4., 150., 6., sun_positions)
+    check = tower_check(10., 10., 0.1, 4., 150., make_plant, sun_positions,
+        None, 50, 0.00465)
+    params, checked = optimize_layout(layout, N.r_[12., 12., 0.02],
+        N.r_[2., 2., 0.01], surrogate, 2000, check)
+"""
+
+import numpy as N
+
+from ..random_streams import as_stream
+from ..parallel import map_forked
+from .heliostat_field import HeliostatField, solar_vector, aim_normals, \
+    heliostat_transforms
+from .shading_blocking import shading_blocking
+from .annual_efficiency import field_evaluator
+
+def graded_stagger(start_ang, end_ang, az_dist, rmin, row_spaces):
+    """
+    Calculate positions of heliostats in a radial-stagger field whose rows
+    are spaced unevenly, and whose heliostats are spaced by a fixed distance
+    along each row, unlike radial_stagger() where the angle between them is
+    fixed.
+
+    Arguments:
+    start_ang, end_ang - the angle in radians CW from the X axis that define
+        the field's boundaries.
+    az_dist - the distance along a row between two heliostats of the row.
+    rmin - the radius of the first row.
+    row_spaces - the radial distance from each row to the next.
+
+    Returns:
+    An array with an x,y row for each heliostat (shape n,2)
+    """
+    radii = rmin + N.r_[0., N.cumsum(row_spaces)]
+    xs = []
+    ys = []
+    for row, r in enumerate(radii):
+        az_space = az_dist/r
+        # Every other row is staggered by half a space:
+        angs = N.arange(start_ang + (row % 2)*az_space/2., end_ang, az_space)
+        xs.append(r*N.cos(angs))
+        ys.append(r*N.sin(angs))
+
+    return N.vstack((N.hstack(xs), N.hstack(ys))).T
+
+def stagger_family(start_ang, end_ang, rmin, rmax):
+    """
+    Make a layout function of three parameters for optimize_layout():
+    (az_dist, r_space, growth), where the space between rows k and k+1 is
+    r_space*(1 + growth)**k. See graded_stagger() for the other arguments.
+    Rows are added up to the radius rmax.
+    """
+    def layout(params):
+        az_dist, r_space, growth = params
+        if az_dist <= 0 or r_space <= 0 or growth <= -1:
+            raise ValueError("Spaces between heliostats must be positive.")
+        spaces = []
+        r = rmin
+        while r + r_space*(1 + growth)**len(spaces) <= rmax:
+            spaces.append(r_space*(1 + growth)**len(spaces))
+            r += spaces[-1]
+        return graded_stagger(start_ang, end_ang, az_dist, rmin, spaces)
+
+    return layout
+
+def attenuation(distance):
+    """
+    The fraction of reflected energy that is not lost to the atmosphere on
+    its way to the receiver, for a clear day, using the polynomial of
+    Vittitoe and Biggs for distances up to 1 km and its exponential
+    extension beyond.
+
+    Arguments:
+    distance - an array of slant distances from heliostats to the receiver,
+        in meters.
+    """
+    return N.where(distance <= 1000.,
+        0.99321 - 1.176e-4*distance + 1.97e-8*distance**2,
+        N.exp(-1.106e-4*distance))
+
+def gaussian_intercept(distance, receiver_radius, sigma):
+    """
+    The fraction of a round Gaussian image that hits a round receiver
+    centered on it.
+
+    Arguments:
+    distance - an array of slant distances from heliostats to the receiver.
+    receiver_radius - the radius of the receiver.
+    sigma - the standard deviation of the reflected rays' angle, combining
+        the sunshape and the optical errors.
+    """
+    return 1 - N.exp(-receiver_radius**2/(2*(sigma*distance)**2))
+
+class LayoutSurrogate(object):
+    """
+    Cheap estimates of the annual optical efficiency of heliostats at any
+    positions.
+    """
+    def __init__(self, width, height, mount_height, aim_height,
+            receiver_radius, sun_positions, weights=None, sigma=None,
+            samples=3):
+        """
+        Arguments:
+        width, height - of each heliostat.
+        mount_height - the height of the heliostats' centers.
+        aim_height - the height of the tower's target.
+        receiver_radius - the radius of a round receiver at the target.
+        sun_positions - an (m,2) array, with the azimuth and elevation of the
+            sun (see solar_vector()) in each row.
+        weights - the weight of each sun position, e.g. the annual direct
+            normal energy it represents. By default all weigh the same.
+        sigma - the standard deviation of the reflected rays' angle. By
+            default, that of a 4.65 mrad pillbox sun and 2 mrad slope errors.
+        samples - as in shading_blocking(); small values are usually enough.
+        """
+        self._half_dims = N.r_[width, height]/2.
+        self._mount = mount_height
+        self._aim = aim_height
+        self._rec_radius = receiver_radius
+        self._suns = N.atleast_2d(sun_positions)
+        if weights is None:
+            weights = N.ones(len(self._suns))
+        self._weights = N.asarray(weights, dtype=N.float_)/N.sum(weights)
+        if sigma is None:
+            sigma = N.sqrt(0.00465**2/4. + (2*0.002)**2)
+        self._sigma = sigma
+        self._samples = samples
+
+    def get_mount_height(self):
+        return self._mount
+
+    def efficiency(self, xy):
+        """
+        Estimate the annual optical efficiency of each heliostat.
+
+        Arguments:
+        xy - an (n,2) array of heliostat ground positions.
+
+        Returns:
+        an array with the weighted mean efficiency of each heliostat over the
+            sun positions.
+        """
+        positions = N.c_[xy, N.tile(self._mount, len(xy))]
+        tower_vec = -positions
+        tower_vec[:,2] += self._aim
+        distance = N.sqrt(N.sum(tower_vec**2, axis=1))
+        fixed = attenuation(distance)* \
+            gaussian_intercept(distance, self._rec_radius, self._sigma)
+
+        effs = N.zeros(len(xy))
+        for (azimuth, elevation), weight in zip(self._suns, self._weights):
+            if elevation >= N.pi/2:
+                continue
+            sun_vec = solar_vector(azimuth, elevation)
+            normals = aim_normals(positions, self._aim, sun_vec)
+            frames = heliostat_transforms(positions, normals)
+            shaded, blocked = shading_blocking(frames, self._half_dims,
+                sun_vec, self._samples)
+            effs += weight*N.dot(normals, sun_vec)*(1 - shaded - blocked)
+        return effs*fixed
+
+    def select(self, xy, num_heliostats):
+        """
+        Choose the heliostats with the highest surrogate efficiency.
+
+        Arguments:
+        xy - an (n,2) array of heliostat ground positions.
+        num_heliostats - the number of heliostats to keep.
+
+        Returns:
+        positions - the positions of the chosen heliostats.
+        score - the sum of their efficiencies.
+        """
+        effs = self.efficiency(xy)
+        best = N.argsort(-effs)[:num_heliostats]
+        return xy[best], effs[best].sum()
+
+def tower_check(width, height, absorpt, mount_height, aim_height, make_plant,
+        sun_positions, weights, rays_per_heliostat, ang_range, **kwds):
+    """
+    Make a function that traces a layout, for optimize_layout().
+
+    Arguments:
+    width, height, absorpt, aim_height - of the HeliostatField.
+    mount_height - the height of the heliostats' centers.
+    make_plant - a function of the HeliostatField returning the plant's
+        assembly, holding the field and a receiver, and the receiver's
+        optics manager.
+    sun_positions, weights - as in LayoutSurrogate.
+    rays_per_heliostat, ang_range, kwds - passed on to field_evaluator().
+
+    Returns:
+    a function of (xy, prng) returning the sum over the heliostats of their
+        traced efficiency, the same measure as LayoutSurrogate.select()'s
+        score.
+    """
+    suns = N.atleast_2d(sun_positions)
+    if weights is None:
+        weights = N.ones(len(suns))
+    weights = N.asarray(weights, dtype=N.float_)/N.sum(weights)
+
+    def check(xy, prng):
+        positions = N.c_[xy, N.tile(mount_height, len(xy))]
+        field = HeliostatField(positions, width, height, absorpt, aim_height,
+            grid=True)
+        assembly, receiver = make_plant(field)
+        evaluate = field_evaluator(field, assembly, receiver,
+            rays_per_heliostat, ang_range, **kwds)
+
+        total = 0.
+        for sun_idx, ((azimuth, elevation), weight) in \
+                enumerate(zip(suns, weights)):
+            if elevation >= N.pi/2:
+                continue
+            total += weight*evaluate(azimuth, elevation,
+                prng.spawn(sun_idx))
+        return total*len(xy)
+
+    return check
+
+def optimize_layout(layout, start, steps, surrogate, num_heliostats,
+        check=None, check_every=10, num_checks=4, max_iter=100,
+        min_step=0.01, bounds=None, prng=None, processes=None):
+    """
+    Search layout parameters by a compass search on the surrogate score,
+    and check the best candidates with full traces, in parallel.
+
+    At each iteration every parameter is moved by its step in both
+    directions, and the best improving move is taken; if none improves, the
+    steps are halved. Every ``check_every`` iterations, and at the end, the
+    best candidates not checked yet are traced with ``check``, each in a
+    worker process.
+
+    Arguments:
+    layout - a function of a parameters array returning an (n,2) array of
+        heliostat ground positions, e.g. from stagger_family().
+    start - the initial parameters array.
+    steps - the initial step of each parameter.
+    surrogate - a LayoutSurrogate.
+    num_heliostats - the number of heliostats in the field. Each candidate
+        layout keeps the heliostats of highest surrogate efficiency.
+    check - a function of (xy, prng) returning the traced score of the
+        chosen heliostat positions, e.g. from tower_check(). If None, only
+        the surrogate is used.
+    check_every - the number of iterations between checks.
+    num_checks - the number of candidates traced at each check.
+    max_iter - the largest number of iterations.
+    min_step - stop when all steps are below this part of their initial
+        size.
+    bounds - optionally, a tuple of arrays (lower, upper) bounding the
+        parameters. Moves out of the bounds are not tried. Moves for which
+        ``layout`` raises a ValueError are never taken, bounds or not. If
+        it rejects every candidate tried, a ValueError is raised.
+    prng - a RandomStream or seed. The k-th checked candidate is traced with
+        prng.spawn(k).
+    processes - number of worker processes for the checks. None means one
+        per CPU; 1 traces in this process.
+
+    Returns:
+    params - the parameters of the best checked candidate, by the traced
+        score, or of the best surrogate score if there is no check.
+    checked - a list with a tuple (params, surrogate score, traced score) for
+        each checked candidate, in the order checked.
+    """
+    stream = as_stream(prng)
+    steps = N.array(steps, dtype=N.float_)
+    init_steps = steps.copy()
+
+    scores = {} # surrogate scores of the candidates, by parameters tuple.
+    def score(params):
+        key = tuple(params)
+        if key not in scores:
+            try:
+                scores[key] = surrogate.select(layout(params),
+                    num_heliostats)[1]
+            except ValueError:
+                # Parameters the layout rejects, e.g. non-positive spaces:
+                scores[key] = -N.inf
+        return scores[key]
+
+    current = N.array(start, dtype=N.float_)
+    checked = []
+    for iteration in xrange(max_iter):
+        moves = [current + sign*step for step in N.diag(steps)
+            for sign in (1, -1)]
+        if bounds is not None:
+            moves = [params for params in moves \
+                if N.all(params >= bounds[0]) and N.all(params <= bounds[1])]
+        move_scores = [score(params) for params in moves]
+        if len(moves) > 0 and max(move_scores) > score(current):
+            current = moves[N.argmax(move_scores)]
+        else:
+            steps /= 2.
+            if N.all(steps < min_step*init_steps):
+                break
+
+        if check is not None and (iteration + 1) % check_every == 0:
+            checked.extend(_check_candidates(layout, surrogate, num_heliostats,
+                check, scores, checked, num_checks, stream, processes))
+
+    score(current)
+    if not N.isfinite(max(scores.values())):
+        raise ValueError("The layout function rejected every candidate")
+    if check is None:
+        return N.array(max(scores, key=scores.get)), checked
+
+    checked.extend(_check_candidates(layout, surrogate, num_heliostats, check,
+        scores, checked, num_checks, stream, processes))
+    best = max(checked, key=lambda cand: cand[2])
+    return N.array(best[0]), checked
+
+def _check_candidates(layout, surrogate, num_heliostats, check, scores,
+        checked, num_checks, stream, processes):
+    """
+    Trace the candidates of highest surrogate score that were not checked
+    yet.
+
+    Returns:
+    a list with a tuple (params, surrogate score, traced score) for each
+        newly checked candidate.
+    """
+    done = set(cand[0] for cand in checked)
+    candidates = [key for key in sorted(scores, key=scores.get, reverse=True)
+        if key not in done and N.isfinite(scores[key])][:num_checks]
+    if len(candidates) == 0:
+        return []
+
+    layouts = [surrogate.select(layout(N.array(key)), num_heliostats)[0] \
+        for key in candidates]
+    traced = map_forked(_check_one, (layouts, check, stream, len(checked)),
+        xrange(len(candidates)), processes)
+
+    return [(key, scores[key], traced_score) \
+        for key, traced_score in zip(candidates, traced)]
+
+def _check_one(job, cand_idx):
+    """Trace one candidate of a check."""
+    layouts, check, stream, first_idx = job
+    return check(layouts[cand_idx], stream.spawn(first_idx + cand_idx))
@@ -6,7 +6,6 @@ from ..surface import Surface
 from ..flat_surface import RectPlateGM
 from .. import optics_callables as opt
 
-from numpy import r_
 import numpy as N
 import types
 
@@ -27,19 +26,24 @@ def surfaces_for_next_iteration(self, rays, surface_id):
     """
     return N.zeros((len(self.surfaces), rays.get_num_rays()), dtype=N.bool)
 
-def rect_one_sided_mirror(width, height, absorptivity=0.):
+def rect_one_sided_mirror(width, height, absorptivity=0., contributor=None):
     """
-    construct an object with two surfaces: one on the XY plane, that is
-    specularly reflective, and one slightly below (negative z), that is opaque.
+    construct an object with one surface on the XY plane, that is specularly
+    reflective on its front (positive z) side and opaque on its back side.
     
     Arguments:
     width - the extent along the x axis in the local frame.
     height - the extent along the y axis in the local frame.
     absorptivity - the ratio of energy incident on the reflective side that's
         not reflected back.
+    contributor - optionally, an integer with which the reflected rays are
+        tagged, see optics_callables.ContributorTagger.
     """
-    surf = Surface(RectPlateGM(width, height), 
-        opt.AbsorberReflector(absorptivity))
+    optics = opt.Reflective(absorptivity)
+    if contributor is not None:
+        optics = opt.ContributorTagger(optics, contributor)
+    surf = Surface(RectPlateGM(width, height), optics,
+        back_optics=opt.Reflective(1.))
     obj = AssembledObject(surfs=[surf])
     obj.surfaces_for_next_iteration = types.MethodType(
         surfaces_for_next_iteration, obj, obj.__class__)
@@ -47,11 +51,11 @@ def rect_one_sided_mirror(width, height, absorptivity=0.):
 
 def one_sided_receiver(width, height, absorptivity=1.):
     """
-    construct an object with two surfaces: one on the XY plane, that is
-    specularly reflective, and one slightly below (negative z), that is opaque.
-    The reflective surface is by default also apaque; it is a ReflectiveReceiver
-    object, so all hits can be obtained after a trace using that surface's 
-    get_all_hits() method.
+    construct an object with one surface on the XY plane, that is specularly
+    reflective on its front (positive z) side and opaque on its back side.
+    The front side is by default also apaque; it is a ReflectiveReceiver
+    object, so all hits on the front can be obtained after a trace using that
+    surface's get_all_hits() method.
     
     Arguments:
     width - the extent along the x axis in the local frame.
@@ -61,13 +65,11 @@ def one_sided_receiver(width, height, absorptivity=1.):
     
     Returns:
     front - the receiving surface
-    obj - the AssembledObject containing both surfaces
+    obj - the AssembledObject containing the surface
     """
     front = Surface(RectPlateGM(width, height), 
-        opt.ReflectiveReceiver(absorptivity))
-    back = Surface(RectPlateGM(width, height), opt.Reflective(1.),
-        location=r_[0., 0., -1e-10])
-    obj = AssembledObject(surfs=[front, back])
+        opt.ReflectiveReceiver(absorptivity), back_optics=opt.Reflective(1.))
+    obj = AssembledObject(surfs=[front])
     obj.surfaces_for_next_iteration = types.MethodType(
         surfaces_for_next_iteration, obj, obj.__class__)
     return front, obj
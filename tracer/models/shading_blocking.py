@@ -0,0 +1,252 @@
+"""
+Shading and blocking factors of the heliostats of a field, without a full
+Monte Carlo trace.
+
+A heliostat is shaded where a neighbour stands between it and the sun, and
+blocked where a neighbour stands in the way of its reflection to the tower.
+Both are found by casting rays from a fixed grid of sample points on each
+heliostat, toward the sun and along the reflected direction. Each ray is
+tested only against the neighbours that may intersect it, found by binning
+the heliostat positions on a uniform grid over the ground, so the work grows
+with the number of heliostats times the number of close neighbours.
+
+All heliostats are flat rectangles, so the reflected direction is the same
+for all sample points of one heliostat.
+"""
+
+import numpy as N
+
+from .heliostat_field import solar_vector, aim_normals, heliostat_transforms
+
+# Intersections closer than this to a sample point are ignored.
+_MIN_PARAM = 1e-9
+
+# Approximate number of values in the temporary arrays of the sample tests.
+_BLOCK_ELEMENTS = 2**20
+
+def shading_blocking(frames, half_dims, sun_vec, samples=5):
+    """
+    Calculate the fraction of each heliostat's area that is shaded, and the
+    fraction that is not shaded but blocked.
+
+    Arguments:
+    frames - an (n,4,4) array, the global frame of each heliostat, with the
+        mirror on the frame's XY plane and its normal along the frame's Z.
+    half_dims - half the width and height of the heliostats, as a 2-array,
+        or an (n,2) array of per-heliostat sizes.
+    sun_vec - a unit 3-array pointing at the sun, see solar_vector().
+    samples - the sample points on each heliostat are a grid of
+        samples by samples points at the centers of equal cells.
+
+    Returns:
+    shaded - an array with the shaded fraction of each heliostat's area.
+    blocked - an array with the fraction of each heliostat's area which is
+        not shaded, but whose reflection is blocked.
+    """
+    num_hstats = frames.shape[0]
+    half_dims = N.tile(half_dims, (num_hstats, 1)) if N.ndim(half_dims) == 1 \
+        else N.asarray(half_dims)
+
+    # Sample points, as an (n, samples**2, 3) array:
+    cells = ((N.arange(samples) + 0.5)/samples)*2 - 1
+    xs, ys = N.broadcast_arrays(cells[:,None], cells[None,:])
+    along_x = xs.flatten()[None,:]*half_dims[:,0,None]
+    along_y = ys.flatten()[None,:]*half_dims[:,1,None]
+    points = frames[:,None,:3,3] + along_x[...,None]*frames[:,None,:3,0] + \
+        along_y[...,None]*frames[:,None,:3,1]
+
+    normals = frames[:,:3,2]
+    to_sun = N.tile(sun_vec, (num_hstats, 1))
+    reflected = 2*N.dot(normals, sun_vec)[:,None]*normals - sun_vec
+
+    radii = N.sqrt(N.sum(half_dims**2, axis=1))
+    index = NeighbourGrid(frames[:,:2,3], 2*radii.max())
+
+    shaded = _obstructed(index, frames, half_dims, radii, points, to_sun)
+    blocked = _obstructed(index, frames, half_dims, radii, points, reflected)
+    return shaded.mean(axis=1), (blocked & ~shaded).mean(axis=1)
+
+def field_shading_blocking(field, azimuth, elevation, samples=5):
+    """
+    Shading and blocking of the heliostats of a HeliostatField when aimed at
+    a given sun position. The field itself is not moved.
+
+    Arguments:
+    field - a HeliostatField instance.
+    azimuth, elevation - the sun's position, as in solar_vector().
+    samples - see shading_blocking().
+
+    Returns:
+    shaded, blocked - as in shading_blocking(), indexed like the field's
+        positions (and get_heliostats() of a field that is not instanced).
+    """
+    sun_vec = solar_vector(azimuth, elevation)
+    positions = field.get_positions()
+    transforms = heliostat_transforms(positions,
+        aim_normals(positions, field.get_aim_height(), sun_vec))
+    return shading_blocking(field.heliostat_frames(transforms),
+        field.get_heliostat_half_dims(), sun_vec, samples)
+
+class NeighbourGrid(object):
+    """
+    A uniform grid over 2D positions, holding the indices of the positions
+    in each cell, for finding the positions near many query points at once.
+    """
+    def __init__(self, xy, cell_size):
+        """
+        Arguments:
+        xy - an (n,2) array of positions.
+        cell_size - the side of a grid cell.
+        """
+        self._cell_size = float(cell_size)
+        self._min = xy.min(axis=0)
+        self._shape = N.floor((xy.max(axis=0) - self._min)/cell_size).astype(
+            N.int_) + 1
+        self._cells = self.cell_of(xy)
+
+        cell_ids = self._cells[:,0]*self._shape[1] + self._cells[:,1]
+        self._items = N.argsort(cell_ids, kind='mergesort')
+        self._start = N.r_[0, N.cumsum(N.bincount(cell_ids,
+            minlength=N.prod(self._shape)))]
+
+    def cell_of(self, xy):
+        """The (unclipped) grid cell indices of an (n,2) array of points."""
+        return N.floor((xy - self._min)/self._cell_size).astype(N.int_)
+
+    def get_cell_size(self):
+        return self._cell_size
+
+    def pairs_at_offset(self, offset, items=None):
+        """
+        Pair indexed positions with the positions in the cell at a given
+        offset from their own cell.
+
+        Arguments:
+        offset - a 2-array of integers, the offset in cells.
+        items - optionally, the indices of the positions to pair, by default
+            all of them.
+
+        Returns:
+        first, second - integer arrays of the same length, such that
+            positions second[k] are in the cell at ``offset`` from the cell of
+            positions first[k].
+        """
+        if items is None:
+            items = N.arange(self._cells.shape[0])
+        cells = self._cells[items] + offset
+        inside = N.all((cells >= 0) & (cells < self._shape), axis=1)
+        valid = items[inside]
+        cells = cells[inside]
+        cell_ids = cells[:,0]*self._shape[1] + cells[:,1]
+        starts = self._start[cell_ids]
+        counts = self._start[cell_ids + 1] - starts
+
+        first = N.repeat(valid, counts)
+        second = self._items[N.repeat(starts - N.cumsum(counts) + counts,
+            counts) + N.arange(counts.sum())]
+        return first, second
+
+def _obstructed(index, frames, half_dims, radii, points, directions):
+    """
+    Find the sample points whose rays along their heliostat's direction hit
+    another heliostat.
+
+    Arguments:
+    index - a NeighbourGrid of the heliostat positions.
+    frames, half_dims - as in shading_blocking(), with half_dims per
+        heliostat.
+    radii - the half-diagonal of each heliostat.
+    points - an (n,s,3) array of sample points on each heliostat.
+    directions - an (n,3) array, the direction of the rays of each heliostat.
+
+    Returns:
+    an (n,s) boolean array, True for the obstructed sample points.
+    """
+    first, second = _candidate_pairs(index, frames[:,:3,3], radii, directions)
+    obstructed = N.zeros(points.shape[:2], dtype=N.bool)
+    if len(first) == 0:
+        return obstructed
+
+    block = max(1, _BLOCK_ELEMENTS//points.shape[1])
+    oldsettings = N.seterr(divide='ignore', invalid='ignore')
+    for start in xrange(0, len(first), block):
+        i = first[start:start + block]
+        j = second[start:start + block]
+        f = frames[j]
+        d = directions[i][:,None,:]
+        rel = points[i] - f[:,None,:3,3]
+
+        dt = N.sum(d*f[:,None,:3,2], axis=2)
+        prm = -N.sum(rel*f[:,None,:3,2], axis=2)/dt
+        hit = (abs(dt) > 1e-10) & (prm > _MIN_PARAM)
+        on_plane = rel + prm[...,None]*d
+        for axis in xrange(2):
+            hit &= abs(N.sum(on_plane*f[:,None,:3,axis], axis=2)) <= \
+                half_dims[j,axis][:,None]
+
+        pair, sample = N.nonzero(hit)
+        obstructed[i[pair], sample] = True
+    N.seterr(**oldsettings)
+    return obstructed
+
+def _candidate_pairs(index, centers, radii, directions):
+    """
+    Find the pairs of heliostats (i, j) such that a ray leaving heliostat i
+    along its direction may hit heliostat j: j's center is within the sum
+    of the two radii of the line through i's center along the direction,
+    and not behind it. Only the cells within horizontal reach of each ray
+    are searched, the reach being where the ray leaves the height range of
+    the heliostats.
+
+    Returns:
+    first, second - integer arrays, the indices of i and j of each pair.
+    """
+    z_low = (centers[:,2] - radii).min()
+    z_high = (centers[:,2] + radii).max()
+    horiz = N.sqrt(N.sum(directions[:,:2]**2, axis=1))
+
+    oldsettings = N.seterr(divide='ignore', invalid='ignore')
+    rise = N.where(directions[:,2] > 0, z_high - (centers[:,2] - radii),
+        (centers[:,2] + radii) - z_low)
+    reach = N.where(horiz > 0, rise/abs(directions[:,2])*horiz, 0)
+    N.seterr(**oldsettings)
+    extent = N.sqrt(N.sum((centers[:,:2].max(axis=0) - \
+        centers[:,:2].min(axis=0))**2))
+    reach = N.minimum(reach, extent) + 2*radii.max()
+
+    # The horizontal direction of each ray, zero for vertical rays:
+    horiz_dirs = N.zeros((len(horiz), 2))
+    slanted = horiz > 0
+    horiz_dirs[slanted] = directions[slanted,:2]/horiz[slanted,None]
+
+    cell = index.get_cell_size()
+    slack = 2*radii.max() + N.sqrt(2)*cell
+    max_offset = int(N.ceil(reach.max()/cell)) + 1
+    first = []
+    second = []
+    for dx in xrange(-max_offset, max_offset + 1):
+        for dy in xrange(-max_offset, max_offset + 1):
+            # Skip heliostats whose rays pass far from the offset cell. The
+            # horizontal distance of a center from a ray is no more than the
+            # 3D distance, and the offset of the cells is within the slack
+            # of the offset of any two centers in them.
+            offset = N.r_[dx, dy]*cell
+            along = N.dot(horiz_dirs, offset)
+            perp2 = N.sum(offset**2) - along**2
+            items = N.nonzero((along > -slack) & (perp2 <= slack**2) & \
+                (N.sqrt(N.sum(offset**2)) <= reach + N.sqrt(2)*cell))[0]
+            if len(items) == 0:
+                continue
+            i, j = index.pairs_at_offset(N.r_[dx, dy], items)
+
+            rel = centers[j] - centers[i]
+            along = N.sum(rel*directions[i], axis=1)
+            perp2 = N.sum(rel**2, axis=1) - along**2
+            near = (i != j) & (along > -(radii[i] + radii[j])) & \
+                (perp2 <= (radii[i] + radii[j])**2)
+            first.append(i[near])
+            second.append(j[near])
+
+    if len(first) == 0:
+        return N.zeros(0, dtype=N.int_), N.zeros(0, dtype=N.int_)
+    return N.hstack(first), N.hstack(second)
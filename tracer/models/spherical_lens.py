@@ -17,7 +17,8 @@ from ..spatial_geometry import rotx
 import numpy as N
 
 class SphericalLens(AssembledObject):
-    def __init__(self, diameter, depth, R1, R2, refr_idx, transform=None):
+    def __init__(self, diameter, depth, R1, R2, refr_idx, transform=None,
+            stochastic=False):
         """
         Create at least two lens surfaces (back and front), and possibly a
         cylindrical face to close the object if its diameter is smaller than
@@ -36,6 +37,10 @@ class SphericalLens(AssembledObject):
             radius indicates that the center of curvature is down the Z axis
             from the surface, and either 0, None or infinity indicate planar face.
         refr_idx - refractive index of the material of the lens.
+        transform - passed on to the AssembledObject constructor.
+        stochastic - if True, the lens faces choose between reflection and
+            refraction for each hit, instead of splitting each ray in two (see
+            RefractiveHomogenous).
         """
         flip_side = rotx(N.pi)[:3,:3]
         
@@ -43,7 +48,7 @@ class SphericalLens(AssembledObject):
         if R1 in [0, None, N.inf, -N.inf]:
             self._front = Surface(
                 RoundPlateGM(diameter/2.),
-                Refractive(1., refr_idx))
+                Refractive(1., refr_idx, stochastic))
             R1 = B.inf
         else:
             z = N.sqrt(R1**2 - diameter**2/4.) # location of cut plane
@@ -53,14 +58,14 @@ class SphericalLens(AssembledObject):
                 sect1 = BoundaryPlane(location=N.r_[0, 0, -z], rotation=flip_side)
             sphere = CutSphereGM(radius=abs(R1), bounding_volume=sect1)
             
-            refr=Refractive(1., refr_idx)
+            refr=Refractive(1., refr_idx, stochastic)
             self._front = Surface(geometry=sphere, optics=refr)
         
         # Back surface:
         if R2 in [0, None, N.inf, -N.inf]:
             self._back = Surface(
                 RoundPlateGM(diameter/2.),
-                Refractive(1., refr_idx),
+                Refractive(1., refr_idx, stochastic),
                 rotation=flip_side)
             R2 = N.inf
         else:
@@ -71,7 +76,7 @@ class SphericalLens(AssembledObject):
                 sect2 = BoundaryPlane(location=N.r_[0, 0, -z], rotation=flip_side)
             sphere = CutSphereGM(radius=abs(R2), bounding_volume=sect2)
 
-            refr=Refractive(1., refr_idx)
+            refr=Refractive(1., refr_idx, stochastic)
             self._back = Surface(geometry=sphere, optics=refr)
         
         # While locating the surfaces, we'll calculate bounding cylinder
@@ -106,7 +111,7 @@ class SphericalLens(AssembledObject):
         if cyl_height > 0:
             self._cyl = Surface(
                 FiniteCylinder(diameter, cyl_height),
-                Refractive(refr_idx, 1.), location=N.r_[0., 0., cyl_loc])
+                Refractive(refr_idx, 1., stochastic), location=N.r_[0., 0., cyl_loc])
             surfs = [self._front, self._back, self._cyl]
         else:
             surfs=[self._front, self._back]
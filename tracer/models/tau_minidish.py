@@ -22,7 +22,7 @@ from math import sqrt, pi
 class MiniDish(HomogenizedLocalReceiver):
     def __init__(self, diameter, focal_length, dish_opt_eff,\
         receiver_pos, receiver_side, homogenizer_depth, homog_opt_eff,
-        receiver_aspect=1.):
+        receiver_aspect=1., light_pipe=False):
         """
         Arguments:
         diameter, focal_length - of the parabolic dish
@@ -34,12 +34,15 @@ class MiniDish(HomogenizedLocalReceiver):
         homogenizer_depth - the homogenizer has base dimensions to fit the PV
             square, and this height.
         homog_opt_eff - the optical efficiency of each mirror in the homogenizer
+        receiver_aspect - the ratio of the receiver's y side to its x side.
+        light_pipe - if True, model the homogenizer as a light pipe, see
+            HomogenizedLocalReceiver.
         """
         dish_surf = Surface(ParabolicDishGM(diameter, focal_length), 
             opt.Reflective(1 - dish_opt_eff))
         receiver_dims = (receiver_side, receiver_side*receiver_aspect)
         HomogenizedLocalReceiver.__init__(self, dish_surf, receiver_pos, \
-            receiver_dims, homogenizer_depth, homog_opt_eff)
+            receiver_dims, homogenizer_depth, homog_opt_eff, light_pipe)
         
         # for later interrogation:
         self._ext_dims = (diameter, receiver_pos)
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+JIT-compiled versions of the kernels in tracer.kernels, used when Numba is
+installed. Each kernel is a single loop over the rays, doing all the per-ray
+work (including the branches for misses, back-side hits, total internal
+reflection etc.) without allocating whole-array temporaries.
+
+The kernels are exported in the KERNELS dictionary and registered under the
+'numba' backend by tracer.kernels. Importing this module raises ImportError
+if Numba is not available.
+"""
+
+import math
+import numpy as N
+from numba import njit
+
+@njit(cache=True)
+def _flat_loop(frame, vertices, directions, params, backside):
+    """
+    Fill in the flat-plane intersection parameters and back-side flags,
+    returning nothing.
+    """
+    for r in range(vertices.shape[1]):
+        dt = 0.
+        vt = 0.
+        for c in range(3):
+            dt += directions[c,r]*frame[c,2]
+            vt += (vertices[c,r] - frame[c,3])*frame[c,2]
+        backside[r] = dt > 0
+
+        params[r] = N.inf
+        if abs(dt) > 1e-10:
+            t = -vt/dt
+            if t >= 0:
+                params[r] = t
+
+@njit(cache=True)
+def _finite_flat_loop(frame, vertices, directions, shape, dims):
+    """
+    Intersect rays with a finite shape on the XY plane of ``frame``. The
+    local coordinates are found using the transpose of the frame's rotation,
+    which is valid for the rigid transforms used by Tracer.
+
+    Arguments:
+    shape - 0 for a rectangle, 1 for a circle, 2 for a triangle.
+    dims - the half-width and half-height of a rectangle; the radius of a
+        circle; or the 4 local x, y coordinates of the two non-origin vertices
+        of a triangle (column by column).
+    """
+    n = vertices.shape[1]
+    params = N.empty(n)
+    backside = N.empty(n, dtype=N.bool_)
+    glob = N.empty((3, n))
+    _flat_loop(frame, vertices, directions, params, backside)
+
+    # Triangle edges, used only for shape 2:
+    u0 = 0.; u1 = 0.; v0 = 0.; v1 = 0.
+    if shape == 2:
+        u0 = dims[0]; u1 = dims[1]
+        v0 = dims[2]; v1 = dims[3]
+    uu = u0*u0 + u1*u1
+    vv = v0*v0 + v1*v1
+    uv = u0*v0 + u1*v1
+    denom = uv*uv - uu*vv
+
+    for r in range(n):
+        t = params[r]
+        if t == N.inf:
+            for c in range(3):
+                glob[c,r] = N.nan
+            continue
+
+        x = 0.
+        y = 0.
+        for c in range(3):
+            g = vertices[c,r] + t*directions[c,r]
+            glob[c,r] = g
+            x += (g - frame[c,3])*frame[c,0]
+            y += (g - frame[c,3])*frame[c,1]
+
+        if shape == 0:
+            outside = (abs(x) > dims[0]) or (abs(y) > dims[1])
+        elif shape == 1:
+            outside = x*x + y*y > dims[0]*dims[0]
+        else:
+            wu = x*u0 + y*u1
+            wv = x*v0 + y*v1
+            s = (uv*wv - vv*wu)/denom
+            q = (uv*wu - uu*wv)/denom
+            outside = (s < 0) or (q < 0) or (s + q > 1)
+
+        if outside:
+            params[r] = N.inf
+
+    return params, backside, glob
+
+def flat_intersections(frame, vertices, directions):
+    n = vertices.shape[1]
+    params = N.empty(n)
+    backside = N.empty(n, dtype=N.bool_)
+    _flat_loop(N.ascontiguousarray(frame, dtype=N.float64),
+        N.ascontiguousarray(vertices, dtype=N.float64),
+        N.ascontiguousarray(directions, dtype=N.float64), params, backside)
+    return params, backside
+
+def _finite_flat(frame, vertices, directions, shape, dims):
+    return _finite_flat_loop(N.ascontiguousarray(frame, dtype=N.float64),
+        N.ascontiguousarray(vertices, dtype=N.float64),
+        N.ascontiguousarray(directions, dtype=N.float64), shape,
+        N.ascontiguousarray(dims, dtype=N.float64))
+
+def rect_plate_intersections(frame, vertices, directions, half_dims):
+    return _finite_flat(frame, vertices, directions, 0,
+        N.asarray(half_dims, dtype=N.float64).reshape(-1))
+
+def round_plate_intersections(frame, vertices, directions, R):
+    return _finite_flat(frame, vertices, directions, 1, N.r_[float(R)])
+
+def triangle_intersections(frame, vertices, directions, tri_verts):
+    return _finite_flat(frame, vertices, directions, 2,
+        N.asarray(tri_verts, dtype=N.float64)[:2].T.reshape(-1))
+
+@njit(cache=True)
+def _instanced_rect_loop(frames, vertices, directions, half_dims, min_param):
+    n = vertices.shape[1]
+    params = N.empty(n)
+    owner = N.empty(n, dtype=N.int64)
+    for r in range(n):
+        params[r] = N.inf
+        owner[r] = -1
+        for i in range(frames.shape[0]):
+            dt = 0.
+            vt = 0.
+            for c in range(3):
+                dt += directions[c,r]*frames[i,c,2]
+                vt += (vertices[c,r] - frames[i,c,3])*frames[i,c,2]
+            if abs(dt) <= 1e-10:
+                continue
+            t = -vt/dt
+            if t <= min_param or t >= params[r]:
+                continue
+
+            inside = True
+            for axis in range(2):
+                loc = 0.
+                for c in range(3):
+                    loc += (vertices[c,r] + t*directions[c,r] - \
+                        frames[i,c,3])*frames[i,c,axis]
+                if abs(loc) > half_dims[axis]:
+                    inside = False
+            if inside:
+                params[r] = t
+                owner[r] = i
+    return params, owner
+
+def instanced_rect_intersections(frames, vertices, directions, half_dims,
+        min_param=1e-6):
+    return _instanced_rect_loop(N.ascontiguousarray(frames, dtype=N.float64),
+        N.ascontiguousarray(vertices, dtype=N.float64),
+        N.ascontiguousarray(directions, dtype=N.float64),
+        N.asarray(half_dims, dtype=N.float64).reshape(-1), float(min_param))
+
+@njit(cache=True)
+def _quadric_roots_loop(A, B, C):
+    n = A.shape[0]
+    hits = N.empty((2, n))
+    for r in range(n):
+        delta = B[r]*B[r] - 4*A[r]*C[r]
+        if delta < 0:
+            hits[0,r] = N.nan
+            hits[1,r] = N.nan
+        elif A[r] <= 1e-10:
+            hits[0,r] = -C[r]/B[r]
+            hits[1,r] = hits[0,r]
+        else:
+            delta = math.sqrt(delta)
+            hits[0,r] = (-B[r] - delta)/(2*A[r])
+            hits[1,r] = (-B[r] + delta)/(2*A[r])
+    return hits
+
+def quadric_roots(A, B, C):
+    return _quadric_roots_loop(N.ascontiguousarray(A, dtype=N.float64),
+        N.ascontiguousarray(B, dtype=N.float64),
+        N.ascontiguousarray(C, dtype=N.float64))
+
+@njit(cache=True)
+def _quadric_select_loop(prm):
+    n = prm.shape[1]
+    select = N.empty(n)
+    for r in range(n):
+        pos0 = prm[0,r] > 0
+        pos1 = prm[1,r] > 0
+        if pos0:
+            select[r] = 0.
+        elif pos1:
+            select[r] = 1.
+        else:
+            select[r] = N.nan
+    return select
+
+def quadric_select_positive(prm):
+    return _quadric_select_loop(N.ascontiguousarray(prm, dtype=N.float64))
+
+# Optics. Normals may be given per ray (3 by n) or as one column (3 by 1)
+# that applies to all rays.
+@njit(cache=True)
+def _reflections_loop(ray_dirs, normals):
+    n = ray_dirs.shape[1]
+    per_ray = normals.shape[1] > 1
+    out = N.empty((3, n))
+    for r in range(n):
+        nr = r if per_ray else 0
+        proj = 0.
+        for c in range(3):
+            proj += ray_dirs[c,r]*normals[c,nr]
+        for c in range(3):
+            out[c,r] = ray_dirs[c,r] - 2*proj*normals[c,nr]
+    return out
+
+def reflections(ray_dirs, normals):
+    return _reflections_loop(N.ascontiguousarray(ray_dirs, dtype=N.float64),
+        N.ascontiguousarray(normals, dtype=N.float64))
+
+@njit(cache=True)
+def _refractions_loop(n1, n2, ray_dirs, normals):
+    n = ray_dirs.shape[1]
+    per_ray = normals.shape[1] > 1
+    refracted = N.empty(n, dtype=N.bool_)
+
+    num_refr = 0
+    for r in range(n):
+        nr = r if per_ray else 0
+        cos1 = 0.
+        for c in range(3):
+            cos1 += ray_dirs[c,r]*normals[c,nr]
+        ratio = n2[r]/n1[r]
+        refracted[r] = cos1*cos1 >= 1 - ratio*ratio
+        if refracted[r]:
+            num_refr += 1
+
+    refr_dirs = N.empty((3, num_refr))
+    out = 0
+    for r in range(n):
+        if not refracted[r]:
+            continue
+        nr = r if per_ray else 0
+        cos1 = 0.
+        for c in range(3):
+            cos1 += ray_dirs[c,r]*normals[c,nr]
+        ratio = n2[r]/n1[r]
+        cos2 = math.sqrt(1 - (1 - cos1*cos1)/(ratio*ratio))
+        if cos1 < 0:
+            cos2 = -cos2
+        for c in range(3):
+            refr_dirs[c,out] = (ray_dirs[c,r] - cos1*normals[c,nr])/ratio + \
+                normals[c,nr]*cos2
+        out += 1
+
+    return refracted, refr_dirs
+
+def refractions(n1, n2, ray_dirs, normals):
+    num_rays = ray_dirs.shape[1]
+    n1 = N.broadcast_to(N.asarray(n1, dtype=N.float64), (num_rays,))
+    n2 = N.broadcast_to(N.asarray(n2, dtype=N.float64), (num_rays,))
+    return _refractions_loop(N.ascontiguousarray(n1),
+        N.ascontiguousarray(n2),
+        N.ascontiguousarray(ray_dirs, dtype=N.float64),
+        N.ascontiguousarray(normals, dtype=N.float64))
+
+@njit(cache=True)
+def _fresnel_loop(ray_dirs, normals, n1, n2):
+    n = ray_dirs.shape[1]
+    per_ray = normals.shape[1] > 1
+    R = N.empty(n)
+    for r in range(n):
+        nr = r if per_ray else 0
+        cos_in = 0.
+        for c in range(3):
+            cos_in += ray_dirs[c,r]*normals[c,nr]
+        foo = abs(cos_in)
+        sin_in = math.sqrt(max(0., 1 - foo*foo))
+        bar = math.sqrt(1 - (n1[r]/n2[r]*sin_in)**2)
+
+        Rs = ((n1[r]*foo - n2[r]*bar)/(n1[r]*foo + n2[r]*bar))**2
+        Rp = ((n1[r]*bar - n2[r]*foo)/(n1[r]*bar + n2[r]*foo))**2
+        R[r] = (Rs + Rp)/2
+    return R
+
+def fresnel(ray_dirs, normals, n1, n2):
+    num_rays = ray_dirs.shape[1]
+    n1 = N.broadcast_to(N.asarray(n1, dtype=N.float64), (num_rays,))
+    n2 = N.broadcast_to(N.asarray(n2, dtype=N.float64), (num_rays,))
+    return _fresnel_loop(N.ascontiguousarray(ray_dirs, dtype=N.float64),
+        N.ascontiguousarray(normals, dtype=N.float64),
+        N.ascontiguousarray(n1), N.ascontiguousarray(n2))
+
+KERNELS = {
+    'flat_intersections': flat_intersections,
+    'rect_plate_intersections': rect_plate_intersections,
+    'round_plate_intersections': round_plate_intersections,
+    'instanced_rect_intersections': instanced_rect_intersections,
+    'triangle_intersections': triangle_intersections,
+    'quadric_roots': quadric_roots,
+    'quadric_select_positive': quadric_select_positive,
+    'reflections': reflections,
+    'refractions': refractions,
+    'fresnel': fresnel,
+}
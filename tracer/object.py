@@ -3,6 +3,7 @@
 import numpy as N
 from spatial_geometry import general_axis_rotation
 from assembly import Assembly
+from has_frame import HasFrame
 
 class AssembledObject(Assembly):
     """ Defines an assembly of surfaces as an object. The object has its own set of 
@@ -96,3 +97,92 @@ class AssembledObject(Assembly):
             in the next iteration.
         """
         return N.ones((len(self.surfaces), rays.get_num_rays()), dtype=N.bool)
+
+class TransformBatch(object):
+    """
+    Sets the transforms of many objects belonging to one assembly at once,
+    with the same result as calling set_transform() on each of them.
+    
+    The objects' transforms and the global frames of their surfaces are kept
+    as views into two shared (n,4,4) arrays (see HasFrame.share_frames()),
+    so that once they are bound, moving all objects is a few array
+    operations regardless of their number. Objects or members moved
+    individually (e.g. by set_transform()) no longer share the arrays, and
+    the next set_transforms() binds them all again. Members that override
+    transform_frame(), like boundary shapes, are updated by calling it.
+    """
+    def __init__(self, objects):
+        """
+        Arguments:
+        objects - a list of n AssembledObject instances.
+        """
+        self._objects = objects
+        self._transforms = None
+        self._bound = False
+    
+    def invalidate(self):
+        """
+        Make the next set_transforms() bind the objects and members again,
+        e.g. after changing an object's boundaries. Moving an object or
+        member other than through the batch, or adding surfaces, does this
+        already.
+        """
+        self._bound = False
+    
+    def _bind(self, transforms, assembly_transform):
+        self._transforms = N.array(transforms, dtype=N.float64)
+        self._called = []
+        
+        members = []
+        owners = []
+        for idx, obj in enumerate(self._objects):
+            obj.share_frames(transform=self._transforms[idx],
+                on_change=self.invalidate)
+            for member in obj.get_surfaces() + obj.get_boundaries():
+                if type(member).transform_frame.im_func is \
+                        HasFrame.transform_frame.im_func:
+                    members.append(member)
+                    owners.append(idx)
+                else:
+                    self._called.append((member, idx))
+        
+        self._owners = N.array(owners, dtype=N.int_)
+        self._locals = N.array([m.get_transform() for m in members]).reshape(
+            -1, 4, 4)
+        self._frames = self._global_frames(assembly_transform)
+        for member, frame in zip(members, self._frames):
+            member.share_frames(frame=frame, on_change=self.invalidate)
+        self._bound = True
+    
+    def _global_frames(self, assembly_transform):
+        obj_glob = N.matmul(assembly_transform, self._transforms)
+        return N.matmul(obj_glob[self._owners], self._locals)
+    
+    def set_transforms(self, transforms, assembly_transform=N.eye(4)):
+        """
+        Move all objects.
+        
+        Arguments:
+        transforms - an (n,4,4) array, the new transform of each object
+            relative to the containing assembly.
+        assembly_transform - the transform of the containing assembly into
+            global coordinates.
+        """
+        if self._bound:
+            self._transforms[...] = transforms
+            self._frames[...] = self._global_frames(assembly_transform)
+        else:
+            self._bind(transforms, assembly_transform)
+        
+        for member, idx in self._called:
+            member.transform_frame(N.dot(assembly_transform,
+                self._transforms[idx]))
+    
+    def get_transforms(self):
+        """
+        The (n,4,4) array of the objects' transforms, or None if they were
+        never set through the batch.
+        """
+        if self._transforms is not None and not self._bound:
+            return N.array([obj.get_transform() for obj in self._objects])
+        return self._transforms
@@ -2,7 +2,8 @@
 # A collection of callables and tools for creating them, that may be used for
 # the optics-callable part of a Surface object.
 
-from . import optics, ray_bundle, sources
+from . import sources, kernels
+from .ray_bundle import RayBundle
 from .spatial_geometry import rotation_to_z
 import numpy as N
 
@@ -20,12 +21,23 @@ class Reflective(object):
     def __init__(self, absorptivity):
         self._abs = absorptivity
     
-    def __call__(self, geometry, rays, selector):
-        outg = rays.inherit(selector,
-            vertices=geometry.get_intersection_points_global(),
-            direction=optics.reflections(
-                rays.get_directions()[:,selector], geometry.get_normals()),
-            energy=rays.get_energy()[selector]*(1 - self._abs),
+    def is_terminal(self):
+        """
+        A fully-absorbing surface is terminal: it generates no outgoing rays,
+        and the tracer engine may skip all bookkeeping of its hits.
+        """
+        return self._abs == 1.
+    
+    def __call__(self, hits):
+        if self.is_terminal():
+            return RayBundle.empty_bund()
+        
+        selector = hits.get_selector()
+        outg = hits.get_rays().inherit(selector,
+            vertices=hits.get_intersection_points(),
+            direction=kernels.get_kernel('reflections')(
+                hits.get_directions(), hits.get_normals()),
+            energy=hits.get_energy()*(1 - self._abs),
             parents=selector)
         return outg
 
@@ -52,11 +64,18 @@ class AbsorptionAccountant(object):
         """Clear the memory of hits (best done before a new trace)."""
         self._absorbed = []
         self._hits = []
+        self._contributors = []
+    
+    def is_terminal(self):
+        """Terminal if the wrapped optics manager is."""
+        return self._opt.is_terminal()
     
-    def __call__(self, geometry, rays, selector):
-        self._absorbed.append(rays.get_energy()[selector]*self._opt._abs)
-        self._hits.append(geometry.get_intersection_points_global())
-        return self._opt(geometry, rays, selector)
+    def __call__(self, hits):
+        self._absorbed.append(hits.get_energy()*self._opt._abs)
+        self._hits.append(hits.get_intersection_points())
+        if hits.get_rays().has_property('contributor'):
+            self._contributors.append(hits.get_property('contributor'))
+        return self._opt(hits)
     
     def get_all_hits(self):
         """
@@ -71,6 +90,45 @@ class AbsorptionAccountant(object):
         
         return N.hstack([a for a in self._absorbed if len(a)]), \
             N.hstack([h for h in self._hits if h.shape[1]])
+    
+    def get_all_contributors(self):
+        """
+        Aggregate the contributor of each hit, for rays tagged by a
+        ContributorTagger.
+        
+        Returns:
+        an integer array, the contributor of each hit-point in the order of
+            get_all_hits(), -1 for rays not reflected by a contributor.
+        """
+        if len(self._contributors) != len(self._absorbed):
+            raise ValueError("Not all rays hitting the receiver were tagged " \
+                "with a contributor.")
+        if not len(self._absorbed):
+            return N.array([], dtype=N.int_)
+        
+        return N.hstack(self._contributors)
+    
+    def get_contributions(self, num_contributors=0):
+        """
+        Sum the absorbed energy by the contributor that reflected it, for
+        rays tagged by a ContributorTagger. Rays with no contributor (-1) are
+        not counted.
+        
+        Arguments:
+        num_contributors - the minimal length of the result, e.g. the number
+            of heliostats in a field.
+        
+        Returns:
+        an array whose i-th cell is the energy absorbed from rays of
+            contributor i.
+        """
+        ids = self.get_all_contributors()
+        if not len(ids):
+            return N.zeros(num_contributors)
+        
+        tagged = ids >= 0
+        return N.bincount(ids[tagged], N.hstack(self._absorbed)[tagged],
+            minlength=num_contributors)
 
 class ReflectiveReceiver(AbsorptionAccountant):
     """A wrapper around AbsorptionAccountant with a Reflective optics"""
@@ -81,19 +139,23 @@ class AbsorberReflector(Reflective):
     """
     This optics manager behaves similarly to the ReflectiveReceiver class,
     but adds directionality. In this way a simple one-side receiver doesn't
-    necessitate an extra surface in the back.
+    necessitate an extra surface in the back. Note that rays from the "down"
+    side still generate (zero-energy) outgoing rays; giving the Surface a
+    separate back_optics avoids that.
     """
-    def __call__(self, geometry, rays, selector):
+    def __call__(self, hits):
         """
         Rays coming from the "up" side are reflected like in a Reflective
         instance, rays coming from the "down" side have their energy set to 0.
         As usual, "up" is the surface's Z axis.
         """
-        outg = Reflective.__call__(self, geometry, rays, selector)
+        outg = Reflective.__call__(self, hits)
+        if self.is_terminal():
+            return outg
+        
         energy = outg.get_energy()
-        proj = N.sum(rays.get_directions()[:,selector] * geometry.up()[:,None], axis=0)
+        proj = N.dot(hits.get_geometry().up(), hits.get_directions())
         energy[proj > 0] = 0
-        outg.set_energy(energy)
         return outg
         
 class RefractiveHomogenous(object):
@@ -102,14 +164,24 @@ class RefractiveHomogenous(object):
     constant refractive index on each side. The specific index in which a
     refracted ray moves is determined by toggling between the two possible
     indices.
+    
+    By default each hit is split into a reflected and a refracted ray, with
+    the energy divided according to the Fresnel reflectance. In stochastic
+    mode, each hit instead generates one ray with the full incoming energy,
+    which is reflected with probability equal to the reflectance, and
+    refracted otherwise. The expected energy in each direction is the same,
+    but the number of rays does not grow on each refraction.
     """
-    def __init__(self, n1, n2):
+    def __init__(self, n1, n2, stochastic=False):
         """
         Arguments:
         n1, n2 - scalars representing the homogenous refractive index on each
             side of the surface (order doesn't matter).
+        stochastic - if True, choose one of reflection or refraction for each
+            hit, as described above.
         """
         self._ref_idxs = (n1, n2)
+        self._stochastic = stochastic
     
     def toggle_ref_idx(self, current):
         """
@@ -126,39 +198,262 @@ class RefractiveHomogenous(object):
         return N.where(current == self._ref_idxs[0], 
             self._ref_idxs[1], self._ref_idxs[0])
     
-    def __call__(self, geometry, rays, selector):
+    def __call__(self, hits):
+        selector = hits.get_selector()
         if len(selector) == 0:
-            return ray_bundle.empty_bund()
+            return RayBundle.empty_bund()
         
-        n1 = rays.get_ref_index()[selector]
+        dirs = hits.get_directions()
+        normals = hits.get_normals()
+        n1 = hits.get_ref_index()
         n2 = self.toggle_ref_idx(n1)
-        refr, out_dirs = optics.refractions(n1, n2, \
-            rays.get_directions()[:,selector], geometry.get_normals())
+        refr, out_dirs = kernels.get_kernel('refractions')(n1, n2, dirs, normals)
         
         if not refr.any():
-            return perfect_mirror(geometry, rays, selector)
+            return perfect_mirror(hits)
         
         # Reflected energy:
+        if normals.shape[1] > 1:
+            refr_normals = normals[:,refr]
+        else:
+            refr_normals = normals
         R = N.ones(len(selector))
-        R[refr] = optics.fresnel(rays.get_directions()[:,selector][:,refr],
-            geometry.get_normals()[:,refr], n1[refr], n2[refr])
-        
-        # The output bundle is generated by stacking together the reflected and
-        # refracted rays in that order.
-        inters = geometry.get_intersection_points_global()
-        reflected_rays = rays.inherit(selector, vertices=inters,
-            direction=optics.reflections(
-                rays.get_directions()[:,selector],
-                geometry.get_normals()),
-            energy=rays.get_energy()[selector]*R,
-            parents=selector)
+        R[refr] = kernels.get_kernel('fresnel')(dirs[:,refr], refr_normals,
+            n1[refr], n2[refr])
+        
+        if self._stochastic:
+            return self._choose_branch(hits, refr, out_dirs, R, n1, n2)
         
-        refracted_rays = rays.inherit(selector[refr], vertices=inters[:,refr],
-            direction=out_dirs, parents=selector[refr],
-            energy=rays.get_energy()[selector][refr]*(1 - R[refr]),
-            ref_index=n2[refr])
+        # The output bundle holds the reflected and refracted rays in that
+        # order. It is allocated once and filled in place.
+        num_hits = len(selector)
+        num_out = num_hits + out_dirs.shape[1]
+        inters = hits.get_intersection_points()
+        energy = hits.get_energy()
         
-        return reflected_rays + refracted_rays
+        vertices = N.empty((3, num_out))
+        vertices[:,:num_hits] = inters
+        vertices[:,num_hits:] = inters[:,refr]
+        
+        directions = N.empty((3, num_out))
+        directions[:,:num_hits] = kernels.get_kernel('reflections')(dirs, normals)
+        directions[:,num_hits:] = out_dirs
+        
+        out_energy = N.empty(num_out)
+        out_energy[:num_hits] = energy*R
+        out_energy[num_hits:] = energy[refr]*(1 - R[refr])
+        
+        ref_index = N.empty(num_out)
+        ref_index[:num_hits] = n1
+        ref_index[num_hits:] = n2[refr]
+        
+        parents = N.hstack((selector, selector[refr]))
+        return hits.get_rays().inherit(parents, vertices=vertices,
+            direction=directions, energy=out_energy, parents=parents,
+            ref_index=ref_index)
+
+    def _choose_branch(self, hits, refr, refr_dirs, R, n1, n2):
+        """
+        Generate the outgoing bundle in stochastic mode: one ray per hit,
+        refracted with probability 1 - R and reflected otherwise.
+        
+        Arguments:
+        hits - the HitRecord given to __call__()
+        refr - a boolean array, True for hits that may be refracted (not
+            totally internally reflected).
+        refr_dirs - a 3 by refr.sum() array of refracted directions.
+        R - the reflectance of each hit (1 where refr is False).
+        n1, n2 - arrays of the refractive index before the hit and on the
+            other side of the surface, respectively.
+        """
+        selector = hits.get_selector()
+        reflect = hits.get_prng().uniform(size=len(selector)) < R
+        transmit = refr & ~reflect
+        
+        directions = kernels.get_kernel('reflections')(hits.get_directions(),
+            hits.get_normals())
+        directions[:,transmit] = refr_dirs[:,~reflect[refr]]
+        
+        return hits.get_rays().inherit(selector,
+            vertices=hits.get_intersection_points(), direction=directions,
+            energy=hits.get_energy(), parents=selector,
+            ref_index=N.where(transmit, n2, n1))
+
+class ContributorTagger(object):
+    """
+    Wraps an optics manager, and tags the rays it generates with the
+    contributor that first reflected them, e.g. the index of a heliostat in
+    its field. The tag is the ray property 'contributor', which RayBundle's
+    inherit() passes on to the rays generated by later surfaces, and which
+    receivers count in AbsorptionAccountant.get_contributions().
+    
+    Rays already tagged by an earlier surface keep their tag. Untagged rays
+    have the contributor -1; so that the tag is kept by all rays of a trace,
+    the source bundle should have the property too (see with_contributors()).
+    """
+    def __init__(self, real_optics, contributor=None):
+        """
+        Arguments:
+        real_optics - the optics manager generating the outgoing rays.
+        contributor - an integer, the tag of all rays reflected here. If
+            None, rays are tagged with the instance they hit, for a surface
+            whose geometry manager is an InstancedGM (see tracer.instancing).
+        """
+        self._opt = real_optics
+        self._contributor = contributor
+    
+    def is_terminal(self):
+        """Terminal if the wrapped optics manager is."""
+        return hasattr(self._opt, 'is_terminal') and self._opt.is_terminal()
+    
+    def __call__(self, hits):
+        outg = self._opt(hits)
+        if outg.get_num_rays() == 0:
+            return outg
+        
+        parents = outg.get_parents()
+        if self._contributor is None:
+            # Find the instance hit by each outgoing ray's parent:
+            by_ray = N.empty(hits.get_rays().get_num_rays(), dtype=N.int_)
+            by_ray[hits.get_selector()] = hits.restrict(
+                hits.get_geometry().get_instance_indices())
+            tags = by_ray[parents]
+        else:
+            tags = N.repeat(self._contributor, len(parents))
+        
+        if hits.get_rays().has_property('contributor'):
+            prev = hits.get_rays().get_contributor(parents)
+            tags = N.where(prev >= 0, prev, tags)
+        
+        if outg.has_property('contributor'):
+            outg.set_contributor(tags)
+            return outg
+        return outg.inherit(contributor=tags)
+
+def with_contributors(bundle):
+    """
+    Make a copy of a source bundle with the ray property 'contributor' of a
+    ContributorTagger, set to -1 (none yet) for all rays.
+    """
+    return bundle.inherit(
+        contributor=-N.ones(bundle.get_num_rays(), dtype=N.int_))
+
+class AxialStart(object):
+    """
+    Wraps an optics manager, and marks the rays it generates with the axial
+    coordinate where they first hit a surface of a translation-invariant
+    collector (see tracer.extruded), in the ray property 'axial_start'.
+    Wrap the optics of each of the collector's surfaces that rays may hit
+    before the receiver, e.g. its mirrors.
+    
+    Rays already marked by an earlier surface keep their mark. Unmarked rays
+    have NaN; so that the mark is kept by all rays of a trace, the source
+    bundle should have the property too (see with_axial_start()).
+    """
+    def __init__(self, real_optics, axis):
+        """
+        Arguments:
+        real_optics - the optics manager generating the outgoing rays.
+        axis - a 3-array, the global unit vector along the collector's axis.
+        """
+        self._opt = real_optics
+        self._axis = N.asarray(axis, dtype=N.float_)
+    
+    def is_terminal(self):
+        """Terminal if the wrapped optics manager is."""
+        return hasattr(self._opt, 'is_terminal') and self._opt.is_terminal()
+    
+    def __call__(self, hits):
+        outg = self._opt(hits)
+        if outg.get_num_rays() == 0:
+            return outg
+        
+        parents = outg.get_parents()
+        by_ray = N.empty(hits.get_rays().get_num_rays())
+        by_ray[hits.get_selector()] = N.dot(self._axis,
+            hits.get_intersection_points())
+        starts = by_ray[parents]
+        
+        if hits.get_rays().has_property('axial_start'):
+            prev = hits.get_rays().get_axial_start(parents)
+            starts = N.where(N.isnan(prev), starts, prev)
+        
+        if outg.has_property('axial_start'):
+            outg.set_axial_start(starts)
+            return outg
+        return outg.inherit(axial_start=starts)
+
+def with_axial_start(bundle):
+    """
+    Make a copy of a source bundle with the ray property 'axial_start' of an
+    AxialStart, set to NaN (no start yet) for all rays.
+    """
+    return bundle.inherit(axial_start=N.tile(N.nan, bundle.get_num_rays()))
+
+class EndLossReceiver(AbsorptionAccountant):
+    """
+    A receiver of a translation-invariant collector of finite length, traced
+    with infinite surfaces in the 2.5D mode (see tracer.extruded). All rays
+    should start at the same axial position, so that the rays stand for the
+    collector's cross section.
+    
+    Along the collector's axis, a ray moves the same way between reflections,
+    so it gets from where it first hit the collector to the receiver only if
+    it first hit the collector at least its axial travel away from the end
+    it travels to. For rays first hitting anywhere along the collector, that
+    is a fraction 1 - |travel|/length of them, by which the absorbed energy
+    is weighted. The travel is measured from the 'axial_start' property of
+    AxialStart; rays without it came to the receiver directly and have no
+    end loss.
+    """
+    def __init__(self, axis, length, absorptivity=1.):
+        """
+        Arguments:
+        axis - a 3-array, the global unit vector along the collector's axis.
+        length - of the collector.
+        absorptivity - to be passed to the Reflective optics of the receiver.
+        """
+        self._axis = N.asarray(axis, dtype=N.float_)
+        self._length = length
+        AbsorptionAccountant.__init__(self, Reflective, absorptivity)
+    
+    def reset(self):
+        """Clear the memory of hits (best done before a new trace)."""
+        AbsorptionAccountant.reset(self)
+        self._travel = []
+    
+    def __call__(self, hits):
+        travel = N.dot(self._axis, hits.get_intersection_points())
+        if hits.get_rays().has_property('axial_start'):
+            travel = travel - hits.get_property('axial_start')
+            travel[N.isnan(travel)] = 0.
+        else:
+            travel = N.zeros_like(travel)
+        self._travel.append(travel)
+        return AbsorptionAccountant.__call__(self, hits)
+    
+    def get_all_hits(self):
+        """
+        Aggregate all hits from all stages of tracing into joined arrays.
+        
+        Returns:
+        absorbed - the energy absorbed by each hit-point, less the end losses.
+        hits - the corresponding global coordinates for each hit-point.
+        """
+        absorbed, hits = AbsorptionAccountant.get_all_hits(self)
+        if len(absorbed):
+            absorbed = absorbed*self.get_end_factors()
+        return absorbed, hits
+    
+    def get_end_factors(self):
+        """
+        Returns an array with the fraction of each hit's energy that the
+        collector's length allows, in the order of get_all_hits().
+        """
+        if not len(self._travel):
+            return N.array([])
+        travel = N.hstack(self._travel)
+        return N.maximum(0., 1 - abs(travel)/self._length)
 
 class LambertianReflector(object):
     """
@@ -166,25 +461,38 @@ class LambertianReflector(object):
     that reflects rays in a random direction (uniform distribution of
     directions in 3D, see tracer.sources.pillbox_sunshape_directions)
     """
-    def __init__(self, absorptivity):
+    def __init__(self, absorptivity, sampler=None):
+        """
+        Arguments:
+        absorptivity - the amount of energy absorbed before reflection.
+        sampler - optionally, a sampler from tracer.qmc to draw the reflected
+            directions from, instead of numpy.random.
+        """
         self._abs = absorptivity
+        self._sampler = sampler
+    
+    def is_terminal(self):
+        """A fully-absorbing surface is terminal, as in Reflective."""
+        return self._abs == 1.
     
-    def __call__(self, geometry, rays, selector):
+    def __call__(self, hits):
         """
         Arguments:
-        geometry - a GeometryManager which knows about surface normals, hit
-            points etc.
-        rays - the incoming ray bundle (all of it, not just rays hitting this
-            surface)
-        selector - indices into ``rays`` of the hitting rays.
-        """
-        directs = sources.pillbox_sunshape_directions(len(selector), N.pi/2.)
-        directs = N.sum(rotation_to_z(geometry.get_normals().T) * \
+        hits - a HitRecord describing the rays hitting the surface; its
+            geometry manager knows about surface normals, hit points etc.
+        """
+        if self.is_terminal():
+            return RayBundle.empty_bund()
+        
+        selector = hits.get_selector()
+        directs = sources.pillbox_sunshape_directions(len(selector), N.pi/2.,
+            self._sampler, hits.get_prng())
+        directs = N.sum(rotation_to_z(hits.get_normals().T) * \
             directs.T[:,None,:], axis=2).T
         
-        outg = rays.inherit(selector,
-            vertices=geometry.get_intersection_points_global(),
-            energy=rays.get_energy()[selector]*(1 - self._abs),
+        outg = hits.get_rays().inherit(selector,
+            vertices=hits.get_intersection_points(),
+            energy=hits.get_energy()*(1 - self._abs),
             direction=directs, parents=selector)
         return outg
 
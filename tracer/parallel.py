@@ -0,0 +1,127 @@
+"""
+Trace a chunked source in several processes, with the same results as
+tracing it serially.
+
+The rays of chunk i are generated by a user function of i, and chunk i is
+traced with the random substream optics_stream.spawn(i) (see
+tracer.random_streams), exactly as TracerEngine.ray_tracer() does when given
+an iterable of bundles. Since nothing in a chunk's trace depends on other
+chunks, the hits gathered by the receivers are bit-identical to those of a
+serial trace, whatever the number of processes.
+
+Worker processes are forked (as multiprocessing does on POSIX systems), so
+the assembly, the source function and the receivers need not be picklable;
+only the receivers' hits are sent back. map_forked() does the same for any
+function of the items of a job.
+
+Example::
+
+    stream = RandomStream(seed)
+    source = lambda i: solar_disk_bundle(chunk_size, center, direct, radius,
+        ang_range, flux, prng=stream.spawn(0).spawn(i))
+    results = trace_chunks(engine, source, num_chunks, 100, 1e-6,
+        [receiver], stream.spawn(1))
+    absorbed, hits = results[0]
+"""
+
+import multiprocessing as mp
+import numpy as N
+
+# The function and job of the current map_forked() call, inherited by
+# forked workers.
+_job = None
+
+def _call_one(item):
+    """Apply the current map_forked() function to one item of its job."""
+    func, job = _job
+    return func(job, item)
+
+def map_forked(func, job, items, processes=None):
+    """
+    Apply a function to each item, possibly in parallel by forked worker
+    processes. The job is shared with the workers by forking, so it need not
+    be picklable; the items and the results are sent through pipes.
+
+    Arguments:
+    func - a function taking the job and an item, and returning the item's
+        result.
+    job - anything func needs besides the item, e.g. an assembly to trace.
+    items - a sequence of picklable items.
+    processes - number of worker processes. None means one per CPU; 1
+        calls func in this process.
+
+    Returns:
+    a list of the results, in the order of the items.
+    """
+    if processes == 1:
+        return [func(job, item) for item in items]
+
+    global _job
+    outer = _job
+    _job = (func, job)
+    try:
+        pool = mp.Pool(processes)
+        try:
+            return pool.map(_call_one, items, 1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _job = outer
+
+def _trace_one(job, chunk_idx):
+    """
+    Trace one chunk of a trace_chunks() job.
+
+    Returns:
+    a list with a tuple (absorbed, hits) for each receiver of the job, the
+        result of its get_all_hits() for this chunk alone.
+    """
+    engine, source, reps, min_energy, receivers, prng = job
+    for rec in receivers:
+        rec.reset()
+
+    chunk_prng = None if prng is None else prng.spawn(chunk_idx)
+    engine.ray_tracer(source(chunk_idx), reps, min_energy, tree=False,
+        prng=chunk_prng)
+    return [rec.get_all_hits() for rec in receivers]
+
+def trace_chunks(engine, source, num_chunks, reps, min_energy, receivers,
+        prng=None, processes=None):
+    """
+    Trace the chunks of a source, possibly in parallel, and gather the hits
+    on some receivers.
+
+    Arguments:
+    engine - a TracerEngine of the traced assembly.
+    source - a function taking a chunk index and returning that chunk's
+        RayBundle. For reproducible results it should only draw random
+        numbers from a stream that depends on the index, e.g. a substream
+        of a RandomStream.
+    num_chunks - the number of chunks, with indices 0 .. num_chunks - 1.
+    reps, min_energy - passed on to engine.ray_tracer().
+    receivers - a list of optics managers whose hits are gathered, e.g.
+        ReflectiveReceiver instances. Their previous hits are discarded.
+    prng - the RandomStream of the stochastic optics. Chunk i is traced with
+        prng.spawn(i). If None, the global numpy.random generator is used,
+        and results are not reproducible.
+    processes - number of worker processes. None means one per CPU; 1
+        traces in this process.
+
+    Returns:
+    a list with a tuple (absorbed, hits) for each receiver, as returned by
+        its get_all_hits() after a serial trace of all chunks in order.
+    """
+    per_chunk = map_forked(_trace_one,
+        (engine, source, reps, min_energy, receivers, prng),
+        xrange(num_chunks), processes)
+
+    results = []
+    for rec_idx in xrange(len(receivers)):
+        absorbed = [chunk[rec_idx][0] for chunk in per_chunk]
+        hits = [chunk[rec_idx][1] for chunk in per_chunk]
+        results.append((N.hstack(absorbed), N.hstack(hits)))
+
+    for rec in receivers:
+        rec.reset()
+    return results
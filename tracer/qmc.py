@@ -0,0 +1,285 @@
+"""
+Low-discrepancy (quasi-Monte Carlo) samplers, to be used by the functions of
+tracer.sources and by optics managers that generate random directions,
+instead of numpy.random.
+
+A sampler is a callable ``sampler(num, dims)`` returning a (dims, num) array
+of points in the unit hypercube [0, 1)**dims. Consecutive calls continue the
+sequence, so that e.g. a LambertianReflector does not re-use the same
+directions on each trace iteration. Points of a low-discrepancy sequence fill
+the unit cube more evenly than pseudo-random points, so integrals over it
+(like the flux on a receiver) converge at close to O(1/N) instead of
+O(1/sqrt(N)).
+
+The samplers are randomized (scrambled and/or randomly shifted) by default.
+Each randomized sampler gives an unbiased estimate, so tracing several
+replicates, each with a sampler created with a different seed, and using
+replicate_error() on the results gives an error estimate for their mean.
+
+References:
+.. [1] S. Joe and F. Y. Kuo, Constructing Sobol sequences with better
+   two-dimensional projections, SIAM J. Sci. Comput. 30, 2635-2654 (2008).
+.. [2] J. Matousek, On the L2-discrepancy for anchored boxes, J. Complexity
+   14, 527-556 (1998).
+.. [3] A. B. Owen, Monte Carlo theory, methods and examples, 2013, ch. 17.
+"""
+
+import numpy as N
+
+# Bits of precision in the Sobol sequence. Allows 2**30 points.
+_SOBOL_BITS = 30
+
+# Primitive polynomial degree, coefficients and initial direction numbers m_i
+# of Sobol dimensions 2 onward, from [1] (the first dimension is the van der
+# Corput sequence).
+_SOBOL_PARAMS = [
+    (1, 0, [1]),
+    (2, 1, [1, 3]),
+    (3, 1, [1, 3, 1]),
+    (3, 2, [1, 1, 1]),
+    (4, 1, [1, 1, 3, 3]),
+    (4, 4, [1, 3, 5, 13]),
+    (5, 2, [1, 1, 5, 5, 17]),
+    (5, 4, [1, 1, 5, 5, 5]),
+    (5, 7, [1, 1, 7, 11, 19]),
+]
+
+_PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29]
+
+def sobol_direction_numbers(dims):
+    """
+    Calculate the direction numbers of the first ``dims`` dimensions of the
+    Sobol sequence, using the recurrence in [1].
+
+    Arguments:
+    dims - number of dimensions, at most len(_SOBOL_PARAMS) + 1.
+
+    Returns:
+    a (dims, _SOBOL_BITS) integer array. Row d holds the direction numbers
+        of dimension d, as integers to be divided by 2**_SOBOL_BITS.
+    """
+    if dims > len(_SOBOL_PARAMS) + 1:
+        raise ValueError("Sobol sequence supports at most %d dimensions" % \
+            (len(_SOBOL_PARAMS) + 1))
+
+    L = _SOBOL_BITS
+    V = N.empty((dims, L), dtype=N.int64)
+    V[0] = 1 << (L - 1 - N.arange(L))
+
+    for d in xrange(1, dims):
+        s, a, m = _SOBOL_PARAMS[d - 1]
+        for i in xrange(min(s, L)):
+            V[d,i] = m[i] << (L - 1 - i)
+        for i in xrange(s, L):
+            v = V[d,i - s] ^ (V[d,i - s] >> s)
+            for k in xrange(1, s):
+                if (a >> (s - 1 - k)) & 1:
+                    v ^= V[d,i - k]
+            V[d,i] = v
+
+    return V
+
+class Sobol(object):
+    """
+    The Sobol sequence [1], optionally scrambled by random linear matrix
+    scrambling [2] and a random digital shift. Scrambling keeps the
+    stratification properties of the sequence: each consecutive run of 2**m
+    points, starting at a multiple of 2**m, has exactly one point in each of
+    2**m equal intervals of each dimension.
+    """
+    def __init__(self, scramble=True, seed=None):
+        """
+        Arguments:
+        scramble - if True, randomize the sequence as described above.
+        seed - seed for the randomization, passed to numpy.random.RandomState.
+        """
+        self._scramble = scramble
+        self._prng = N.random.RandomState(seed)
+        self._index = 0
+        self._dims = 0
+        self._V = N.empty((0, _SOBOL_BITS), dtype=N.int64)
+        self._shift = N.empty(0, dtype=N.int64)
+
+    def _add_dimensions(self, dims):
+        """
+        Prepare the (possibly scrambled) direction numbers of dimensions not
+        yet used. Dimensions already used keep their randomization.
+        """
+        L = _SOBOL_BITS
+        V = sobol_direction_numbers(dims)[self._dims:]
+        shift = N.zeros(dims - self._dims, dtype=N.int64)
+
+        if self._scramble:
+            # Bit b of an integer is its b-th most significant bit.
+            powers = 1 << (L - 1 - N.arange(L))
+            for d in xrange(V.shape[0]):
+                M = N.tril(self._prng.randint(2, size=(L, L)), -1) + N.eye(L,
+                    dtype=N.int64)
+                bits = ((V[d][None,:] & powers[:,None]) != 0).astype(N.int64)
+                V[d] = N.dot(powers, N.dot(M, bits) % 2)
+            shift = N.dot(self._prng.randint(2, size=(len(shift), L)), powers)
+
+        self._V = N.vstack((self._V, V))
+        self._shift = N.hstack((self._shift, shift))
+        self._dims = dims
+
+    def __call__(self, num, dims):
+        """
+        Generate the next ``num`` points of the sequence.
+
+        Arguments:
+        num - number of points.
+        dims - number of dimensions of each point.
+
+        Returns:
+        a (dims, num) array of points in [0, 1).
+        """
+        if dims > self._dims:
+            self._add_dimensions(dims)
+
+        idx = N.arange(self._index, self._index + num, dtype=N.int64)
+        self._index += num
+
+        points = N.zeros((dims, num), dtype=N.int64)
+        for b in xrange(_SOBOL_BITS):
+            # Done when no index has this or any higher bit:
+            if not (idx >> b).any():
+                break
+            has_bit = ((idx >> b) & 1).astype(N.bool)
+            points[:,has_bit] ^= self._V[:dims,b][:,None]
+        points ^= self._shift[:dims,None]
+
+        return points/float(1 << _SOBOL_BITS)
+
+def radical_inverse(idx, base, perm=None):
+    """
+    Reflect the digits of integers in a given base around the radix point.
+
+    Arguments:
+    idx - an integer array.
+    base - the base in which to represent the integers.
+    perm - optionally, an array of length ``base`` with a permutation to
+        apply to each digit. perm[0] must be 0.
+
+    Returns:
+    a float array the same shape as ``idx``, with values in [0, 1).
+    """
+    idx = N.array(idx, dtype=N.int64)
+    res = N.zeros(idx.shape)
+    scale = 1./base
+    while (idx > 0).any():
+        digits = idx % base
+        if perm is not None:
+            digits = perm[digits]
+        res += digits*scale
+        idx //= base
+        scale /= base
+    return res
+
+class Halton(object):
+    """
+    The Halton sequence: dimension d is the radical inverse of the point
+    index in the d-th prime base. Optionally scrambled by a random
+    permutation of the nonzero digits in each dimension, and/or randomly
+    shifted modulo 1 (a Cranley-Patterson rotation).
+    """
+    def __init__(self, scramble=True, shift=False, seed=None):
+        """
+        Arguments:
+        scramble - if True, apply random digit permutations.
+        shift - if True, add a random shift to each dimension, modulo 1.
+        seed - seed for the randomization, passed to numpy.random.RandomState.
+        """
+        self._scramble = scramble
+        self._do_shift = shift
+        self._prng = N.random.RandomState(seed)
+        self._index = 0
+        self._perms = []
+        self._shifts = []
+
+    def _add_dimensions(self, dims):
+        if dims > len(_PRIMES):
+            raise ValueError("Halton sequence supports at most %d dimensions" \
+                % len(_PRIMES))
+
+        for d in xrange(len(self._perms), dims):
+            base = _PRIMES[d]
+            if self._scramble:
+                self._perms.append(
+                    N.r_[0, 1 + self._prng.permutation(base - 1)])
+            else:
+                self._perms.append(None)
+
+            if self._do_shift:
+                self._shifts.append(self._prng.uniform())
+            else:
+                self._shifts.append(0.)
+
+    def __call__(self, num, dims):
+        """
+        Generate the next ``num`` points of the sequence.
+
+        Arguments:
+        num - number of points.
+        dims - number of dimensions of each point.
+
+        Returns:
+        a (dims, num) array of points in [0, 1).
+        """
+        if dims > len(self._perms):
+            self._add_dimensions(dims)
+
+        # Skip the point at the origin, which unscrambled dimensions share.
+        idx = N.arange(self._index + 1, self._index + num + 1)
+        self._index += num
+
+        points = N.empty((dims, num))
+        for d in xrange(dims):
+            points[d] = radical_inverse(idx, _PRIMES[d], self._perms[d])
+        points += N.array(self._shifts[:dims])[:,None]
+        return points % 1.
+
+class LatinHypercube(object):
+    """
+    Stratified pseudo-random sampling: each call divides each dimension to
+    ``num`` equal strata and puts exactly one point in each, with the strata
+    of different dimensions paired by random permutations.
+    """
+    def __init__(self, seed=None):
+        """
+        Arguments:
+        seed - passed to numpy.random.RandomState.
+        """
+        self._prng = N.random.RandomState(seed)
+
+    def __call__(self, num, dims):
+        """
+        Generate ``num`` stratified points.
+
+        Arguments:
+        num - number of points.
+        dims - number of dimensions of each point.
+
+        Returns:
+        a (dims, num) array of points in [0, 1).
+        """
+        strata = N.empty((dims, num))
+        for d in xrange(dims):
+            strata[d] = self._prng.permutation(num)
+        return (strata + self._prng.uniform(size=(dims, num)))/num
+
+def replicate_error(estimates):
+    """
+    Combine independent estimates of the same quantity, e.g. the flux on a
+    receiver cell from traces using randomized samplers with different seeds.
+
+    Arguments:
+    estimates - an array whose first axis runs over the replicates.
+
+    Returns:
+    mean - the mean of the estimates along the first axis.
+    error - the standard error of that mean.
+    """
+    estimates = N.asarray(estimates, dtype=N.float64)
+    num = estimates.shape[0]
+    return estimates.mean(axis=0), estimates.std(axis=0, ddof=1)/N.sqrt(num)
@@ -5,6 +5,7 @@
 
 import numpy as N
 from geometry_manager import GeometryManager
+import kernels
 
 class QuadricGM(GeometryManager):
     """
@@ -55,26 +56,14 @@ class QuadricGM(GeometryManager):
         
         # Gets the relevant A, B, C from whichever quadric surface, see [1]  
         A, B, C = self.get_ABC(ray_bundle)
-        delta = B**2 - 4*A*C
+        hits = kernels.get_kernel('quadric_roots')(A, B, C)
         
-        any_inters = delta >= 0
-        num_inters = any_inters.sum()
-        if num_inters == 0:
+        any_inters = ~N.isnan(hits[0])
+        if not any_inters.any():
             self._vertices = vertices
             return params
         
-        A = A[any_inters]
-        B = B[any_inters]
-        C = C[any_inters]
-        delta = N.sqrt(delta[any_inters])
-        
-        pm = N.c_[[-1, 1]]
-        hits = N.empty((2, num_inters))
-        almost_planar = A <= 1e-10
-        really_quadric = ~almost_planar
-        hits[:,almost_planar] = N.tile(-C[almost_planar]/B[almost_planar], (2,1))
-        hits[:,really_quadric] = \
-            (-B[really_quadric] + pm*delta[really_quadric])/(2*A[really_quadric])
+        hits = hits[:,any_inters]
         inters_coords = v[:,any_inters] + d[:,any_inters]*hits.reshape(2,1,-1)
         
         # Quadrics can have two intersections. Here we allow child classes
@@ -109,20 +98,7 @@ class QuadricGM(GeometryManager):
         Returns:
         The index of the selected intersection, or None if neither will do.
         """
-        is_positive = prm > 0
-        select = N.empty(prm.shape[1])
-
-        # If both are negative, it is a miss
-        # This line also catches the cases of the last xor.
-        select[~N.logical_or(*is_positive)] = N.nan
-        
-        # If both are positive, use the smaller one
-        select[N.logical_and(*is_positive)] = 0
-        
-        # If either one is negative, use the positive one
-        one_pos = N.logical_xor(*is_positive)
-        select[one_pos] = N.nonzero(is_positive.T[one_pos,:])[1]
-        
+        select = kernels.get_kernel('quadric_select_positive')(prm)
         return select
         
     def select_rays(self, idxs):
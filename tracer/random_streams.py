@@ -0,0 +1,92 @@
+"""
+Reproducible streams of pseudo-random numbers, to be used instead of the
+global state of numpy.random by sources, stochastic optics managers and the
+tracer engine.
+
+A RandomStream is identified by a seed and a key - a tuple of integers. The
+stream with key () is the root stream of a seed; stream.spawn(i) gives the
+stream whose key is stream's key extended by i. Streams with different keys
+are independent, and a stream's numbers depend only on its seed and key, so
+e.g. the i-th chunk of a chunked trace can be drawn from root.spawn(i) by any
+process, in any order, with the same results.
+
+Example::
+
+    stream = RandomStream(1234)
+    source_stream = stream.spawn(0)   # for generating rays
+    optics_stream = stream.spawn(1)   # for the engine's stochastic optics
+"""
+
+import os
+import numpy as N
+
+class RandomStream(object):
+    """
+    A source of pseudo-random numbers with the drawing methods used by
+    Tracer (a subset of those of numpy.random.RandomState), which can spawn
+    independent substreams.
+    """
+    def __init__(self, seed=None, key=()):
+        """
+        Arguments:
+        seed - a nonnegative integer smaller than 2**32. If None, one is
+            taken from the operating system's entropy source; use get_seed()
+            to find it for reproducing the stream.
+        key - a tuple of nonnegative integers identifying the substream of
+            ``seed``. Usually left at its default, and substreams are made
+            using spawn().
+        """
+        if seed is None:
+            seed = int(N.frombuffer(os.urandom(4), dtype=N.uint32)[0])
+        self._seed = seed
+        self._key = tuple(key)
+        self._prng = N.random.RandomState([seed] + list(self._key))
+
+    def get_seed(self):
+        return self._seed
+
+    def get_key(self):
+        return self._key
+
+    def spawn(self, index):
+        """
+        Get an independent substream of this stream. The substream's numbers
+        do not depend on how many numbers were drawn from this stream.
+
+        Arguments:
+        index - a nonnegative integer identifying the substream.
+
+        Returns:
+        a new RandomStream.
+        """
+        return RandomStream(self._seed, self._key + (index,))
+
+    def uniform(self, low=0., high=1., size=None):
+        """Uniformly distributed floats, as in numpy.random.uniform."""
+        return self._prng.uniform(low, high, size)
+
+    def randint(self, low, high=None, size=None):
+        """Random integers, as in numpy.random.randint."""
+        return self._prng.randint(low, high, size)
+
+    def permutation(self, x):
+        """A random permutation, as in numpy.random.permutation."""
+        return self._prng.permutation(x)
+
+    def normal(self, loc=0., scale=1., size=None):
+        """Normally distributed floats, as in numpy.random.normal."""
+        return self._prng.normal(loc, scale, size)
+
+def as_stream(seed):
+    """
+    Convert a seed argument to a RandomStream.
+
+    Arguments:
+    seed - a RandomStream (returned as is), an integer seed, or None.
+
+    Returns:
+    a RandomStream.
+    """
+    if isinstance(seed, RandomStream):
+        return seed
+    return RandomStream(seed)
@@ -178,7 +178,7 @@ class RayBundle:
         empty.set_directions(empty_array)
         empty.set_vertices(empty_array)
         empty.set_energy(N.array([]))
-        empty.set_parents(N.array([]))
+        empty.set_parents(N.array([], dtype=N.int))
         empty.set_ref_index(N.array([]))
         return empty
 
@@ -199,11 +199,15 @@ def concatenate_rays(bundles):
     
     Arguments:
     bundles - a list of RayBundle objects, all with the same set of attributes
-        set.
+        set. Bundles with no rays may lack some of the attributes (e.g. those
+        from RayBundle.empty_bund()), and are skipped.
     
     Returns:
     A RayBundle object with all attributes that are set in the first bundle.
     """
+    nonempty = [b for b in bundles if b.get_num_rays() > 0]
+    if len(nonempty) > 0:
+        bundles = nonempty
     if len(bundles) == 0:
         return RayBundle.empty_bund()
     
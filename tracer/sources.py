@@ -12,8 +12,9 @@ import numpy as N
 
 from .ray_bundle import RayBundle
 from .spatial_geometry import rotation_to_z
+from .random_streams import as_stream
 
-def pillbox_sunshape_directions(num_rays, ang_range):
+def pillbox_sunshape_directions(num_rays, ang_range, sampler=None, prng=None):
     """
     Calculates directions for a ray bundles with ``num_rays`` rays, distributed
     as a pillbox sunshape shining toward the +Z axis, and deviating from it by
@@ -23,21 +24,40 @@ def pillbox_sunshape_directions(num_rays, ang_range):
     Arguments:
     num_rays - number of rays to generate directions for.
     ang_range - in radians, the maximum deviation from +Z.
+    sampler - optionally, a sampler from tracer.qmc (or any callable with
+        the same signature) to use instead of numpy.random.
+    prng - optionally, a tracer.random_streams.RandomStream or a
+        numpy.random.RandomState to draw from instead of the global
+        numpy.random generator. Not used if a sampler is given.
     
     Returns:
     A (3, num_rays) array whose each column is a unit direction vector for one
         ray, distributed to match a pillbox sunshape.
     """
+    if sampler is None:
+        if prng is None:
+            prng = random
+        xi1 = prng.uniform(size=num_rays)
+        xi2 = prng.uniform(size=num_rays)
+    else:
+        xi1, xi2 = sampler(num_rays, 2)
+    return _pillbox_directions(xi1, xi2, ang_range)
+
+def _pillbox_directions(xi1, xi2, ang_range):
+    """
+    Map two uniformly distributed variables in [0,1) to pillbox-sunshape
+    directions around +Z, see pillbox_sunshape_directions().
+    """
     # Diffuse divergence from +Z:
     # development bassed on eq. 2.12  from [1]
-    xi1 = random.uniform(high=2*N.pi, size=num_rays)
-    xi2 = random.uniform(size=num_rays)
+    phi = 2*N.pi*xi1
     theta = N.arcsin(N.sin(ang_range)*N.sqrt(xi2))
     sin_th = N.sin(theta)
-    a = N.vstack((N.cos(xi1)*sin_th, N.sin(xi1)*sin_th , N.cos(theta)))
+    a = N.vstack((N.cos(phi)*sin_th, N.sin(phi)*sin_th , N.cos(theta)))
     return a
 
-def solar_disk_bundle(num_rays,  center,  direction,  radius,  ang_range, flux=None):
+def solar_disk_bundle(num_rays,  center,  direction,  radius,  ang_range,
+        flux=None, sampler=None, sunshape=None, prng=None):
     """
     Generates a ray bundle emanating from a disk, with each surface element of 
     the disk having the same ray density. The rays all point at directions uniformly 
@@ -53,11 +73,31 @@ def solar_disk_bundle(num_rays,  center,  direction,  radius,  ang_range, flux=N
     ang_range - in radians, the maximum deviation from <direction>.
     flux - if not None, the ray bundle's energy is set such that each ray has
         an equal amount of energy, and the total energy is flux*pi*radius**2
+    sampler - optionally, a sampler from tracer.qmc (or any callable with
+        the same signature) to use instead of numpy.random. Directions and
+        locations are then taken together from 4D points of the sampler.
+    sunshape - optionally, a TabulatedSunshape (see tracer.sunshape) to draw
+        directions from instead of the pillbox sunshape. ang_range is then
+        ignored.
+    prng - optionally, a tracer.random_streams.RandomStream or a
+        numpy.random.RandomState to draw from instead of the global
+        numpy.random generator. Not used if a sampler is given.
     
     Returns: 
     A RayBundle object with the above charachteristics set.
     """
-    a = pillbox_sunshape_directions(num_rays, ang_range)
+    if sampler is None:
+        if prng is None:
+            prng = random
+        samples = prng.uniform(size=(4, num_rays))
+    else:
+        samples = sampler(num_rays, 4)
+    
+    if sunshape is None:
+        a = _pillbox_directions(samples[0], samples[1], ang_range)
+    else:
+        a = sunshape.map_directions(samples[0], samples[1])
+    xi1, xi2 = samples[2:]
     
     # Rotate to a frame in which <direction> is Z:
     perp_rot = rotation_to_z(direction)
@@ -65,8 +105,7 @@ def solar_disk_bundle(num_rays,  center,  direction,  radius,  ang_range, flux=N
 
     # Locations:
     # See [1]
-    xi1 = random.uniform(size=num_rays)
-    thetas = random.uniform(high=2*N.pi, size=num_rays)
+    thetas = 2*N.pi*xi2
     rs = radius*N.sqrt(xi1)
     xs = rs * N.cos(thetas)
     ys = rs * N.sin(thetas)
@@ -81,6 +120,269 @@ def solar_disk_bundle(num_rays,  center,  direction,  radius,  ang_range, flux=N
     
     return rayb
 
+def transverse_bundle(num_rays, center, direction, width, ang_range, axis,
+        flux=None, sampler=None, sunshape=None, prng=None):
+    """
+    Generates a ray bundle for the translation-invariant (2.5D) mode of
+    tracing collectors extruded along an axis (see tracer.extruded). The
+    rays start evenly along a line segment perpendicular to the axis and to
+    the bundle's direction, so they all start at the same axial position.
+    
+    Arguments:
+    num_rays - number of rays to generate.
+    center - a column 3-array with the 3D coordinate of the segment's center.
+    direction - a 1D 3-array with the unit average direction vector for the
+        bundle. It may not be parallel to the axis.
+    width - of the segment.
+    ang_range - in radians, the maximum deviation from <direction>.
+    axis - a 1D 3-array, the unit vector along the collector's axis.
+    flux - if not None, the ray bundle's energy is set such that each ray has
+        an equal amount of energy, and the total energy is that of the beam
+        crossing the collector's cross section along the segment, per unit
+        of the collector's length.
+    sampler - optionally, a sampler from tracer.qmc (or any callable with
+        the same signature) to use instead of numpy.random. Directions and
+        locations are then taken together from 3D points of the sampler.
+    sunshape - optionally, a TabulatedSunshape (see tracer.sunshape) to draw
+        directions from instead of the pillbox sunshape. ang_range is then
+        ignored.
+    prng - optionally, a tracer.random_streams.RandomStream or a
+        numpy.random.RandomState to draw from instead of the global
+        numpy.random generator. Not used if a sampler is given.
+    
+    Returns: 
+    A RayBundle object with the above charachteristics set.
+    """
+    if sampler is None:
+        if prng is None:
+            prng = random
+        samples = prng.uniform(size=(3, num_rays))
+    else:
+        samples = sampler(num_rays, 3)
+    
+    if sunshape is None:
+        a = _pillbox_directions(samples[0], samples[1], ang_range)
+    else:
+        a = sunshape.map_directions(samples[0], samples[1])
+    perp_rot = rotation_to_z(direction)
+    directions = N.sum(perp_rot[...,None] * a[None,...], axis=1)
+    
+    line = N.cross(axis, direction)
+    axial_cos = LA.norm(line)
+    line /= axial_cos
+    vertices = center + line[:,None]*(samples[2] - 0.5)*width
+    
+    rayb = RayBundle(vertices=vertices, directions=directions)
+    if flux is not None:
+        rayb.set_energy(width*axial_cos/num_rays*flux*N.ones(num_rays))
+    
+    return rayb
+
+def solar_disk_bundle_chunks(num_rays, chunk_size, center, direction, radius,
+        ang_range, flux, sampler=None, sunshape=None, seed=None):
+    """
+    A generator of ray bundles which together have the distribution of one
+    bundle from solar_disk_bundle(), to be traced one at a time (see
+    TracerEngine.ray_tracer()) so that memory use depends on the chunk size
+    rather than on the total number of rays.
+    
+    Each ray carries the energy it would have had in the full bundle, so
+    the total energy of all chunks is flux*pi*radius**2. Chunk i is drawn
+    from the substream i of the random stream given by ``seed`` (see
+    tracer.random_streams), so chunks are independent, and any of them can be
+    regenerated alone, e.g. by a parallel worker.
+    
+    Arguments:
+    num_rays - total number of rays in all chunks.
+    chunk_size - maximal number of rays in one chunk.
+    center, direction, radius, ang_range, sampler, sunshape - as in
+        solar_disk_bundle(). A sampler's sequence continues from chunk to
+        chunk.
+    flux - the energy per unit area of the disk.
+    seed - an integer seed or a RandomStream. If None, a seed is drawn from
+        numpy.random.
+    
+    Yields:
+    RayBundle objects of at most chunk_size rays each.
+    """
+    if seed is None:
+        seed = random.randint(2**31)
+    stream = as_stream(seed)
+    ray_energy = flux*N.pi*radius**2/num_rays
+    
+    for chunk, start in enumerate(xrange(0, num_rays, chunk_size)):
+        size = min(chunk_size, num_rays - start)
+        rayb = solar_disk_bundle(size, center, direction, radius, ang_range,
+            sampler=sampler, sunshape=sunshape, prng=stream.spawn(chunk))
+        rayb.set_energy(N.ones(size)*ray_energy)
+        yield rayb
+
+def chunk_prng(seed, chunk):
+    """
+    Get the pseudo-random stream for one chunk of a chunked source.
+    
+    Arguments:
+    seed - the source's integer seed or RandomStream.
+    chunk - the chunk's index.
+    
+    Returns:
+    a RandomStream whose state depends on both arguments.
+    """
+    return as_stream(seed).spawn(chunk)
+
+def rect_apertures_bundle(surfaces, rays_per_surf, direction, ang_range, flux,
+        sampler=None, sunshape=None, prng=None):
+    """
+    Generates a ray bundle aimed directly at a set of rectangular surfaces
+    (e.g. the heliostats of a field), so that no rays are wasted on the space
+    between them. Each surface gets the same number of rays, whose origins
+    are distributed uniformly over its aperture as seen from the source,
+    with the directions of a sunshape around <direction>.
+    
+    All rays start on a plane perpendicular to <direction>, beyond all of the
+    surfaces, so that shading of one surface by another is traced. Where the
+    apertures of several surfaces overlap as seen from the source, each of
+    them samples the same incoming light, so the energy of rays passing
+    through k apertures is divided by k.
+    
+    Arguments:
+    surfaces - a list of Surface objects whose geometry managers are
+        RectPlateGM instances. Their global transforms (see
+        HasFrame.get_global_transform()) must be up to date.
+    rays_per_surf - number of rays aimed at each surface.
+    direction - a 1D 3-array with the unit average direction of the rays.
+    ang_range - in radians, the maximum deviation from <direction>.
+    flux - the energy per unit area perpendicular to <direction>.
+    sampler, sunshape, prng - as in solar_disk_bundle().
+    
+    Returns:
+    A RayBundle object with the rays aimed at each surface in order, and
+        their energy set such that each surface receives the energy of the
+        light incident on its projected area.
+    """
+    frames = N.array([surf.get_global_transform() for surf in surfaces])
+    half_dims = N.array([surf.get_geometry_manager().get_half_dims() \
+        for surf in surfaces])
+    return rects_bundle(frames, half_dims, rays_per_surf, direction,
+        ang_range, flux, sampler, sunshape, prng)
+
+def rects_bundle(frames, half_dims, rays_per_surf, direction, ang_range,
+        flux, sampler=None, sunshape=None, prng=None):
+    """
+    Like rect_apertures_bundle(), with the rectangles given by their frames
+    and sizes instead of as surfaces, e.g. the instances of an InstancedGM.
+    
+    Arguments:
+    frames - an (s,4,4) array, the global frame of each rectangle, which is
+        centered on the origin of the frame's XY plane.
+    half_dims - an (s,2) array, the half-extents of each rectangle along
+        its local x and y axes.
+    rays_per_surf, direction, ang_range, flux, sampler, sunshape, prng - as
+        in rect_apertures_bundle().
+    
+    Returns:
+    A RayBundle object, see rect_apertures_bundle().
+    """
+    num_surfs = frames.shape[0]
+    num_rays = num_surfs*rays_per_surf
+    
+    if sampler is None:
+        if prng is None:
+            prng = random
+        samples = prng.uniform(size=(4, num_rays))
+    else:
+        samples = sampler(num_rays, 4)
+    
+    if sunshape is None:
+        a = _pillbox_directions(samples[0], samples[1], ang_range)
+        max_ang = ang_range
+    else:
+        a = sunshape.map_directions(samples[0], samples[1])
+        max_ang = sunshape.get_max_angle()
+    perp_rot = rotation_to_z(direction)
+    directions = N.dot(perp_rot, a)
+    
+    # Target points on each surface:
+    surf_idx = N.repeat(N.arange(num_surfs), rays_per_surf)
+    local = (2*samples[2:] - 1)*half_dims[surf_idx].T
+    targets = frames[surf_idx,:3,3].T + frames[surf_idx,:3,0].T*local[0] + \
+        frames[surf_idx,:3,1].T*local[1]
+    
+    # Back off to the starting plane:
+    heights = N.dot(-direction, targets)
+    start = N.max(N.dot(-direction, frames[:,:3,3].T)) + \
+        N.max(N.sqrt(N.sum(half_dims**2, axis=1))) 
+    dists = (start - heights)/N.dot(direction, directions)
+    vertices = targets - dists*directions
+    
+    proj_area = 4*N.prod(half_dims, axis=1)*abs(N.dot(frames[:,:3,2], direction))
+    overlaps = _aperture_overlaps(targets, directions, frames, half_dims,
+        rays_per_surf, perp_rot, max_ang)
+    energy = flux*proj_area[surf_idx]/rays_per_surf/overlaps
+    
+    return RayBundle(vertices=vertices, directions=directions, energy=energy)
+
+def _aperture_overlaps(targets, directions, frames, half_dims, rays_per_surf,
+        perp_rot, max_ang):
+    """
+    Count for each ray of rect_apertures_bundle() the number of rectangular
+    apertures its line passes through (at least the one it is aimed at).
+    Only pairs of surfaces whose bounding circles may overlap as seen from
+    the source are checked; those are found by binning the projected
+    surface centers on a grid.
+    
+    Arguments:
+    targets, directions - 3 by n arrays, the target point of each ray and
+        its direction.
+    frames, half_dims - the global transform and half-extents of each
+        rectangle, as (s,4,4) and (s,2) arrays.
+    rays_per_surf - number of consecutive rays aimed at each rectangle.
+    perp_rot - a rotation into a frame whose Z is the source's direction.
+    max_ang - the largest angle of a ray from the source's direction.
+    
+    Returns:
+    an integer array with the number of apertures hit by each ray's line.
+    """
+    num_surfs = frames.shape[0]
+    overlaps = N.ones(targets.shape[1], dtype=N.int_)
+    
+    proj = N.dot(perp_rot.T, frames[:,:3,3].T)
+    radii = N.sqrt(N.sum(half_dims**2, axis=1))
+    slack = (proj[2].max() - proj[2].min())*N.tan(max_ang)
+    cell_size = 2*radii.max() + slack
+    cells = N.floor(proj[:2]/cell_size).astype(N.int_).T
+    
+    bins = {}
+    for surf, cell in enumerate(cells):
+        bins.setdefault(tuple(cell), []).append(surf)
+    
+    for surf, cell in enumerate(cells):
+        neighbours = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                neighbours.extend(bins.get((cell[0] + dx, cell[1] + dy), []))
+        
+        rays = slice(surf*rays_per_surf, (surf + 1)*rays_per_surf)
+        for other in neighbours:
+            if other == surf:
+                continue
+            if N.sum((proj[:2,surf] - proj[:2,other])**2) > \
+                    (radii[surf] + radii[other] + slack)**2:
+                continue
+            
+            # Intersect the rays' lines with the other rectangle:
+            frame = frames[other]
+            dt = N.dot(frame[:3,2], directions[:,rays])
+            oldsettings = N.seterr(divide='ignore', invalid='ignore')
+            t = N.dot(frame[:3,2], frame[:3,3][:,None] - targets[:,rays])/dt
+            hit = targets[:,rays] + t*directions[:,rays] - frame[:3,3][:,None]
+            inside = (abs(N.dot(frame[:3,0], hit)) <= half_dims[other,0]) & \
+                (abs(N.dot(frame[:3,1], hit)) <= half_dims[other,1])
+            N.seterr(**oldsettings)
+            overlaps[rays] += inside
+    
+    return overlaps
+
 def square_bundle(num_rays, center, direction, width):
     """
     Generate a ray bundles whose rays are equally spaced along a square grid,
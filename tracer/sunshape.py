@@ -0,0 +1,208 @@
+"""
+Radially-symmetric sunshapes given as tabulated profiles, for use with
+tracer.sources.solar_disk_bundle as an alternative to the pillbox sunshape.
+
+A sunshape is described by the radiance of the sky as a function of the
+angular distance from the center of the sun. Directions are drawn from it by
+inverting its cumulative distribution over the solid angle, using a lookup
+table that is calculated once when the sunshape is created. Sunshapes created
+by buie_sunshape() and load_sunshape() are cached, so repeated calls with the
+same arguments reuse the lookup table.
+
+References:
+.. [1] D. Buie, A. G. Monger, C. J. Dey, Sunshape distributions for
+   terrestrial solar simulations, Solar Energy 74, 113-122 (2003).
+"""
+
+import os
+import numpy as N
+
+# Module-level cache of sunshapes, keyed by the arguments creating them.
+_cache = {}
+
+_angle_units = {'rad': 1., 'mrad': 1e-3, 'deg': N.pi/180.}
+
+class TabulatedSunshape(object):
+    """
+    A sunshape defined by radiance values at increasing angles from the
+    sun's center. The radiance is linearly interpolated between the given
+    angles, and is zero beyond the last one.
+    """
+    def __init__(self, theta, radiance, table_size=4096):
+        """
+        Arguments:
+        theta - a 1D array of increasing angles from the sun's center, in
+            radians. The first should be 0.
+        radiance - a 1D array, the relative radiance at each angle in theta.
+        table_size - number of entries in the inverse-CDF lookup table.
+        """
+        theta = N.asarray(theta, dtype=N.float64)
+        radiance = N.asarray(radiance, dtype=N.float64)
+        if theta.ndim != 1 or theta.shape != radiance.shape:
+            raise ValueError("Angles and radiance must be 1D arrays " + \
+                "of the same length")
+        if N.any(N.diff(theta) <= 0):
+            raise ValueError("Sunshape angles must be increasing")
+        if N.any(radiance < 0):
+            raise ValueError("Sunshape radiance must not be negative")
+
+        self._theta = theta
+        self._radiance = radiance
+
+        # Integrate the radiance over solid angle on a fine grid, where
+        # linear interpolation of the CDF is accurate:
+        fine = N.linspace(theta[0], theta[-1], 4*table_size)
+        density = N.interp(fine, theta, radiance)*N.sin(fine)
+        cdf = N.hstack((0, N.cumsum(
+            (density[1:] + density[:-1])/2.*N.diff(fine))))
+        if cdf[-1] <= 0:
+            raise ValueError("Sunshape radiance integrates to zero")
+        cdf /= cdf[-1]
+
+        # Invert on a uniform grid of the CDF:
+        self._inv_cdf = N.interp(N.linspace(0, 1, table_size), cdf, fine)
+
+    def get_max_angle(self):
+        """The largest angle from the sun's center with nonzero radiance."""
+        last = N.nonzero(self._radiance)[0][-1]
+        return self._theta[min(last + 1, len(self._theta) - 1)]
+
+    def get_profile(self):
+        """
+        Returns:
+        theta, radiance - the tabulated profile, as given to the constructor.
+        """
+        return self._theta, self._radiance
+
+    def angles(self, xi):
+        """
+        Map uniformly distributed values to angles from the sun's center
+        distributed according to the sunshape, using the lookup table.
+
+        Arguments:
+        xi - an array of values in [0, 1].
+
+        Returns:
+        an array the same shape as xi, with angles in radians.
+        """
+        pos = xi*(len(self._inv_cdf) - 1)
+        idx = N.minimum(pos.astype(N.int_), len(self._inv_cdf) - 2)
+        frac = pos - idx
+        return self._inv_cdf[idx]*(1 - frac) + self._inv_cdf[idx + 1]*frac
+
+    def map_directions(self, xi1, xi2):
+        """
+        Map two arrays of uniformly distributed values in [0,1) to directions
+        around +Z distributed according to the sunshape.
+
+        Arguments:
+        xi1 - determines the azimuth around +Z.
+        xi2 - determines the angle from +Z.
+
+        Returns:
+        A (3, n) array of unit direction vectors.
+        """
+        phi = 2*N.pi*xi1
+        theta = self.angles(xi2)
+        sin_th = N.sin(theta)
+        return N.vstack((N.cos(phi)*sin_th, N.sin(phi)*sin_th, N.cos(theta)))
+
+    def directions(self, num_rays, sampler=None, prng=None):
+        """
+        Draw directions around +Z from the sunshape, like
+        tracer.sources.pillbox_sunshape_directions().
+
+        Arguments:
+        num_rays - number of directions to draw.
+        sampler - optionally, a sampler from tracer.qmc to use instead of
+            numpy.random.
+        prng - when no sampler is given, the source of random numbers: a
+            tracer.random_streams.RandomStream or numpy RandomState. Default
+            is numpy.random's global state.
+
+        Returns:
+        A (3, num_rays) array of unit direction vectors.
+        """
+        if sampler is None:
+            if prng is None:
+                prng = N.random
+            xi1 = prng.uniform(size=num_rays)
+            xi2 = prng.uniform(size=num_rays)
+        else:
+            xi1, xi2 = sampler(num_rays, 2)
+        return self.map_directions(xi1, xi2)
+
+def buie_profile(csr, theta):
+    """
+    The radiance profile of the Buie sunshape model [1].
+
+    Arguments:
+    csr - the circumsolar ratio, the fraction of the total radiance which
+        comes from outside the solar disk.
+    theta - an array of angles from the sun's center, in radians.
+
+    Returns:
+    an array with the relative radiance at each angle.
+    """
+    theta = N.asarray(theta)*1e3 # The model is in milliradians.
+    kappa = 0.9*N.log(13.5*csr)*csr**-0.3
+    gamma = 2.2*N.log(0.52*csr)*csr**0.43 - 0.1
+
+    radiance = N.zeros(theta.shape)
+    disk = theta <= 4.65
+    radiance[disk] = N.cos(0.326*theta[disk])/N.cos(0.308*theta[disk])
+    aureole = (theta > 4.65) & (theta <= 43.6)
+    radiance[aureole] = N.exp(kappa)*theta[aureole]**gamma
+    return radiance
+
+def buie_sunshape(csr, num_points=1000, table_size=4096):
+    """
+    Get the Buie sunshape [1] of a given circumsolar ratio, up to the
+    model's maximal angle of 43.6 mrad.
+
+    Arguments:
+    csr - the circumsolar ratio, in (0, 1).
+    num_points - number of angles at which the profile is tabulated.
+    table_size - passed on to TabulatedSunshape.
+
+    Returns:
+    a TabulatedSunshape instance, shared by calls with the same arguments.
+    """
+    if not 0 < csr < 1:
+        raise ValueError("Circumsolar ratio must be between 0 and 1")
+
+    key = ('buie', csr, num_points, table_size)
+    if key not in _cache:
+        # Make sure the disk edge is in the table, it is discontinuous.
+        theta = N.union1d(N.linspace(0, 43.6e-3, num_points),
+            N.r_[4.65e-3, 4.65e-3 + 1e-9])
+        _cache[key] = TabulatedSunshape(theta, buie_profile(csr, theta),
+            table_size)
+    return _cache[key]
+
+def load_sunshape(filename, angle_units='mrad', table_size=4096):
+    """
+    Read a measured sunshape from a text file of two columns: the angle from
+    the sun's center, and the radiance at that angle. Lines starting with #
+    are ignored.
+
+    Arguments:
+    filename - path to the file.
+    angle_units - one of 'rad', 'mrad', 'deg': the units of the first column.
+    table_size - passed on to TabulatedSunshape.
+
+    Returns:
+    a TabulatedSunshape instance, shared by calls with the same arguments
+        as long as the file is not modified.
+    """
+    if angle_units not in _angle_units:
+        raise ValueError("Unknown angle units %s" % angle_units)
+
+    filename = os.path.abspath(filename)
+    key = ('file', filename, os.path.getmtime(filename), angle_units,
+        table_size)
+    if key not in _cache:
+        table = N.loadtxt(filename, ndmin=2)
+        _cache[key] = TabulatedSunshape(table[:,0]*_angle_units[angle_units],
+            table[:,1], table_size)
+    return _cache[key]
@@ -8,24 +8,33 @@
 
 import numpy as N
 from has_frame import HasFrame
+from hit_record import HitRecord
+from ray_bundle import RayBundle, concatenate_rays
 
 class Surface(HasFrame):
     """
     Defines the base of surfaces that interact with rays.
     """
-    def __init__(self, geometry, optics, location=None, rotation=None):
+    def __init__(self, geometry, optics, location=None, rotation=None,
+            back_optics=None):
         """
         Arguments:
         geometry - a GeometryManager object responsible for finding ray 
             intersections with the surface.
-        optics - a callable that gets the geometry manageri, bundle and
-            selector, and returns the outgoing ray bundle generated by the
-            geometry and bundle.
+        optics - a callable that gets a HitRecord (see tracer.hit_record)
+            describing the rays hitting the surface, and returns the outgoing
+            ray bundle generated by the hits.
         location, rotation - passed directly to the HasFrame constructor.
+        back_optics - optionally, an optics callable like ``optics``, for the
+            rays hitting the surface from its back side. The geometry manager
+            must then implement get_backside(), and ``optics`` only gets the
+            rays hitting the front side. If None (the default), ``optics``
+            handles both sides.
         """
         HasFrame.__init__(self, location, rotation)
         self._geom = geometry
         self._opt = optics
+        self._back_opt = back_optics
         
     def get_optics_manager(self):
         """
@@ -34,6 +43,13 @@ class Surface(HasFrame):
         """
         return self._opt
     
+    def get_back_optics_manager(self):
+        """
+        Returns the optics-manager callable of the back side, or None if the
+        front optics manager handles both sides.
+        """
+        return self._back_opt
+    
     def get_geometry_manager(self):
         """
         Returns the geometry-manager instance. May be useful for introspection.
@@ -70,17 +86,55 @@ class Surface(HasFrame):
         self._selected = idxs
         self._geom.select_rays(idxs)
     
-    def get_outgoing(self):
+    def is_terminal(self):
+        """
+        Checks whether the surface absorbs all incoming rays without
+        generating outgoing rays, as reported by the optics managers'
+        is_terminal() method. Optics managers that don't have one are not
+        terminal. A two-sided surface is terminal only if both sides are.
+        """
+        for optics in (self._opt, self._back_opt):
+            if optics is None:
+                continue
+            if not (hasattr(optics, 'is_terminal') and optics.is_terminal()):
+                return False
+        return True
+    
+    def get_outgoing(self, prng=None):
         """
         Generates a new ray bundle, which is the reflections/refractions of the
         user-selected rays out of the incoming ray-bundle that was previously
-        registered.
+        registered. If the surface has back-side optics, each side's optics
+        manager generates the outgoing rays for the hits on that side, and
+        the results are concatenated.
+        
+        Arguments:
+        prng - optionally, a RandomStream for stochastic optics managers to
+            draw from, passed to them in the HitRecord.
         
         Returns: 
         a RayBundle object with the new bundle, with vertices on the surface
             and directions according to optics laws.
         """
-        return self._opt(self._geom, self._current_bundle, self._selected)
+        hits = HitRecord(self._geom, self._current_bundle, self._selected,
+            prng=prng)
+        if self._back_opt is None:
+            return self._opt(hits)
+        
+        backside = self._geom.get_backside()
+        outg = []
+        for optics, side in ((self._opt, ~backside), (self._back_opt, backside)):
+            if not side.any():
+                continue
+            side_outg = optics(hits.subset(N.nonzero(side)[0]))
+            if side_outg.get_num_rays() > 0:
+                outg.append(side_outg)
+        
+        if len(outg) == 0:
+            return RayBundle.empty_bund()
+        if len(outg) == 1:
+            return outg[0]
+        return concatenate_rays(outg)
     
     def done(self):
         """
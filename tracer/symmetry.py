@@ -0,0 +1,135 @@
+"""
+Tracing axisymmetric collectors as a wedge. A collector whose surfaces -
+e.g. a parabolic dish and a round receiver on its axis - are symmetric under
+reflection about any plane through its axis, lit by a source that is also
+symmetric (the sun on the axis), need only be traced in a sector of angle
+2*pi/order around the axis: rays reaching the sector's boundaries are
+reflected back into it by perfect mirrors, exactly as the collector's other
+sectors would have sent rays in. The sector's flux is then the collector's
+flux, folded. Radial flux profiles are reconstructed from it with
+radial_flux(), for order times fewer rays than a full trace needs for the
+same accuracy.
+
+A collector that is only symmetric under reflection about some planes, such
+as a hexagonal dish, may be traced the same way with a sector bounded by
+two of its planes of symmetry (order 6 for a hexagon, with the first plane
+along the local X axis).
+
+See Assembly.set_symmetry() for declaring the symmetry of an assembly, and
+sector_bundle() for the matching source.
+"""
+
+import numpy as N
+from numpy import random
+
+from .flat_surface import RectPlateGM
+from .surface import Surface
+from .object import AssembledObject
+from .ray_bundle import RayBundle
+from .spatial_geometry import rotx, rotz, translate
+from .sources import _pillbox_directions
+from . import optics_callables as opt
+
+def sector_walls(order, radius, z_range):
+    """
+    Create the boundaries of a sector around the local Z axis, as two
+    two-sided perfect mirrors. The first lies on the XZ plane at positive X,
+    the second is rotated from it by 2*pi/order around the Z axis.
+
+    Arguments:
+    order - the number of sectors in a full circle.
+    radius - the extent of the walls away from the axis.
+    z_range - a 2-sequence, the lowest and highest Z coordinate the walls
+        reach.
+
+    Returns:
+    an AssembledObject whose two surfaces are the walls.
+    """
+    if radius is None or radius <= 0:
+        raise ValueError("The walls' radius must be positive")
+    z_min, z_max = z_range
+    if z_max <= z_min:
+        raise ValueError("The walls' Z range must be increasing")
+
+    # A plate's local Y is turned to the Z axis, its width set along X:
+    to_wall = N.dot(translate(radius/2., 0., (z_min + z_max)/2.), rotx(N.pi/2))
+    walls = []
+    for ang in (0., 2*N.pi/order):
+        wall = Surface(RectPlateGM(radius, z_max - z_min), opt.perfect_mirror)
+        wall.set_transform(N.dot(rotz(ang), to_wall))
+        walls.append(wall)
+    return AssembledObject(surfs=walls)
+
+def sector_bundle(assembly, num_rays, height, radius, ang_range, flux=None,
+        prng=None):
+    """
+    Generate a ray bundle emanating from the sector of a disk declared by an
+    assembly's symmetry, with the same ray density as a solar_disk_bundle()
+    on the full disk. The disk is centered on the assembly's local Z axis,
+    and the rays point down that axis within a pillbox sunshape.
+
+    Arguments:
+    assembly - an Assembly with a declared symmetry (see
+        Assembly.set_symmetry()). Its transform is taken as its frame in
+        global coordinates, i.e. the assembly is not nested in another.
+    num_rays - number of rays to generate.
+    height - the Z coordinate of the disk in the assembly's frame.
+    radius - of the disk.
+    ang_range - in radians, the maximum deviation from the -Z direction.
+    flux - if not None, the ray bundle's energy is set such that each ray has
+        an equal amount of energy, and the total energy is
+        flux*pi*radius**2/order
+    prng - optionally, a numpy.random.RandomState or a
+        tracer.random_streams.RandomStream to draw from instead of the
+        global numpy.random generator.
+
+    Returns:
+    A RayBundle object with the above characteristics set.
+    """
+    order = assembly.get_symmetry()
+    if order is None:
+        raise ValueError("The assembly has no declared symmetry")
+    if prng is None:
+        prng = random
+    samples = prng.uniform(size=(4, num_rays))
+
+    a = _pillbox_directions(samples[0], samples[1], ang_range)
+    a[2] *= -1
+
+    thetas = 2*N.pi/order*samples[3]
+    rs = radius*N.sqrt(samples[2])
+    vertices = N.vstack((rs*N.cos(thetas), rs*N.sin(thetas),
+        N.tile(height, num_rays)))
+
+    frame = assembly.get_transform()
+    rayb = RayBundle(vertices=N.dot(frame[:3,:3], vertices) + \
+        frame[:3,3][:,None], directions=N.dot(frame[:3,:3], a))
+    if flux is not None:
+        rayb.set_energy(N.pi*radius**2/order/num_rays*flux*N.ones(num_rays))
+    return rayb
+
+def radial_flux(energy, hits, frame, order, r_max, bins=50):
+    """
+    Reconstruct the radial flux profile of a full collector from the hits
+    on its receiver in a traced sector. The hits are binned by their
+    distance from the receiver's axis, and each bin's energy is multiplied
+    by the number of sectors and divided by the area of its ring.
+
+    Arguments:
+    energy - the energy absorbed at each hit.
+    hits - a 3 by n array, the global coordinates of the hits.
+    frame - a 4x4 homogenous transformation matrix whose local Z axis is the
+        receiver's axis of symmetry.
+    order - the number of sectors in the full collector, 1 for a full trace.
+    r_max - the outer radius of the outermost bin.
+    bins - number of rings between the axis and r_max.
+
+    Returns:
+    flux - the mean flux over each ring.
+    edges - the bins' radii, an array one longer than flux.
+    """
+    local = N.dot(N.linalg.inv(frame), N.vstack((hits, N.ones(hits.shape[1]))))
+    rs = N.sqrt(N.sum(local[:2]**2, axis=0))
+
+    H, edges = N.histogram(rs, bins=bins, range=(0., r_max), weights=energy)
+    return order*H/(N.pi*(edges[1:]**2 - edges[:-1]**2)), edges
@@ -76,7 +76,7 @@ class TracerEngine():
         
         return stack, owned_rays
 
-    def ray_tracer(self, bundle, reps, min_energy, tree=True):
+    def ray_tracer(self, bundle, reps, min_energy, tree=True, prng=None):
         """
         Creates a ray bundle or uses a reflected ray bundle, and intersects it
         with all objects, uses intersect_ray(). Based on the intersections,
@@ -84,13 +84,21 @@ class TracerEngine():
         reflects or refracts off any surfaces.
         
         Arguments:
-        bundle - the initial incoming bundle
+        bundle - the initial incoming bundle, or an iterable of bundles (e.g.
+            a generator from tracer.sources) each traced in turn. In the
+            latter case only the last bundle's tree is kept, and the arrays
+            returned are concatenated over all bundles.
         reps - stop iteration after this many ray bundles were generated (i.e. 
             after the original rays intersected some surface this many times).
         min_energy - the minimum energy the rays have to have continue tracking
             them; rays with a lower energy are discarded. A float.
         tree - if True, register each bundle in self.tree, otherwise only
             register the last bundle.
+        prng - optionally, a tracer.random_streams.RandomStream for the
+            stochastic optics managers to draw from, instead of the global
+            numpy.random generator. When tracing an iterable of bundles, the
+            i-th bundle is traced with the substream prng.spawn(i), so its
+            results do not depend on the bundles traced before it.
         
         Returns: 
         A tuple containing an array of vertices and an array of the the direcitons
@@ -98,8 +106,13 @@ class TracerEngine():
         intersection points of the previous incoming bundle)
         
         NB: the order of the rays within the arrays may change, but they are tracked
-        by the ray tree
+        by the ray tree. Rays hitting a terminal surface (see 
+        Surface.is_terminal()) end there, and do not appear in the next bundle
+        of the tree.
         """
+        if not isinstance(bundle, RayBundle):
+            return self._trace_chunks(bundle, reps, min_energy, tree, prng)
+        
         self.tree = RayTree()
         bund = bundle
         if tree is True:
@@ -131,7 +144,14 @@ class TracerEngine():
                     surfaces[surf_idx].done()
                     continue
                 surfaces[surf_idx].select_rays(N.nonzero(inters)[0])
-                new_outg = surfaces[surf_idx].get_outgoing()
+                if surfaces[surf_idx].is_terminal():
+                    # The optics manager accounts for the absorbed rays, and
+                    # they are not tracked any further.
+                    surfaces[surf_idx].get_outgoing(prng)
+                    surfaces[surf_idx].done()
+                    continue
+                
+                new_outg = surfaces[surf_idx].get_outgoing(prng)
                 new_record = new_outg
                 
                 # Fix parent indexing to refer to the full original bundle:
@@ -186,4 +206,24 @@ class TracerEngine():
             self.tree.append(record)
              
         return bund.get_vertices(), bund.get_directions()
+    
+    def _trace_chunks(self, bundles, reps, min_energy, tree, prng=None):
+        """
+        Trace each bundle out of an iterable, with the arguments of
+        ray_tracer(), so that only one bundle is in memory at a time. Optics
+        managers that accumulate hits (e.g. receivers) collect the hits from
+        all bundles.
+        
+        Returns:
+        the vertices and directions returned by ray_tracer() for all
+        bundles, concatenated.
+        """
+        verts = [N.empty((3,0))]
+        dirs = [N.empty((3,0))]
+        for chunk_idx, chunk in enumerate(bundles):
+            chunk_prng = None if prng is None else prng.spawn(chunk_idx)
+            v, d = self.ray_tracer(chunk, reps, min_energy, tree, chunk_prng)
+            verts.append(v)
+            dirs.append(d)
+        return N.hstack(verts), N.hstack(dirs)
 
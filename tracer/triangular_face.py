@@ -7,7 +7,9 @@
 # [2] http://softsurfer.com/Archive/algorithm_0105/algorithm_0105.htm
 
 import numpy as np
+from .geometry_manager import GeometryManager
 from .flat_surface import FiniteFlatGM
+from . import kernels
 
 class TriangularFace(FiniteFlatGM):
     """
@@ -36,8 +38,9 @@ class TriangularFace(FiniteFlatGM):
         """
         Register the working frame and ray bundle, calculate intersections
         and save the parametric locations of intersection on the surface.
-        plane intersection is done in the base class, triangle trimming done
-        here.
+        The plane intersection and the triangle trimming (using barycentric
+        coordinates, see [1, 2]) are done by the 'triangle_intersections'
+        kernel of tracer.kernels.
         
         In this class, global coordinates of intersection points
         are calculated and kept. _global is handled in select_rays().
@@ -51,25 +54,10 @@ class TriangularFace(FiniteFlatGM):
         A 1D array with the parametric position of intersection along each of
             the rays. Rays that missed the surface return +infinity.
         """
-        ray_prms = FiniteFlatGM.find_intersections(self, frame, ray_bundle)
-        
-        # Transform the charachteristic vertices to the global systenm, then
-        # project the global intersection points to get barycentric
-        # coordinates, see [1, 2]
-        glob_verts = np.dot(frame, np.vstack(( self._verts, np.array([1,1]) )) )
-        rel_glob = glob_verts[:3].T - frame[:3,3]
-        w = self._global.T - frame[:3,3]
-        
-        uv = np.dot(self._verts[:,0], self._verts[:,1])
-        rel_dots = np.dot(w, rel_glob.T)
-        norms_sq = np.sum(self._verts**2, axis=0)
-        
-        bc = (uv*rel_dots[:,::-1] - norms_sq[::-1]*rel_dots) / \
-            (uv**2 - norms_sq[0]*norms_sq[1])
-        
-        # Use barycentric coordinates for exclusion test.
-        outside = np.any(bc < 0, axis=1) | (bc.sum(axis=1) > 1)
-        ray_prms[outside] = np.inf
+        GeometryManager.find_intersections(self, frame, ray_bundle)
+        ray_prms, self._backside, self._global = \
+            kernels.get_kernel('triangle_intersections')(frame,
+            ray_bundle.get_vertices(), ray_bundle.get_directions(), self._verts)
         
         return ray_prms
         